@@ -0,0 +1,228 @@
+from __future__ import annotations
+from typing import Sequence
+from numbers import Real
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+numpy_available = np is not None
+"""Whether NumPy is installed. If it isn't, every BatchColliding function uses its pure Python path."""
+
+class BatchColliding:
+    """
+    Collision checks between many objects at once, with the same results as their equivalents in utilities.Colliding.
+
+    Positions and sizes are passed in as sequences of (x, y) pairs (e.g. lists of tuples or Verts) or as NumPy arrays
+    with shape (n, 2), which are fastest when using NumPy. Sizes may also be a single (x, y) pair used for every object,
+    and radii a sequence or a single number used for every circle.
+    \nFunctions that check many objects against one return a hit mask, a sequence with whether each object collides.
+    The *_pairs functions check every object in one group against every object in another, and return a list of
+    (index in first group, index in second group) for every pair that collides, sorted.
+    \nEvery function uses NumPy if it is installed, unless use_numpy is False.
+    """
+
+    # region Hit masks
+    @staticmethod
+    def square_square(squares_pos, squares_size, square_pos, square_size,
+                      use_numpy: bool | None = None) -> Sequence[bool]:
+        """Returns whether each square collides with the square at square_pos."""
+        (x, y), (w, h) = square_pos, square_size
+        if _use_numpy(use_numpy):
+            pos, size = _array(squares_pos), _array(squares_size, len(squares_pos))
+            return (pos[:, 0] + size[:, 0] > x) & (x > pos[:, 0] - w) & \
+                   (pos[:, 1] + size[:, 1] > y) & (y > pos[:, 1] - h)
+
+        return [px + pw > x > px - w and py + ph > y > py - h
+                for (px, py), (pw, ph) in zip(squares_pos, _repeat(squares_size, len(squares_pos)))]
+
+    @staticmethod
+    def circle_square(circles_pos, circles_rad, square_pos, square_size,
+                      use_numpy: bool | None = None) -> Sequence[bool]:
+        """Returns whether each circle collides with the square at square_pos."""
+        (x, y), (w, h) = square_pos, square_size
+        if _use_numpy(use_numpy):
+            pos = _array(circles_pos)
+            rad = np.broadcast_to(np.asarray(circles_rad, dtype=float), len(pos))
+            dist_squared = (pos[:, 0] - np.clip(pos[:, 0], x, x + w)) ** 2 + \
+                           (pos[:, 1] - np.clip(pos[:, 1], y, y + h)) ** 2
+            return np.where(rad > 0, dist_squared < rad * rad, (rad == 0) & (dist_squared == 0))
+
+        return [_circle_square(cx, cy, rad, x, y, w, h)
+                for (cx, cy), rad in zip(circles_pos, _repeat_radius(circles_rad, len(circles_pos)))]
+
+    @staticmethod
+    def point_square(points_pos, square_pos, square_size, use_numpy: bool | None = None) -> Sequence[bool]:
+        """Returns whether each point is inside (or on the edge of) the square at square_pos."""
+        (x, y), (w, h) = square_pos, square_size
+        if _use_numpy(use_numpy):
+            pos = _array(points_pos)
+            return (x <= pos[:, 0]) & (pos[:, 0] <= x + w) & (y <= pos[:, 1]) & (pos[:, 1] <= y + h)
+
+        return [x <= px <= x + w and y <= py <= y + h for px, py in points_pos]
+    # endregion
+
+    # region Index pairs
+    @staticmethod
+    def square_square_pairs(squares1_pos, squares1_size, squares2_pos, squares2_size,
+                            use_numpy: bool | None = None) -> list[tuple[int, int]]:
+        """Returns every pair of squares, one from each group, that collide."""
+        if _use_numpy(use_numpy):
+            pos1, size1 = _array(squares1_pos), _array(squares1_size, len(squares1_pos))
+            pos2, size2 = _array(squares2_pos), _array(squares2_size, len(squares2_pos))
+            i, j = _numpy_sweep(pos1[:, 0], pos1[:, 0] + size1[:, 0], pos2[:, 0], pos2[:, 0] + size2[:, 0])
+            (x1, y1), (w1, h1), (x2, y2), (w2, h2) = pos1[i].T, size1[i].T, pos2[j].T, size2[j].T
+            return _numpy_pairs(i, j, (x1 + w1 > x2) & (x2 > x1 - w2) & (y1 + h1 > y2) & (y2 > y1 - h2))
+
+        squares1_size = _repeat(squares1_size, len(squares1_pos))
+        squares2_size = _repeat(squares2_size, len(squares2_pos))
+        candidates = _sweep([x for x, _ in squares1_pos], [x + w for (x, _), (w, _) in zip(squares1_pos, squares1_size)],
+                            [x for x, _ in squares2_pos], [x + w for (x, _), (w, _) in zip(squares2_pos, squares2_size)])
+        pairs = []
+        for i, j in candidates:
+            (x1, y1), (w1, h1) = squares1_pos[i], squares1_size[i]
+            (x2, y2), (w2, h2) = squares2_pos[j], squares2_size[j]
+            if x1 + w1 > x2 > x1 - w2 and y1 + h1 > y2 > y1 - h2:
+                pairs.append((i, j))
+        return sorted(pairs)
+
+    @staticmethod
+    def circle_square_pairs(circles_pos, circles_rad, squares_pos, squares_size,
+                            use_numpy: bool | None = None) -> list[tuple[int, int]]:
+        """Returns every (circle index, square index) pair that collide."""
+        if _use_numpy(use_numpy):
+            circle_pos = _array(circles_pos)
+            circle_rad = np.broadcast_to(np.asarray(circles_rad, dtype=float), len(circle_pos))
+            square_pos, square_size = _array(squares_pos), _array(squares_size, len(squares_pos))
+            square_far = square_pos + square_size
+            i, j = _numpy_sweep(circle_pos[:, 0] - circle_rad, circle_pos[:, 0] + circle_rad,
+                                square_pos[:, 0], square_far[:, 0])
+            (cx, cy), rad = circle_pos[i].T, circle_rad[i]
+            dist_squared = (cx - np.clip(cx, square_pos[j, 0], square_far[j, 0])) ** 2 + \
+                           (cy - np.clip(cy, square_pos[j, 1], square_far[j, 1])) ** 2
+            return _numpy_pairs(i, j, np.where(rad > 0, dist_squared < rad * rad, (rad == 0) & (dist_squared == 0)))
+
+        circles_rad = _repeat_radius(circles_rad, len(circles_pos))
+        squares_size = _repeat(squares_size, len(squares_pos))
+        candidates = _sweep([x - rad for (x, _), rad in zip(circles_pos, circles_rad)],
+                            [x + rad for (x, _), rad in zip(circles_pos, circles_rad)],
+                            [x for x, _ in squares_pos], [x + w for (x, _), (w, _) in zip(squares_pos, squares_size)])
+        pairs = []
+        for i, j in candidates:
+            (cx, cy), (x, y), (w, h) = circles_pos[i], squares_pos[j], squares_size[j]
+            if _circle_square(cx, cy, circles_rad[i], x, y, w, h):
+                pairs.append((i, j))
+        return sorted(pairs)
+
+    @staticmethod
+    def point_square_pairs(points_pos, squares_pos, squares_size,
+                           use_numpy: bool | None = None) -> list[tuple[int, int]]:
+        """Returns every (point index, square index) pair where the point is inside (or on the edge of) the square."""
+        if _use_numpy(use_numpy):
+            point_pos = _array(points_pos)
+            square_pos, square_size = _array(squares_pos), _array(squares_size, len(squares_pos))
+            square_far = square_pos + square_size
+            i, j = _numpy_sweep(point_pos[:, 0], point_pos[:, 0], square_pos[:, 0], square_far[:, 0])
+            (px, py), (x1, y1), (x2, y2) = point_pos[i].T, square_pos[j].T, square_far[j].T
+            return _numpy_pairs(i, j, (x1 <= px) & (px <= x2) & (y1 <= py) & (py <= y2))
+
+        squares_size = _repeat(squares_size, len(squares_pos))
+        point_xs = [x for x, _ in points_pos]
+        candidates = _sweep(point_xs, point_xs,
+                            [x for x, _ in squares_pos], [x + w for (x, _), (w, _) in zip(squares_pos, squares_size)])
+        pairs = []
+        for i, j in candidates:
+            (px, py), (x, y), (w, h) = points_pos[i], squares_pos[j], squares_size[j]
+            if x <= px <= x + w and y <= py <= y + h:
+                pairs.append((i, j))
+        return sorted(pairs)
+    # endregion
+
+# region Helpers
+def _use_numpy(use_numpy: bool | None) -> bool:
+    if use_numpy and not numpy_available:
+        raise ImportError("NumPy is not installed")
+    return numpy_available if use_numpy is None else use_numpy
+
+def _array(values, length: int | None = None):
+    """Converts positions or sizes to a float NumPy array with shape (n, 2). A single pair is repeated length times."""
+    if length is not None:
+        values = _repeat(values, length)
+    if not isinstance(values, np.ndarray):
+        values = [tuple(value) for value in values]
+    return np.asarray(values, dtype=float).reshape(-1, 2)
+
+def _repeat(values, length: int) -> Sequence:
+    """Returns positions or sizes, or a list of values repeated length times if it is a single (x, y) pair."""
+    if len(values) == 2 and isinstance(values[0], Real):
+        return [values] * length
+    return values
+
+def _repeat_radius(radii, length: int) -> Sequence:
+    """Returns radii, or a list of radii repeated length times if it is a single number."""
+    if isinstance(radii, Real):
+        return [radii] * length
+    return radii
+
+def _circle_square(cx, cy, rad, x, y, w, h) -> bool:
+    dx = cx - min(max(cx, x), x + w)
+    dy = cy - min(max(cy, y), y + h)
+    if rad > 0:
+        return dx * dx + dy * dy < rad * rad
+    return rad == 0 and dx == 0 and dy == 0
+
+def _sweep(min_xs1: list[float], max_xs1: list[float],
+           min_xs2: list[float], max_xs2: list[float]) -> list[tuple[int, int]]:
+    """
+    Sweep and prune along the x axis. Returns every (index in first group, index in second group) pair whose x ranges
+    overlap, including ranges that only touch, so that callers can do the exact (strict or not) check themselves.
+    """
+    events = sorted([(min_x, 0, i) for i, min_x in enumerate(min_xs1)] +
+                    [(min_x, 1, j) for j, min_x in enumerate(min_xs2)])
+    max_xs = (max_xs1, max_xs2)
+    active: list[list[int]] = [[], []]
+    candidates = []
+    for min_x, group, index in events:
+        other_group = 1 - group
+        # Objects are reached in order of min x, so anything that ended before this one starts can't overlap anything
+        #  reached after it either
+        other_max_xs = max_xs[other_group]
+        other_active = active[other_group] = [other for other in active[other_group] if other_max_xs[other] >= min_x]
+        if group == 0:
+            candidates += [(index, other) for other in other_active]
+        else:
+            candidates += [(other, index) for other in other_active]
+        active[group].append(index)
+    return candidates
+
+def _numpy_sweep(min_xs1, max_xs1, min_xs2, max_xs2):
+    """
+    NumPy version of _sweep. Returns arrays of the first and second indices of every pair whose x ranges overlap.
+    \nObjects in the second group are sorted by min x, then each object in the first group takes the range of them that
+    start between (its min x - the widest object in the second group) and its max x. Works best when objects in the
+    second group are similar widths.
+    """
+    if not len(min_xs1) or not len(min_xs2):
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    order = np.argsort(min_xs2, kind="stable")
+    sorted_min_xs2 = min_xs2[order]
+    starts = np.searchsorted(sorted_min_xs2, min_xs1 - (max_xs2 - min_xs2).max(), "left")
+    ends = np.searchsorted(sorted_min_xs2, max_xs1, "right")
+    counts = np.maximum(ends - starts, 0)
+
+    # Expand every [start, end) range into one candidate each
+    i = np.repeat(np.arange(len(min_xs1)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = order[np.repeat(starts, counts) + offsets]
+
+    overlapping = max_xs2[j] >= min_xs1[i]
+    return i[overlapping], j[overlapping]
+
+def _numpy_pairs(i, j, colliding) -> list[tuple[int, int]]:
+    """Returns the sorted (i, j) pairs of candidates that are colliding."""
+    i, j = i[colliding], j[colliding]
+    order = np.lexsort((j, i))
+    return list(zip(i[order].tolist(), j[order].tolist()))
+# endregion
@@ -0,0 +1,94 @@
+"""
+Benchmarks BatchColliding's NumPy and pure Python paths against looping over utilities.Colliding, at 10, 100 and
+10,000 entities.
+
+Run from the repository root with ``python benchmarks/collision_benchmark.py``.
+"""
+import os
+import random
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "client")]
+
+from batch_colliding import BatchColliding, numpy_available
+from utilities import Colliding, Vert
+
+if numpy_available:
+    import numpy as np
+
+ENTITY_COUNTS = (10, 100, 10_000)
+ENTITY_SIZE = 10
+WORLD_AREA_PER_ENTITY = 50 * 50
+"""The world grows with the amount of entities, so each entity collides with about the same amount of others."""
+MAX_LOOPED_PAIRS = 1_000_000
+"""Looping over Colliding is skipped for pair checks with more pairs than this, as it would take minutes."""
+
+def time_function(function, min_time: float = 0.2) -> float:
+    """Returns the average time, in milliseconds, that function takes to run, running it for at least min_time seconds."""
+    runs, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time or runs < 3:
+        function()
+        runs += 1
+    return elapsed / runs * 1000
+
+def make_entities(count: int):
+    world_size = (count * WORLD_AREA_PER_ENTITY) ** 0.5
+    pos = [(random.uniform(0, world_size), random.uniform(0, world_size)) for _ in range(count)]
+    size = [(random.uniform(1, ENTITY_SIZE), random.uniform(1, ENTITY_SIZE)) for _ in range(count)]
+    return pos, size, [w / 2 for w, _ in size]
+
+def main():
+    random.seed(0)
+    paths = ["python"] + (["numpy"] if numpy_available else [])
+    if not numpy_available:
+        print("NumPy is not installed, only benchmarking the pure Python path.\n")
+    print(f"{'check':<24}{'entities':>10}{'Colliding loop':>18}" + "".join(f"{path:>14}" for path in paths))
+
+    for count in ENTITY_COUNTS:
+        pos, size, rad = make_entities(count)
+        other_pos, other_size, _ = make_entities(count)
+        pos_verts, size_verts = [Vert(p) for p in pos], [Vert(s) for s in size]
+        other_pos_verts, other_size_verts = [Vert(p) for p in other_pos], [Vert(s) for s in other_size]
+        target_pos, target_size = Vert(other_pos[0]), Vert(other_size[0])
+
+        # The NumPy path is given arrays, as a game using it would store its entities in them
+        arrays = {"python": (pos, size, rad, other_pos, other_size)}
+        if numpy_available:
+            arrays["numpy"] = tuple(np.array(values, dtype=float) for values in arrays["python"])
+
+        checks = {
+            "square mask": (
+                lambda: [Colliding.square_square(p, s, target_pos, target_size) for p, s in zip(pos_verts, size_verts)],
+                lambda p, s, r, op, os_, use_numpy: BatchColliding.square_square(p, s, target_pos, target_size,
+                                                                                 use_numpy)),
+            "square pairs": (
+                lambda: [(i, j) for i, (p, s) in enumerate(zip(pos_verts, size_verts))
+                         for j, (op, os_) in enumerate(zip(other_pos_verts, other_size_verts))
+                         if Colliding.square_square(p, s, op, os_)],
+                lambda p, s, r, op, os_, use_numpy: BatchColliding.square_square_pairs(p, s, op, os_, use_numpy)),
+            "circle square pairs": (
+                lambda: [(i, j) for i, (p, r) in enumerate(zip(pos_verts, rad))
+                         for j, (op, os_) in enumerate(zip(other_pos_verts, other_size_verts))
+                         if Colliding.circle_square(p, r, op, os_)],
+                lambda p, s, r, op, os_, use_numpy: BatchColliding.circle_square_pairs(p, r, op, os_, use_numpy)),
+            "point square pairs": (
+                lambda: [(i, j) for i, p in enumerate(pos_verts)
+                         for j, (op, os_) in enumerate(zip(other_pos_verts, other_size_verts))
+                         if Colliding.point_square(p, op, os_)],
+                lambda p, s, r, op, os_, use_numpy: BatchColliding.point_square_pairs(p, op, os_, use_numpy)),
+        }
+
+        for name, (looped, batched) in checks.items():
+            if "pairs" in name and count * count > MAX_LOOPED_PAIRS:
+                looped_result = "skipped"
+            else:
+                looped_result = f"{time_function(looped):.3f}ms"
+            row = f"{name:<24}{count:>10}{looped_result:>18}"
+            for path in paths:
+                row += f"{time_function(lambda: batched(*arrays[path], path == 'numpy')):>12.3f}ms"
+            print(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmarks the CPU cost and bytes saved by frame_compression on lobby and chat traffic: the messages a client gets
+while browsing lobbies, sitting in a lobby while others chat, and starting a game. Compares compressing each message on
+its own against one zlib stream per connection (what FrameEncoder does), at a few levels and thresholds, and checks
+that FrameDecoder gets every message back.
+
+Run from the repository root with ``python benchmarks/compression_benchmark.py``.
+"""
+import os
+import pickle
+import random
+import sys
+import time
+import zlib
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root]
+
+from shared_assets import Messages, Client, PongAssets
+from frame_compression import FrameEncoder, FrameDecoder
+
+WORDS = ("come", "play", "pong", "snake", "anyone", "lobby", "ready", "gg", "one", "more", "game", "start", "wait",
+         "brb", "lol", "nice", "rematch", "fast", "join", "here")
+
+def random_text(word_count: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(word_count))
+
+def get_lobby_info(lobby_id: int, include_chat: bool) -> Messages.LobbyInfo:
+    players = [(f"player{random.randint(0, 999)}", random.randint(0, 999)) for _ in range(random.randint(1, 6))]
+    return Messages.LobbyInfo(lobby_id, random_text(3).title(), players[0], players, random.choice(("pong", "snake")),
+                              10, False, [f"{players[0][0]}: {random_text(6)}" for _ in range(50)] if include_chat else None,
+                              PongAssets.Settings() if include_chat else None)
+
+def get_traffic() -> list[bytes]:
+    """Returns the pickled messages a client receives over a session, in order."""
+    random.seed(0)
+    lobbies = [get_lobby_info(i, False) for i in range(60)]
+    messages = []
+    # Browsing: the lobby list is resent whenever any lobby changes
+    for _ in range(40):
+        lobbies[random.randrange(len(lobbies))] = get_lobby_info(random.randrange(1000), False)
+        messages.append(Messages.LobbyListMessage(list(lobbies)))
+    # In a lobby: full lobby info on joining and on every settings change, and a chat message at a time
+    for i in range(200):
+        if i % 25 == 0:
+            messages.append(Messages.LobbyInfoMessage(get_lobby_info(7, True)))
+        messages.append(Messages.NewChatMessage(f"player{random.randint(0, 9)}: {random_text(random.randint(1, 10))}"))
+    clients = [Client(f"player{i}", i) for i in range(6)]
+    messages.append(Messages.GameStartedMessage(clients, clients[0], "pong"))
+    return [pickle.dumps(message) for message in messages]
+
+def run_separately(traffic: list[bytes], level: int) -> tuple[int, float]:
+    """Compresses each message on its own. Returns the total bytes and the seconds spent compressing and decompressing."""
+    total, start = 0, time.perf_counter()
+    for payload in traffic:
+        compressed = zlib.compress(payload, level)
+        assert zlib.decompress(compressed) == payload
+        total += len(compressed) + 5
+    return total, time.perf_counter() - start
+
+def run_streamed(traffic: list[bytes], level: int, threshold: int) -> tuple[int, float]:
+    encoder, decoder = FrameEncoder(threshold, level), FrameDecoder()
+    start = time.perf_counter()
+    frames = [encoder.encode(payload) for payload in traffic]
+    decoded = [payload for frame in frames for payload in decoder.feed(frame)]
+    elapsed = time.perf_counter() - start
+    assert decoded == traffic, "FrameDecoder didn't get every message back"
+    return encoder.bytes_out, elapsed
+
+def main():
+    traffic = get_traffic()
+    raw = sum(len(payload) for payload in traffic)
+    print(f"{len(traffic)} messages, {raw} bytes uncompressed "
+          f"({sum(len(p) < FrameEncoder.DEFAULT_THRESHOLD for p in traffic)} under the default threshold)\n")
+    print(f"{'method':<34}{'bytes':>10}{'saved':>8}{'cpu/message':>14}")
+
+    rows = [(f"zlib per message, level {level}", run_separately(traffic, level)) for level in (1, 6)]
+    rows += [(f"zlib stream, level {level}, threshold {threshold}", run_streamed(traffic, level, threshold))
+             for level in (1, 6, 9) for threshold in (0, FrameEncoder.DEFAULT_THRESHOLD, 512)]
+    for name, (total, elapsed) in rows:
+        print(f"{name:<34}{total:>10}{1 - total / raw:>8.1%}{elapsed / len(traffic) * 1_000_000:>12.1f}us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Runs two ends of a datagram_channel over UDP on localhost, dropping a share of every packet sent, and checks that
+reliable messages all arrive, in order and exactly once, while unreliable ones never arrive older than one already
+delivered on the same stream. Reports how long the reliable messages took to all arrive and how many packets were resent.
+
+Run from the repository root with ``python benchmarks/datagram_channel_check.py``.
+"""
+import os
+import socket
+import sys
+import time
+import _thread
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root]
+
+import datagram_channel
+from datagram_channel import DatagramPeer
+
+MESSAGES = 2000
+"""Amount of reliable and of unreliable messages to send."""
+SEND_INTERVAL = 0.0005
+LOSS_RATES = (0, 0.05, 0.2)
+TIMEOUT = 20
+
+def run(loss_rate: float) -> dict:
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(2)]
+    for sock in sockets:
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(DatagramPeer.RESEND_INTERVAL)
+    sender = DatagramPeer(sockets[0], sockets[1].getsockname(), 1)
+    receiver = DatagramPeer(sockets[1], sockets[0].getsockname(), 1)
+    sender.simulated_loss = receiver.simulated_loss = loss_rate
+
+    received = {"reliable": [], "unreliable": []}
+    running = [True]
+
+    def listen(peer: DatagramPeer, deliver: bool):
+        while running[0]:
+            try:
+                packet, _ = peer.socket.recvfrom(65536)
+            except socket.timeout:
+                packet = None
+            peer.resend_unacknowledged()
+            if packet and (parsed := datagram_channel.parse_packet(packet)):
+                kind, _, sequence, payload = parsed
+                for delivered in peer.receive(kind, sequence, payload):
+                    if deliver:
+                        received["reliable" if kind == datagram_channel.RELIABLE else "unreliable"].append(
+                            int.from_bytes(delivered, "big"))
+
+    _thread.start_new_thread(listen, (sender, False))
+    _thread.start_new_thread(listen, (receiver, True))
+
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        sender.send(i.to_bytes(4, "big"), True)
+        # Alternated between two streams, which mustn't make each other stale
+        sender.send(i.to_bytes(4, "big"), False, "odd" if i % 2 else "even")
+        time.sleep(SEND_INTERVAL)
+    while (len(received["reliable"]) < MESSAGES or sender.unacknowledged) and time.perf_counter() - start < TIMEOUT:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    running[0] = False
+    time.sleep(DatagramPeer.RESEND_INTERVAL * 2)
+    for sock in sockets:
+        sock.close()
+
+    assert received["reliable"] == list(range(MESSAGES)), "Reliable messages were lost, duplicated or out of order"
+    for parity in (0, 1):
+        stream = [i for i in received["unreliable"] if i % 2 == parity]
+        assert stream == sorted(set(stream)), "A stale unreliable message was delivered"
+    return {"time": elapsed, "unreliable": len(received["unreliable"]), "resent": sender.packets_resent,
+            "stale": receiver.stale_packets_dropped}
+
+def main():
+    print(f"{MESSAGES} reliable and {MESSAGES} unreliable messages over localhost\n")
+    print(f"{'loss':>6}{'all reliable in':>18}{'unreliable arrived':>20}{'resent':>9}{'stale dropped':>15}")
+    for loss_rate in LOSS_RATES:
+        result = run(loss_rate)
+        print(f"{loss_rate:>6.0%}{result['time']:>17.2f}s{result['unreliable']:>20}{result['resent']:>9}"
+              f"{result['stale']:>15}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Benchmarks the client's menus without a window, using SDL's dummy video driver: the title screen, the multiplayer menu
+with 10, 100 and 1000 lobbies, and a host's lobby room with a full chat. Times drawing each menu's gui, resize_elements,
+resizing the window, setting the lobby list and adding chat messages, and reports the percentiles of each in
+milliseconds, and how much each call allocates (from tracemalloc, in a separate pass so it doesn't slow the timings).
+
+Run from the repository root with ``python benchmarks/gui_benchmark.py [output.json]``, to also write the results as
+JSON.
+"""
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "client")]
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+# The client loads its images relative to its own directory
+starting_directory = os.getcwd()
+os.chdir(os.path.join(root, "client"))
+
+import pygame
+import client
+from client import TitleScreenMenu, MultiplayerMenu, HostLobbyRoom
+from shared_assets import Messages, PongAssets, max_chat_messages
+
+FRAMES = 200
+"""Times each operation is timed, for operations cheap enough to run every frame."""
+RESIZES = 40
+WINDOW_SIZES = ((600, 450), (1280, 720), (800, 600), (1920, 1080))
+LOBBY_COUNTS = (10, 100, 1000)
+MAX_WINDOW_RESIZE_LOBBIES = 100
+"""
+Window resizes are only measured with up to this many lobbies. With 1000, the first draw after each takes minutes, as
+every lobby's position is worked out from a bounding box over all of them.
+"""
+GAME_IDS = ("pong", "snake")
+
+class OfflineNetwork:
+    def __init__(self):
+        """Stands in for network.Network, so menus that send messages can be used without a server."""
+        self.client_id = 0
+
+    def send(self, message: Messages.Message):
+        return True
+
+def get_lobbies(count: int, update: int = 0) -> list[Messages.LobbyInfo]:
+    """Returns count synthetic lobbies. Lobbies get different players for each update, as they do while browsing."""
+    lobbies = []
+    for lobby_id in range(count):
+        random.seed(lobby_id * 1000 + update)
+        players = [(f"player{random.randrange(10_000)}", random.randrange(10_000)) for _ in range(random.randint(1, 4))]
+        lobbies.append(Messages.LobbyInfo(lobby_id, f"Lobby number {lobby_id}", players[0], players,
+                                          random.choice(GAME_IDS), 4))
+    return lobbies
+
+def time_calls(function, count: int) -> list[float]:
+    """Returns how long each of count calls to function took, in milliseconds."""
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        function(i)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def measure_allocations(function, count: int) -> tuple[float, float]:
+    """Returns the average amount of memory blocks each call leaves allocated, and the average peak KiB allocated."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    peak = 0
+    for i in range(count):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        function(i)
+        peak += tracemalloc.get_traced_memory()[1] - current
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return blocks / count, peak / count / 1024
+
+def set_window_size(size: tuple[int, int]):
+    client.canvas = pygame.display.set_mode(size, pygame.RESIZABLE)
+
+def get_operations() -> list[tuple[str, str, Callable[[int], None], int]]:
+    """Returns (menu, operation, function taking the call's index, call count) for everything to measure."""
+    operations = []
+
+    def add_menu_operations(menu_name: str, menu, scale: int = 1, resize_window: bool = True):
+        operations.append((menu_name, "draw", lambda _: menu.gui.draw(client.canvas), max(2, FRAMES // scale)))
+        operations.append((menu_name, "resize_elements", lambda _: menu.resize_elements(), max(2, RESIZES // scale)))
+        if not resize_window:
+            return
+
+        def resize_window(i: int):
+            set_window_size(WINDOW_SIZES[i % len(WINDOW_SIZES)])
+            menu.resize_elements()
+            menu.gui.draw(client.canvas)
+        operations.append((menu_name, "window resize", resize_window, max(2, RESIZES // scale)))
+
+    add_menu_operations("TitleScreenMenu", TitleScreenMenu())
+
+    for lobby_count in LOBBY_COUNTS:
+        menu_name = f"MultiplayerMenu ({lobby_count} lobbies)"
+        menu = MultiplayerMenu()
+        # Fewer calls with more lobbies, so the whole run takes minutes rather than hours
+        scale = max(1, lobby_count // 10)
+        lobby_updates = [get_lobbies(lobby_count, update) for update in range(max(2, RESIZES // scale))]
+
+        def set_lobbies(i: int, menu=menu, lobby_updates=lobby_updates):
+            # Every other call starts from an empty list, so both filling the list and updating it are measured
+            if i % 2 == 0:
+                menu.set_lobbies([])
+            menu.set_lobbies(lobby_updates[i])
+        operations.append((menu_name, "set_lobbies", set_lobbies, max(2, RESIZES // scale)))
+        add_menu_operations(menu_name, menu, scale, lobby_count <= MAX_WINDOW_RESIZE_LOBBIES)
+
+    lobby_room = HostLobbyRoom()
+    lobby_room.set_lobby_info(Messages.LobbyInfo(0, "Benchmark lobby", ("host", 0), [("host", 0), ("guest", 1)],
+                                                 "pong", 2, False, [], PongAssets.Settings()))
+    lobby_room.chat_container.active = True
+
+    def add_chat_message(i: int):
+        # As client.message_listener does for every NewChatMessage
+        lobby_room.chat_text.text += [f"<player{i % 7}> chat message number {i}, with a few more words"]
+        if len(lobby_room.chat_text.text) > max_chat_messages:
+            lobby_room.chat_text.text = lobby_room.chat_text.text[len(lobby_room.chat_text.text) - max_chat_messages:]
+        lobby_room.gui.draw(client.canvas)
+    operations.append(("HostLobbyRoom", "chat message + draw", add_chat_message, FRAMES))
+    add_menu_operations("HostLobbyRoom", lobby_room)
+    return operations
+
+def get_percentiles(times: list[float]) -> dict[str, float]:
+    times = sorted(times)
+    return {f"p{percentile}": times[min(len(times) - 1, int(len(times) * percentile / 100))]
+            for percentile in (50, 90, 99)} | {"max": times[-1]}
+
+def main():
+    output_path = os.path.join(starting_directory, sys.argv[1]) if len(sys.argv) > 1 else None
+    client.network = OfflineNetwork()
+    set_window_size(WINDOW_SIZES[0])
+
+    results = []
+    print(f"{'menu':<34}{'operation':<22}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'blocks/call':>13}"
+          f"{'peak KiB/call':>15}", flush=True)
+    for menu_name, operation, function, count in get_operations():
+        set_window_size(WINDOW_SIZES[0])
+        function(0)  # Once first, so caches filled on the first call don't count towards allocations
+        percentiles = get_percentiles(time_calls(function, count))
+        set_window_size(WINDOW_SIZES[0])
+        blocks, peak = measure_allocations(function, count)
+
+        results.append({"menu": menu_name, "operation": operation, "calls": count, **percentiles,
+                        "blocks_per_call": blocks, "peak_kib_per_call": peak})
+        print(f"{menu_name:<34}{operation:<22}" + "".join(f"{value:>10.3f}" for value in percentiles.values()) +
+              f"{blocks:>13.1f}{peak:>15.1f}", flush=True)
+
+    if output_path:
+        with open(output_path, "w") as file:
+            json.dump({"pygame": pygame.version.ver, "frames": FRAMES, "results": results}, file, indent=2)
+        print(f"\nResults written to {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Load tests a local server with headless bots, each using its own network.Network like a real client. Bots connect,
+browse the lobby list, create or join a lobby in groups, chat, start a Pong game and send paddle moves at a steady rate
+until the test ends.
+\nReports connect latency, round trip times (and one way relay times for paddle moves, which bots stamp with the time
+they were sent), messages per second each way, and the errors, kicks and disconnects bots got from the server.
+
+Start the server first, then run from the repository root with ``python benchmarks/load_test.py --bots 200``.
+"""
+import argparse
+import collections
+import os
+import random
+import socket
+import sys
+import time
+import _thread
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "client")]
+
+import console_log
+import shared_assets
+from shared_assets import Messages, PongAssets
+from network import Network
+
+class Stats:
+    def __init__(self):
+        """Results from every bot. Bots add to these from their own threads, so everything is behind one lock."""
+        self.lock = _thread.allocate_lock()
+        self.connect_times: list[float] = []
+        self.round_trip_times: dict[str, list[float]] = collections.defaultdict(list)
+        """Seconds between sending a request and getting its reply, by request name."""
+        self.messages_sent: collections.Counter[str] = collections.Counter()
+        self.messages_received: collections.Counter[str] = collections.Counter()
+        self.errors: collections.Counter[str] = collections.Counter()
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            self.round_trip_times[name].append(seconds)
+
+    def add_error(self, error: str):
+        with self.lock:
+            self.errors[error] += 1
+
+class Bot:
+    def __init__(self, index: int, stats: Stats, options: argparse.Namespace):
+        """
+        One simulated player. The first bot of every group of options.lobby_size creates a lobby and starts the game once
+        the rest of its group has joined.
+        """
+        self.index = index
+        self.stats = stats
+        self.options = options
+        self.username = f"bot{index}"
+        self.lobby_title = f"load test {index // options.lobby_size}"
+        self.is_host = index % options.lobby_size == 0
+        self.group_size = min(options.lobby_size, options.bots - index // options.lobby_size * options.lobby_size)
+
+        self.network: Network | None = None
+        self.running = True
+        self.lobby_id: int | None = None
+        self.players_in_lobby = 0
+        self.game_started = False
+        self.pending_requests: dict[str, collections.deque[float]] = collections.defaultdict(collections.deque)
+        """Times requests were sent, by the name of the reply they're waiting for, oldest first."""
+        self.pending_chat: dict[str, float] = {}
+        """Times chat messages were sent, by their text. Bots get their own chat back, so these are matched exactly."""
+
+    def run(self, end_time: float):
+        start = time.perf_counter()
+        try:
+            self.network = Network(use_udp=not self.options.no_udp, use_compression=not self.options.no_compression)
+        except OSError as err:
+            self.stats.add_error(f"connect failed: {repr(err)}")
+            return
+        self.stats.connect_times.append(time.perf_counter() - start)
+
+        _thread.start_new_thread(self.listen, ())
+        if self.network.datagram_peer is not None:
+            _thread.start_new_thread(self.listen_to_datagrams, ())
+
+        # Browse for a bit, as players do before picking a lobby
+        for _ in range(self.options.browse_count):
+            self.request(Messages.LobbyListRequest(), Messages.LobbyListMessage.name)
+            time.sleep(random.uniform(0.5, 1.5) * self.options.browse_interval)
+
+        if self.is_host:
+            settings = PongAssets.Settings()
+            settings.set_setting("max_players", self.group_size)
+            self.send(Messages.CreateLobbyMessage(self.username, self.lobby_title, settings))
+            self.players_in_lobby = 1
+        else:
+            while self.lobby_id is None and time.perf_counter() < end_time:
+                self.request(Messages.LobbyListRequest(), Messages.LobbyListMessage.name)
+                time.sleep(0.25)
+            if self.lobby_id is None:
+                self.stats.add_error("never found lobby to join")
+                return self.stop()
+            self.request(Messages.JoinLobbyMessage(self.lobby_id, self.username), Messages.LobbyInfoMessage.name)
+
+        next_chat_time = time.perf_counter() + random.uniform(0, self.options.chat_interval)
+        next_paddle_time = time.perf_counter()
+        while time.perf_counter() < end_time and self.running:
+            current_time = time.perf_counter()
+            if self.is_host and not self.game_started and self.players_in_lobby >= self.group_size and \
+                    not self.pending_requests[Messages.GameStartedMessage.name]:
+                # Picked now rather than on creating the lobby, as the server may handle messages sent together out of
+                #  order, and this needs the lobby to exist. It's handled long before the game starts, as that waits
+                #  for every player to reply to the GameStartedMessage.
+                self.send(Messages.ChangeLobbySettingsMessage(game_id=PongAssets.game_id))
+                self.request(Messages.StartGameMessage(), Messages.GameStartedMessage.name)
+
+            if self.game_started:
+                if current_time >= next_paddle_time:
+                    # Stamped with the time sent, so whoever it is relayed to can tell how long it took
+                    self.send(Messages.GameDataMessage(PongAssets.Messages.PaddleMove(current_time)))
+                    next_paddle_time += 1 / self.options.paddle_rate
+            elif current_time >= next_chat_time:
+                text = f"hello from {self.username} at {current_time:.6f}"
+                self.pending_chat[f"<{self.username}> {text}"] = current_time
+                self.send(Messages.NewChatMessage(text))
+                next_chat_time = current_time + random.uniform(0.5, 1.5) * self.options.chat_interval
+
+            time.sleep(min(0.005, 1 / self.options.paddle_rate / 2))
+        self.stop()
+
+    def stop(self):
+        if self.running and self.network is not None:
+            self.running = False
+            self.send(Messages.DisconnectMessage())
+            time.sleep(0.1)
+            self.network.client.close()
+        self.running = False
+
+    def send(self, message: Messages.Message):
+        if self.network.send(message):
+            with self.stats.lock:
+                self.stats.messages_sent[self.get_name(message)] += 1
+        elif self.running:
+            self.stats.add_error(f"failed to send {message.name}")
+
+    def request(self, message: Messages.Message, reply_name: str):
+        self.pending_requests[reply_name].append(time.perf_counter())
+        self.send(message)
+
+    def listen(self):
+        while self.running:
+            messages = self.network.recv()
+            if not isinstance(messages, list):
+                # recv() returns a lone ErrorMessage when the connection fails
+                if self.running:
+                    self.stats.add_error(f"connection error: {repr(messages.error)}")
+                    self.running = False
+                return
+            for message in messages:
+                self.handle_message(message)
+
+    def listen_to_datagrams(self):
+        while self.running:
+            for message in self.network.recv_datagrams():
+                self.handle_message(message)
+        # Closed here rather than in stop(), as closing it while it is being received from is reported as an error
+        self.network.datagram_peer.socket.close()
+
+    def handle_message(self, message: Messages.Message):
+        received_time = time.perf_counter()
+        with self.stats.lock:
+            self.stats.messages_received[self.get_name(message)] += 1
+
+        if (pending := self.pending_requests.get(message.name)) and pending:
+            # Lobby lists are also sent unprompted when lobbies change, so their times may be slightly low
+            self.stats.add_time(self.get_request_name(message.name), received_time - pending.popleft())
+
+        if isinstance(message, Messages.LobbyListMessage):
+            if self.lobby_id is None and not self.is_host:
+                for lobby_info in message.lobbies:
+                    if lobby_info.lobby_title == self.lobby_title:
+                        self.lobby_id = lobby_info.lobby_id
+        elif isinstance(message, Messages.LobbyInfoMessage):
+            self.players_in_lobby = len(message.lobby_info.players)
+        elif isinstance(message, Messages.NewChatMessage):
+            if (sent_time := self.pending_chat.pop(message.message, None)) is not None:
+                self.stats.add_time("chat", received_time - sent_time)
+        elif isinstance(message, Messages.GameStartedMessage):
+            self.game_started = True
+            self.send(Messages.GameInitializedMessage())
+        elif isinstance(message, Messages.GameDataMessage):
+            if isinstance(message.data, PongAssets.Messages.PaddleMove):
+                self.stats.add_time("paddle move relay (one way)", received_time - message.data.paddle_y)
+        elif isinstance(message, Messages.KickedFromLobbyMessage):
+            self.stats.add_error(f"kicked from lobby: {message.reason}")
+        elif isinstance(message, Messages.ErrorMessage):
+            self.stats.add_error(f"error message: {repr(message.error)}")
+
+    @staticmethod
+    def get_name(message: Messages.Message) -> str:
+        if isinstance(message, Messages.GameDataMessage):
+            return f"{message.name} ({type(message.data).__name__})"
+        return message.name
+
+    @staticmethod
+    def get_request_name(reply_name: str) -> str:
+        return {Messages.LobbyListMessage.name: "lobby list request",
+                Messages.LobbyInfoMessage.name: "join lobby",
+                Messages.GameStartedMessage.name: "start game"}[reply_name]
+
+def get_percentiles(values: list[float]) -> str:
+    values = sorted(values)
+    return "".join(f"{values[min(len(values) - 1, int(len(values) * percentile))] * 1000:>10.2f}"
+                   for percentile in (0.5, 0.9, 0.99)) + f"{values[-1] * 1000:>10.2f}"
+
+def server_is_running() -> bool:
+    try:
+        socket.create_connection(("localhost", shared_assets.port), timeout=1).close()
+    except OSError:
+        return False
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1], formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--bots", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30, help="seconds from the first bot connecting")
+    parser.add_argument("--connect-rate", type=float, default=50, help="bots started per second")
+    parser.add_argument("--lobby-size", type=int, default=2)
+    parser.add_argument("--browse-count", type=int, default=3, help="lobby list requests before joining a lobby")
+    parser.add_argument("--browse-interval", type=float, default=1)
+    parser.add_argument("--chat-interval", type=float, default=2, help="seconds between chat messages in a lobby")
+    parser.add_argument("--paddle-rate", type=float, default=30, help="paddle moves sent per second in a game")
+    parser.add_argument("--no-udp", action="store_true")
+    parser.add_argument("--no-compression", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="log every bot's connection and messages")
+    options = parser.parse_args()
+
+    if not options.verbose:
+        console_log.minimum_level = console_log.WARNING
+    if not server_is_running():
+        print(f"No server found on port {shared_assets.port}. Start server/server.py first.")
+        return
+
+    stats = Stats()
+    bots = [Bot(i, stats, options) for i in range(options.bots)]
+    start = time.perf_counter()
+    end_time = start + options.duration
+    for i, bot in enumerate(bots):
+        _thread.start_new_thread(bot.run, (end_time,))
+        time.sleep(max(0.0, start + (i + 1) / options.connect_rate - time.perf_counter()))
+    while time.perf_counter() < end_time + 1 or any(bot.running for bot in bots) and time.perf_counter() < end_time + 5:
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - start
+    console_log.flush()
+
+    print(f"\n{len(stats.connect_times)}/{options.bots} bots connected over {elapsed:.1f}s "
+          f"({'TCP' if options.no_udp else 'TCP + UDP'}, {'uncompressed' if options.no_compression else 'compressed'})\n")
+    print(f"{'milliseconds':<32}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, values in [("connect", stats.connect_times), *sorted(stats.round_trip_times.items())]:
+        if values:
+            print(f"{name:<32}{len(values):>8}{get_percentiles(values)}")
+
+    print(f"\n{'messages per second':<48}{'sent':>10}{'received':>10}")
+    for name in sorted(stats.messages_sent.keys() | stats.messages_received.keys()):
+        print(f"{name:<48}{stats.messages_sent[name] / elapsed:>10.1f}{stats.messages_received[name] / elapsed:>10.1f}")
+    print(f"{'total':<48}{sum(stats.messages_sent.values()) / elapsed:>10.1f}"
+          f"{sum(stats.messages_received.values()) / elapsed:>10.1f}")
+
+    print(f"\n{sum(stats.errors.values())} errors" + (":" if stats.errors else ""))
+    for error, count in stats.errors.most_common():
+        print(f"{count:>8}  {error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Checks that lockstep simulations stay in sync: runs a server's and a client's SnakeSimulation in-process for 10,000
+ticks, feeding both the same LockstepMessages.Ticks (pickled, as they would be over the network), and asserts their
+state hashes match at every checksum and at the end. Games are restarted with a new seed whenever one ends.
+
+Run from the repository root with ``python benchmarks/lockstep_determinism.py``.
+"""
+import os
+import pickle
+import random
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root]
+
+from shared_assets import LockstepMessages
+from snake_engine import SnakeSimulation, UP, LEFT
+
+TICKS = 10_000
+CHECKSUM_INTERVAL = 20
+BOARD_SIZE = (30, 30)
+PLAYER_IDS = (3, 8, 1, 5)
+INPUT_CHANCE = 0.2
+"""Chance of each player sending an input each tick."""
+LEAVE_CHANCE = 0.001
+"""Chance of a player leaving each tick."""
+
+def main():
+    random.seed(0)
+    seed = 0
+    server_simulation = client_simulation = None
+    games = checksums = 0
+    start = time.perf_counter()
+
+    for tick_number in range(1, TICKS + 1):
+        if server_simulation is None or server_simulation.is_over:
+            seed += 1
+            games += 1
+            server_simulation = SnakeSimulation(*BOARD_SIZE, PLAYER_IDS, seed, food_count=3)
+            client_simulation = SnakeSimulation(*BOARD_SIZE, PLAYER_IDS, seed, food_count=3)
+
+        inputs = []
+        for player_id in PLAYER_IDS:
+            if random.random() < LEAVE_CHANCE:
+                inputs.append((player_id, LockstepMessages.PlayerLeft()))
+            elif random.random() < INPUT_CHANCE:
+                inputs.append((player_id, random.randint(UP, LEFT)))
+        tick = LockstepMessages.Tick(tick_number, inputs)
+
+        tick.apply_to(server_simulation)
+        pickle.loads(pickle.dumps(tick)).apply_to(client_simulation)
+
+        if tick_number % CHECKSUM_INTERVAL == 0:
+            checksums += 1
+            assert server_simulation.get_state_hash() == client_simulation.get_state_hash(), \
+                f"Simulations desynced at tick {tick_number}"
+
+    elapsed = time.perf_counter() - start
+    assert server_simulation.get_state_hash() == client_simulation.get_state_hash(), "Simulations desynced at the end"
+    assert server_simulation.board == client_simulation.board
+    print(f"{TICKS} ticks over {games} games, {checksums} checksums matched")
+    print(f"{elapsed / TICKS / 2 * 1_000_000:.1f}us per simulation tick")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Benchmarks the server's message handling by calling server.process_message directly, with in-memory connections that
+count what would have been sent instead of sending it. Scenarios:
+\n- join_leave_churn: players joining and leaving lobbies while 200 idle clients browse the lobby list.
+\n- chat_in_10_player_lobby: chat messages broadcast to everyone in a full lobby.
+\n- lobby_settings_storm: a host changing its lobby's title and game settings while its lobby and 200 idle clients watch.
+\n- lobby_list_fanout: send_lobbies_to_each_client with 1000 idle clients and 200 lobbies.
+\n- spectator_fanout: a 2 player Snake game's state sent to 500 spectators.
+\nEach is run a few times, and the median run is reported: messages handled per second, messages and bytes sent per
+second, and the same rates including the time for every send buffer to be written out. Results are written as JSON (to
+server_benchmark.json by default), and compared to an earlier results file if one is given.
+
+Run from the repository root with ``python benchmarks/server_benchmark.py [output.json] [--compare earlier.json]``.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "server")]
+
+import console_log
+import metrics
+import server
+from server import ConnectedClient, Lobby, Server
+from server_assets import SnakeServer
+from shared_assets import Messages, PongAssets, SnakeAssets
+
+REPEATS = 3
+DEFAULT_OUTPUT = "server_benchmark.json"
+
+class FakeConnection:
+    def __init__(self):
+        """Stands in for a client's socket, counting the bytes sent to it."""
+        self.bytes_received = 0
+
+    def sendall(self, data: bytes):
+        self.bytes_received += len(data)
+
+    def shutdown(self, how: int):
+        ...
+
+    def close(self):
+        ...
+
+def reset_server():
+    for client in list(server.clients_connected.values()):
+        client.send_buffer.close()
+    server.clients_connected.clear()
+    server.clients_listening_to.clear()
+    server.lobbies.clear()
+
+def add_clients(amount: int) -> list[ConnectedClient]:
+    clients = []
+    for _ in range(amount):
+        client_id = len(server.clients_connected)
+        client = ConnectedClient(client_id, FakeConnection(), ("benchmark", client_id), f"player{client_id}")
+        client.connected = True
+        server.clients_connected[client_id] = client
+        server.clients_listening_to.append(client_id)
+        clients.append(client)
+    return clients
+
+def add_lobby(players: list[ConnectedClient], title: str) -> Lobby:
+    server.process_message(Messages.CreateLobbyMessage(players[0].username, title, PongAssets.Settings()), players[0])
+    lobby = players[0].lobby_in
+    for player in players[1:]:
+        server.process_message(Messages.JoinLobbyMessage(lobby.lobby_id, player.username), player)
+    return lobby
+
+# region Scenarios
+# Each sets up the server, and returns the (message, client) pairs to handle, or a function to call instead that
+#  returns how many broadcasts it made
+def join_leave_churn():
+    add_clients(200)
+    hosts = add_clients(20)
+    lobbies = [add_lobby([host], f"lobby {i}") for i, host in enumerate(hosts)]
+    players = add_clients(20)
+    messages = []
+    for i in range(5):
+        for j, player in enumerate(players):
+            lobby = lobbies[(i + j) % len(lobbies)]
+            messages.append((Messages.JoinLobbyMessage(lobby.lobby_id, player.username), player))
+        messages += [(Messages.LeaveLobbyMessage(), player) for player in players]
+    return messages
+
+def chat_in_10_player_lobby():
+    players = add_clients(10)
+    add_lobby(players, "chat")
+    return [(Messages.NewChatMessage(f"message {i} from {players[i % 10].username}"), players[i % 10])
+            for i in range(2000)]
+
+def lobby_settings_storm():
+    add_clients(200)
+    players = add_clients(10)
+    add_lobby(players, "settings")
+    messages = []
+    for i in range(200):
+        if i % 2:
+            message = Messages.ChangeLobbySettingsMessage(lobby_title=f"settings {i}")
+        else:
+            settings = PongAssets.Settings()
+            settings.set_setting("allow_teacher_mode", bool(i % 4))
+            message = Messages.ChangeLobbySettingsMessage(game_settings=settings)
+        messages.append((message, players[0]))
+    return messages
+
+def lobby_list_fanout():
+    # Lobbies are added directly, as creating each with a message would send the growing list to every idle client
+    for i, host in enumerate(add_clients(200)):
+        server.lobbies[Lobby.available_lobby_id] = host.lobby_in = Lobby(host, PongAssets.Settings(), f"lobby {i}")
+    add_clients(1000)
+
+    def broadcast() -> int:
+        for _ in range(3):
+            server.send_lobbies_to_each_client()
+        return 3
+    return broadcast
+
+def spectator_fanout():
+    players = add_clients(2)
+    server.process_message(Messages.CreateLobbyMessage(players[0].username, "spectated", SnakeAssets.Settings()),
+                           players[0])
+    lobby = players[0].lobby_in
+    server.process_message(Messages.JoinLobbyMessage(lobby.lobby_id, players[1].username), players[1])
+    lobby.game_selected_id = SnakeAssets.game_id
+    # Created directly, rather than with Lobby.start_game, so no threads run the game while it is measured
+    lobby.current_game = game = SnakeServer(server.server, lobby.game_settings, lobby.player_clients,
+                                            lobby.host_client, lambda: None)
+    for spectator in add_clients(500):
+        server.process_message(Messages.JoinLobbyMessage(lobby.lobby_id, spectator.username, spectate=True), spectator)
+
+    def broadcast() -> int:
+        for _ in range(20):
+            game.on_frame_private()
+            game.spectator_states.append((0, game.get_spectator_state()))
+            game.send_due_spectator_state()
+        game.stop()
+        return 20
+    return broadcast
+# endregion
+
+SCENARIOS = (join_leave_churn, chat_in_10_player_lobby, lobby_settings_storm, lobby_list_fanout, spectator_fanout)
+
+def get_sent_totals() -> tuple[float, float]:
+    return sum(metrics.messages_sent.values.values()), sum(metrics.bytes_sent.values.values())
+
+def wait_for_send_buffers():
+    while any(client.send_buffer.queue for client in list(server.clients_connected.values())):
+        time.sleep(0.001)
+
+def run(scenario) -> dict[str, float]:
+    reset_server()
+    work = scenario()
+    wait_for_send_buffers()
+    sent_before, bytes_before = get_sent_totals()
+
+    start = time.perf_counter()
+    if callable(work):
+        handled = work()
+    else:
+        for message, client in work:
+            server.process_message(message, client)
+        handled = len(work)
+    handling_time = time.perf_counter() - start
+    wait_for_send_buffers()
+    total_time = time.perf_counter() - start
+
+    sent_after, bytes_after = get_sent_totals()
+    sent, sent_bytes = sent_after - sent_before, bytes_after - bytes_before
+    return {
+        "messages_handled": handled,
+        "handled_per_second": handled / handling_time,
+        "messages_sent": sent,
+        "sent_per_second": sent / handling_time,
+        "bytes_sent_per_second": sent_bytes / handling_time,
+        "sent_per_second_including_writes": sent / total_time,
+        "handling_seconds": handling_time,
+        "seconds_including_writes": total_time,
+        "dropped_messages": sum(sum(client.send_buffer.dropped_messages.values())
+                                for client in server.clients_connected.values())
+    }
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def main():
+    arguments = sys.argv[1:]
+    compare_path = None
+    if "--compare" in arguments:
+        index = arguments.index("--compare")
+        compare_path = arguments[index + 1]
+        del arguments[index:index + 2]
+    output_path = arguments[0] if arguments else DEFAULT_OUTPUT
+
+    # Handled as the server would, but logged nowhere, so the console doesn't set the pace
+    console_log.output = open(os.devnull, "w")
+    server.server = Server.__new__(Server)
+    server.server.compression = None
+    server.server.datagram_socket = None
+
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeats": REPEATS,
+        "scenarios": {}
+    }
+    earlier = None
+    if compare_path:
+        with open(compare_path) as file:
+            earlier = json.load(file)["scenarios"]
+
+    print(f"{'scenario':<26}{'handled/s':>12}{'sent/s':>12}{'sent/s (written)':>18}{'MB sent/s':>11}{'change':>9}")
+    for scenario in SCENARIOS:
+        runs = sorted((run(scenario) for _ in range(REPEATS)), key=lambda result: result["seconds_including_writes"])
+        result = results["scenarios"][scenario.__name__] = runs[len(runs) // 2]
+        result["sent_per_second_spread"] = statistics.pstdev(r["sent_per_second"] for r in runs) / result["sent_per_second"]
+
+        change = ""
+        if earlier and scenario.__name__ in earlier:
+            change = f"{result['sent_per_second'] / earlier[scenario.__name__]['sent_per_second'] - 1:+.1%}"
+        print(f"{scenario.__name__:<26}{result['handled_per_second']:>12.1f}{result['sent_per_second']:>12.0f}"
+              f"{result['sent_per_second_including_writes']:>18.0f}{result['bytes_sent_per_second'] / 1e6:>11.2f}"
+              f"{change:>9}")
+    reset_server()
+
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults written to {output_path}")
+
+if __name__ == "__main__":
+    main()
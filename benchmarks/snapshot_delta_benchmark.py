@@ -0,0 +1,90 @@
+"""
+Reports the bytes per tick sent to each client by server_assets.SnapshotEncoder, with and without deltas, for a
+Pong-like game state broadcast every tick. Runs with different amounts of packet loss (lost snapshots are never
+acknowledged, so later ones fall back to older baselines or full snapshots), and checks every snapshot a client
+receives decodes to the state the server sent.
+
+Run from the repository root with ``python benchmarks/snapshot_delta_benchmark.py``.
+"""
+import math
+import os
+import random
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "server")]
+
+from shared_assets import SnapshotMessages
+from server_assets import SnapshotEncoder
+
+TICKS = 600
+CLIENT_COUNT = 4
+ACK_DELAY = 2
+"""Ticks between a client receiving a snapshot and the server getting its acknowledgement."""
+LOSS_RATES = (0, 0.05, 0.2, 0.5)
+QUANTIZATION = {"ball_pos": 1 / 8, "ball_vel": 1 / 64, "paddle_ys": 1 / 4}
+
+def get_state(tick: int) -> dict:
+    """A Pong-like state: the ball moves every tick, paddles move some of the time and the score rarely changes."""
+    paddle_ys = tuple(250 + 200 * math.sin(tick / (20 + 7 * i)) if (tick // 30 + i) % 2 else 250 for i in range(2))
+    return {
+        "ball_pos": (500 + 400 * math.sin(tick / 37), 300 + 250 * math.sin(tick / 23)),
+        "ball_vel": (400 / 37 * math.cos(tick / 37), 250 / 23 * math.cos(tick / 23)),
+        "paddle_ys": paddle_ys,
+        "scores": (tick // 200, tick // 250),
+        "player_names": ("player one", "player two"),
+        "paused": False
+    }
+
+def run(loss_rate: float) -> tuple[float, float, float]:
+    """Returns the average bytes per tick per client with and without deltas, and the encoding time per tick in ms."""
+    random.seed(0)
+    encoder = SnapshotEncoder(QUANTIZATION, measure_bytes=True)
+    # Fed the same snapshots and acknowledgements as encoder, to time encoding without measuring sizes
+    timed_encoder = SnapshotEncoder(QUANTIZATION)
+    client_snapshots = [{} for _ in range(CLIENT_COUNT)]
+    pending_acks: list[tuple[int, int, int]] = []
+    encode_time = 0
+
+    for tick in range(TICKS):
+        state = get_state(tick)
+        expected = SnapshotMessages.dequantize(SnapshotMessages.quantize(state, QUANTIZATION), QUANTIZATION)
+
+        start = time.perf_counter()
+        timed_encoder.add_snapshot(state)
+        for client_id in range(CLIENT_COUNT):
+            timed_encoder.encode_for(client_id)
+        encode_time += time.perf_counter() - start
+        encoder.add_snapshot(state)
+        snapshots = [encoder.encode_for(client_id) for client_id in range(CLIENT_COUNT)]
+
+        for client_id, snapshot in enumerate(snapshots):
+            received = client_snapshots[client_id]
+            if random.random() < loss_rate or \
+                    (snapshot.baseline_id is not None and snapshot.baseline_id not in received):
+                continue
+            received[snapshot.snapshot_id] = snapshot.apply_to(received.get(snapshot.baseline_id))
+            assert SnapshotMessages.dequantize(received[snapshot.snapshot_id], QUANTIZATION) == expected, \
+                f"Client {client_id} decoded snapshot {snapshot.snapshot_id} wrong"
+            pending_acks.append((tick + ACK_DELAY, client_id, snapshot.snapshot_id))
+
+        for ack in [ack for ack in pending_acks if ack[0] <= tick]:
+            pending_acks.remove(ack)
+            encoder.on_ack(ack[1], ack[2])
+            timed_encoder.on_ack(ack[1], ack[2])
+
+    report = encoder.get_bytes_report().values()
+    return (sum(delta for delta, _ in report) / CLIENT_COUNT, sum(full for _, full in report) / CLIENT_COUNT,
+            encode_time / TICKS * 1000)
+
+def main():
+    print(f"{TICKS} ticks, {CLIENT_COUNT} clients, acknowledgements arrive {ACK_DELAY} ticks later\n")
+    print(f"{'loss':>6}{'full bytes/tick':>18}{'delta bytes/tick':>19}{'saved':>8}{'encode/tick':>14}")
+    for loss_rate in LOSS_RATES:
+        delta_bytes, full_bytes, encode_time = run(loss_rate)
+        print(f"{loss_rate:>6.0%}{full_bytes:>18.1f}{delta_bytes:>19.1f}{1 - delta_bytes / full_bytes:>8.0%}"
+              f"{encode_time:>12.3f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmarks a frame of moving entities with SpatialHash (move every entity, then find every colliding pair), against
+checking every pair with utilities.Colliding. The time per entity should stay about the same as the amount of entities
+grows, while checking every pair grows linearly with it.
+
+Run from the repository root with ``python benchmarks/spatial_hash_benchmark.py``.
+"""
+import os
+import random
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "client")]
+
+from spatial_hash import SpatialHash
+from utilities import Colliding, Vert
+
+ENTITY_COUNTS = (250, 500, 1000, 2000, 4000, 8000)
+ENTITY_SIZE = 10
+ENTITY_SPEED = 3
+WORLD_AREA_PER_ENTITY = 40 * 40
+"""The world grows with the amount of entities, so each entity collides with about the same amount of others."""
+FRAMES = 30
+MAX_PAIRWISE_ENTITIES = 1000
+"""Checking every pair is skipped above this many entities, as it would take minutes."""
+
+class Entity:
+    def __init__(self, world_size: float):
+        self.pos = [random.uniform(0, world_size), random.uniform(0, world_size)]
+        self.size = (random.uniform(2, ENTITY_SIZE), random.uniform(2, ENTITY_SIZE))
+        self.vel = (random.uniform(-ENTITY_SPEED, ENTITY_SPEED), random.uniform(-ENTITY_SPEED, ENTITY_SPEED))
+
+    def update(self, world_size: float):
+        # Wrap around the edges of the world so the density stays the same
+        self.pos[0] = (self.pos[0] + self.vel[0]) % world_size
+        self.pos[1] = (self.pos[1] + self.vel[1]) % world_size
+
+def run_spatial_hash(entities: list[Entity], world_size: float) -> tuple[float, int]:
+    """Returns the average time per frame in milliseconds, and the amount of pairs found in the last frame."""
+    spatial_hash = SpatialHash(ENTITY_SIZE * 2)
+    for entity in entities:
+        spatial_hash.insert(entity, entity.pos, entity.size)
+
+    pairs = []
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        for entity in entities:
+            entity.update(world_size)
+            spatial_hash.move(entity, entity.pos)
+        pairs = spatial_hash.get_colliding_pairs()
+    return (time.perf_counter() - start) / FRAMES * 1000, len(pairs)
+
+def run_pairwise(entities: list[Entity], world_size: float) -> tuple[float, int]:
+    pairs = []
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        for entity in entities:
+            entity.update(world_size)
+        verts = [(Vert(entity.pos), Vert(entity.size)) for entity in entities]
+        pairs = [(i, j) for i in range(len(verts)) for j in range(i + 1, len(verts))
+                 if Colliding.square_square(*verts[i], *verts[j])]
+    return (time.perf_counter() - start) / FRAMES * 1000, len(pairs)
+
+def main():
+    print(f"{'entities':>10}{'spatial hash':>16}{'per entity':>14}{'pairs':>8}{'every pair':>16}{'per entity':>14}")
+    for count in ENTITY_COUNTS:
+        world_size = (count * WORLD_AREA_PER_ENTITY) ** 0.5
+        random.seed(count)
+        hash_time, hash_pairs = run_spatial_hash([Entity(world_size) for _ in range(count)], world_size)
+        row = f"{count:>10}{hash_time:>14.2f}ms{hash_time / count * 1000:>12.2f}us{hash_pairs:>8}"
+
+        if count <= MAX_PAIRWISE_ENTITIES:
+            random.seed(count)
+            pairwise_time, pairwise_pairs = run_pairwise([Entity(world_size) for _ in range(count)], world_size)
+            assert pairwise_pairs == hash_pairs, "SpatialHash found a different amount of pairs"
+            row += f"{pairwise_time:>14.2f}ms{pairwise_time / count * 1000:>12.2f}us"
+        else:
+            row += f"{'skipped':>16}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Microbenchmarks comparing the slot based Vec2/IVec2 to the list based Vert/IVert.
+
+Run from the repository root with ``python benchmarks/vec2_benchmark.py``.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "client"))
+
+from utilities import Vert, IVert, Vec2, IVec2
+
+NUMBER = 200_000
+"""Amount of times each statement is run per repeat."""
+REPEAT = 5
+
+# Each benchmark is run once for every vertex type, with {v} replaced by the type's name
+benchmarks = {
+    "construct from values": "{v}(3, 4)",
+    "construct from vertex": "{v}(a)",
+    "add": "a + b",
+    "subtract": "a - b",
+    "multiply by vertex": "a * b",
+    "multiply by number": "a * 1.5",
+    "divide by number": "a / 2",
+    "in-place add": "c += b",  # IVert and IVec2 have no in-place operators, so this is c = c + b for them
+    "equality": "a == b",
+    "component access": "a.x + a.y",
+    "index access": "a[0] + a[1]",
+    "draw pos (a * n + b)": "a * 1.5 + {v}(0, 20)",
+}
+
+def run_benchmark(statement: str, vert_type: type) -> float:
+    """Returns the fastest time, in nanoseconds, that statement took to run once."""
+    setup = f"a = {vert_type.__name__}(3, 4)\nb = {vert_type.__name__}(5.5, 6.5)\nc = {vert_type.__name__}(0, 0)"
+    timer = timeit.Timer(statement.format(v=vert_type.__name__), setup=setup, globals=globals())
+    return min(timer.repeat(repeat=REPEAT, number=NUMBER)) / NUMBER * 1e9
+
+def main():
+    pairs = ((Vert, Vec2), (IVert, IVec2))
+    print(f"{'benchmark':<24}" + "".join(f"{old.__name__ + ' -> ' + new.__name__:>30}" for old, new in pairs))
+    for name, statement in benchmarks.items():
+        row = f"{name:<24}"
+        for old_type, new_type in pairs:
+            old_time, new_time = run_benchmark(statement, old_type), run_benchmark(statement, new_type)
+            row += f"{f'{old_time:.0f}ns -> {new_time:.0f}ns ({old_time / new_time:.1f}x)':>30}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,9 @@ from __future__ import annotations
 import time
 import pygame
 from abc import ABC, abstractmethod
+import collections
 import copy
+import functools
 import _thread
 import random
 from typing import Type, Callable, Union
@@ -11,9 +13,11 @@ from client_assets import game_datas_by_id, selectable_games, GameData, get_butt
 import shared_assets
 from shared_assets import Messages, max_chat_messages, Client
 from games import Game
-from gui import Gui, GuiMouseEventHandler, get_auto_center_function, GuiKeyboardEventHandler
+from gui import Gui, GuiMouseEventHandler, get_auto_center_function, GuiKeyboardEventHandler, DirtyRectRenderer
+from frame_profiler import FrameProfiler
 from network import Network
 from utilities import Vert
+import console_log
 
 _ = shared_assets
 
@@ -35,6 +39,8 @@ pygame.init()
 canvas = pygame.display.set_mode((600, 450), pygame.RESIZABLE)
 pygame.display.set_caption("Online games and all that jazz.")
 clock = pygame.time.Clock()
+frame_rate_limit = 60
+"""The most frames drawn per second, or 0 for no limit. Games update at their own fixed rate (Game.update_rate) regardless."""
 canvas_active = True
 network: Network | None = None
 listening_for_messages = False
@@ -66,6 +72,17 @@ def get_default_username():
         ...
     return default_username
 
+def batch_layout(func: Callable) -> Callable:
+    """
+    Decorator for Menu methods that move or resize elements of the menu's gui. Runs the method inside a
+    Gui.batch_layout of self.gui, so each bounding box is only recalculated once when it finishes.
+    """
+    @functools.wraps(func)
+    def wrapper(self: Menu, *args, **kwargs):
+        with Gui.batch_layout(self.gui):
+            return func(self, *args, **kwargs)
+    return wrapper
+
 class Menu(ABC):
 
     @staticmethod
@@ -122,7 +139,7 @@ class ConnectingMenu(Menu):
 
         self.connecting_to_server_text = "Connecting to Server"
         self.text = self.gui.add_element(Gui.Text(
-            self.connecting_to_server_text, on_draw_before=cycle_ellipsis
+            self.connecting_to_server_text, on_draw_before=cycle_ellipsis, animated=True
         ))
         self.trying_again_text = self.gui.add_element(Gui.Text(
             "Could not connect to server, trying again...", active=False
@@ -131,6 +148,7 @@ class ConnectingMenu(Menu):
     def load_next_menu(self):
         Menus.set_active_menu(self.menu_being_loaded)
 
+    @batch_layout
     def resize_elements(self):
         canvas_size = Vert(canvas.get_size())
         canvas_scale = canvas_size / Vert(600, 400)
@@ -199,6 +217,7 @@ class TitleScreenMenu(Menu):
 
         self.gui.add_element(*self.button_list, self.game_title)
 
+    @batch_layout
     def resize_elements(self):
         canvas_size = Vert(canvas.get_size())
         # element_scale = min(canvas_size.x / 600, canvas_size.y / 450)
@@ -247,6 +266,7 @@ class OptionsMenu(Menu):
 
         self.gui.add_element(self.keybinds_button, self.default_lobby_title_input, self.options_back_button)
 
+    @batch_layout
     def resize_elements(self):
         canvas_size = Vert(canvas.get_size())
         canvas_scale = canvas_size / Vert(600, 450)
@@ -285,7 +305,9 @@ class MultiplayerMenu(Menu):
                 else:
                     element.col = Colors.lobby_list_element_default_color
 
+            # Each lobby element is made of many elements that rarely change, so draw it all at once from a cached surface
             self.list_gui_element = Gui.Rect(col=Colors.lobby_list_element_default_color,
+                                             cache_surface=True,
                                              on_mouse_down=on_mouse_down,
                                              on_mouse_up=on_mouse_up,
                                              on_mouse_over=on_mouse_over,
@@ -337,6 +359,8 @@ class MultiplayerMenu(Menu):
             self.game_id = value.game_id
             self.players = value.players
             self.max_players = value.max_players
+            self.in_game = value.in_game
+            self._lobby_info.spectators = value.spectators
 
         @property
         def lobby_title(self):
@@ -383,8 +407,12 @@ class MultiplayerMenu(Menu):
 
         @player_count.setter
         def player_count(self, value):
-            self.player_count_element.text = f"{value}/{self.max_players}" if self.max_players is not None else \
-                f"{value}"
+            self.player_count_element.text = self.get_player_count_text()
+
+        def get_player_count_text(self) -> str:
+            player_count_text = f"{self.player_count}/{self.max_players}" if self.max_players is not None else \
+                f"{self.player_count}"
+            return f"{player_count_text} (in game)" if self.in_game else player_count_text
 
         @property
         def players(self):
@@ -410,8 +438,22 @@ class MultiplayerMenu(Menu):
             if value == self._lobby_info.max_players:
                 return
             self._lobby_info.max_players = value
-            self.player_count_element.text = f"{self.player_count}/{value}" \
-                if self.max_players is not None else f"{self.player_count}"
+            self.player_count_element.text = self.get_player_count_text()
+
+        @property
+        def in_game(self):
+            return bool(self._lobby_info.in_game)
+
+        @in_game.setter
+        def in_game(self, value):
+            if value == self._lobby_info.in_game:
+                return
+            self._lobby_info.in_game = value
+            self.player_count_element.text = self.get_player_count_text()
+
+        @property
+        def spectator_count(self):
+            return len(self._lobby_info.spectators or ())
 
         @property
         def lobby_id(self):
@@ -436,7 +478,11 @@ class MultiplayerMenu(Menu):
                                                          Menus.lobby_room_menu.game_selected.settings))
                 self.selected_lobby = None
             elif element is self.join_lobby_button:
-                if self.selected_lobby and self.selected_lobby.player_count < self.selected_lobby.max_players:
+                if self.selected_lobby and self.selected_lobby.in_game:
+                    # Stays on this menu until the server sends the game to watch, or why it can't be watched
+                    network.send(Messages.JoinLobbyMessage(self.selected_lobby.lobby_id, username, spectate=True))
+                    self.selected_lobby = None
+                elif self.selected_lobby and self.selected_lobby.player_count < self.selected_lobby.max_players:
                     Menus.lobby_room_menu = MemberLobbyRoom()
                     Menus.set_active_menu(Menus.lobby_room_menu)
                     network.send(Messages.JoinLobbyMessage(self.selected_lobby.lobby_id, username))
@@ -503,12 +549,16 @@ class MultiplayerMenu(Menu):
         self.connected_lobbies: list[MultiplayerMenu.ConnectedLobby] = []
         self._selected_lobby: MultiplayerMenu.ConnectedLobby | None = None
 
+    @batch_layout
     def set_lobby_info(self, lobby: ConnectedLobby):
         self.lobby_title.text = lobby.lobby_title
         self.host.text = f"Host: {lobby.host_name}"
         self.game_title.text = f"Game: {game_datas_by_id[lobby.game_id].title}"
         self.player_list_title.text = f"Players: " + (f"{lobby.player_count}/{lobby.max_players}" if
                                                       lobby.max_players is not None else f"{lobby.player_count}")
+        if lobby.in_game:
+            self.player_list_title.text += f", {lobby.spectator_count} watching"
+        self.join_lobby_button.contents[0].text = "Spectate" if lobby.in_game else "Join Lobby"
         self.game_image.image = game_datas_by_id[lobby.game_id].image
 
         self.resize_lobby_info_elements(False)
@@ -540,7 +590,9 @@ class MultiplayerMenu(Menu):
             self._selected_lobby.set_selected(True)
         else:
             self.lobby_info_inside_wrapper.active = False
+            self.join_lobby_button.contents[0].text = "Join Lobby"
 
+    @batch_layout
     def set_lobbies(self, lobbies: list[Messages.LobbyInfo]):
         connected_lobbies_by_id = {lobby.lobby_id: lobby for lobby in self.connected_lobbies}
         incoming_lobbies_by_id = {lobby.lobby_id: lobby for lobby in lobbies}
@@ -573,6 +625,7 @@ class MultiplayerMenu(Menu):
 
         self.resize_lobby_list_elements()
 
+    @batch_layout
     def resize_lobby_list_elements(self):
         if len(self.connected_lobbies) == 0:
             return
@@ -608,6 +661,7 @@ class MultiplayerMenu(Menu):
                     min(lobby.text_container.size.x * 0.2 / lobby.player_count_element.size_per_font_size.x,
                         lobby.text_container.size.y * 0.45 / lobby.player_count_element.size_per_font_size.y)
 
+    @batch_layout
     def resize_lobby_info_player_list(self):
         if self.player_list_title.text:
             self.player_list_title.font_size = min(self.lobby_info.size.y / 10, self.lobby_info.size.x / 8)
@@ -640,6 +694,7 @@ class MultiplayerMenu(Menu):
                 circle.pos = text.pos - Vert(left_padding / 2, 0)
                 circle.rad = min(max_font_size * 0.2, left_padding / 3)
 
+    @batch_layout
     def resize_lobby_info_elements(self, resize_player_list=True):
         self.game_image.size = Vert(1, 1) * min(self.lobby_info.size.x / 2, self.lobby_info.size.y / 2)
 
@@ -660,6 +715,7 @@ class MultiplayerMenu(Menu):
         if resize_player_list:
             self.resize_lobby_info_player_list()
 
+    @batch_layout
     def resize_elements(self):
         canvas_size = Vert(canvas.get_size())
 
@@ -901,6 +957,7 @@ class LobbyRoom(Menu):
     def host_id(self, value):
         self._host_id = value
 
+    @batch_layout
     def set_lobby_info(self, lobby_info: Messages.LobbyInfo):
         game_changed = False
 
@@ -1004,6 +1061,7 @@ class LobbyRoom(Menu):
     def game_selected(self, value):
         self.set_game_selected(value)
 
+    @batch_layout
     def resize_game_settings(self):
         setting_height = min(self.game_settings_container.size.y / len(self.game_setting_containers),
                              self.game_settings_container.size.x * 0.15)
@@ -1011,6 +1069,7 @@ class LobbyRoom(Menu):
             container.size = Vert(self.game_settings_container.size.x, setting_height)
             container.pos = Vert(0, i * setting_height)
 
+    @batch_layout
     def resize_player_list_elements(self):
         if len(self.player_list) == 0:
             return
@@ -1033,18 +1092,21 @@ class LobbyRoom(Menu):
                     min(player.list_gui_element.size.x * 0.45 / player.status_text_element.size_per_font_size.x,
                         player.list_gui_element.size.y * 0.3 / player.status_text_element.size_per_font_size.y)
 
+    @batch_layout
     def resize_game_select_text(self):
         if self.game_select_text.text:
             self.game_select_text.font_size = \
                 min(self.game_select_text_container.size.x * 0.9 / self.game_select_text.size_per_font_size.x,
                     self.game_select_text_container.size.y * 0.75 / self.game_select_text.size_per_font_size.y)
 
+    @batch_layout
     def resize_game_start_text(self):
         if self.game_start_button_text.text:
             self.game_start_button_text.font_size = \
                 min(self.game_start_button.size.x * 0.8 / self.game_start_button_text.size_per_font_size.x,
                     self.game_start_button.size.y * 0.75 / self.game_start_button_text.size_per_font_size.y)
 
+    @batch_layout
     def resize_elements(self):
         canvas_size = Vert(canvas.get_size())
         canvas_scale = canvas_size / Vert(600, 450)
@@ -1454,6 +1516,7 @@ class HostLobbyRoom(LobbyRoom):
 
         self.set_player_action_buttons_grayed()
 
+    @batch_layout
     def resize_game_settings(self):
         super().resize_game_settings()
         for i, elements in enumerate(self.setting_element_contents):
@@ -1469,6 +1532,7 @@ class HostLobbyRoom(LobbyRoom):
 
             setting_input.resize_element(setting_input_container.size)
 
+    @batch_layout
     def resize_elements(self):
         # TODO: Resizing everything individually can be laggy as heck (recalculating bounding boxes every time)
 
@@ -1567,6 +1631,7 @@ class MemberLobbyRoom(LobbyRoom):
         else:
             self.toggle_private_button_text.text = "Lobby Open"
 
+    @batch_layout
     def resize_lobby_title_text(self):
         if self.lobby_title_text.text:
             self.lobby_title_text.font_size = \
@@ -1586,18 +1651,21 @@ class MemberLobbyRoom(LobbyRoom):
             if not GameHandler.current_game:
                 Menus.set_active_menu(Menus.lobby_room_menu)
 
+    @batch_layout
     def set_lobby_info(self, lobby_info: Messages.LobbyInfo):
         old_lobby_title_text = self.lobby_title_text.text
         super().set_lobby_info(lobby_info)
         if old_lobby_title_text != self.lobby_title_text.text:
             self.resize_lobby_title_text()
 
+    @batch_layout
     def resize_game_settings(self):
         super().resize_game_settings()
         for i, setting_text in enumerate(self.setting_text):
             setting_text.font_size = min(self.game_setting_containers[i].size.y * 0.6,
                                          self.game_setting_containers[i].size.x * 0.9 / setting_text.size_per_font_size.x)
 
+    @batch_layout
     def resize_elements(self):
         # TODO: Resizing everything individually can be laggy as heck (recalculating bounding boxes every time)
 
@@ -1655,6 +1723,7 @@ class GameHandler:
 
     @classmethod
     def start_game(cls, game_data: GameData, clients: list[Client], host_client: Client):
+        """Starts a game of game_data. If this client isn't one of clients, it only watches (see Game.spectating)."""
         def on_game_leave():
             cls.end_game(False)
             network.send(Messages.LeaveLobbyMessage())
@@ -1669,7 +1738,7 @@ class GameHandler:
                                                     game_data.settings,
                                                     clients,
                                                     host_client,
-                                                    Client(network.client_id, username),
+                                                    Client(username, network.client_id),
                                                     cls.end_game,
                                                     on_game_leave,
                                                     get_all_keys_down,
@@ -1746,117 +1815,240 @@ class GameHandler:
 
 Menus.set_active_menu(Menus.title_screen_menu)
 
+renderer = DirtyRectRenderer(Colors.background_color)
+"""Draws the active menu, only repainting what has changed. Toggle its repainted area overlay with F3."""
+updated_rects: list[pygame.Rect] | None = None
+"""The rects drawn over in the last call to on_frame. None if the whole canvas needs to be updated."""
+profiler = FrameProfiler()
+"""Times each part of every frame. Toggle its overlay with F4, and dump the latest frames as a Chrome trace with F5."""
+frame_trace_path = "frame_trace.json"
+
+message_inbox: collections.deque[Messages.Message] = collections.deque()
+"""
+Messages received from the server that haven't been handled yet, oldest first. The listener threads append to it, and
+the main loop takes from it, so messages are handled in order, and never while a frame is being drawn.
+"""
+class ServerDisconnectedMessage(Messages.Message):
+    """Added to message_inbox by on_server_disconnect, so the disconnect is handled on the main loop."""
+    name = "server_disconnected"
+
+    def __init__(self, disconnected_network: Network | None):
+        self.network = disconnected_network
+        """The network that lost the server. Once it's been replaced, later reports of it are ignored."""
+
+message_budget_seconds = 0.004
+"""
+How long each frame may spend handling messages before leaving the rest for the next frame. At least one message is
+handled every frame, however long it takes.
+"""
+
 def message_listener():
-    """Function to listen to and handle incoming messages from the server."""
+    """Function to listen to incoming messages from the server, adding them to message_inbox to be handled by the main loop."""
     global listening_for_messages
     listening_for_messages = True
 
-    print("Now listening for messages...")
+    console_log.info("Now listening for messages...")
 
-    def handle_message(message):
-        if message.name == Messages.GameDataMessage.name:
-            if GameHandler.current_game:
-                GameHandler.current_game.on_data_received(message.data)
-        elif message.name == Messages.ErrorMessage.name:
-            if isinstance(message.error, ConnectionResetError):
-                # Called on server disconnect
-                listening_for_messages = False
-                return
-        elif message.name == Messages.LobbyListMessage.name:
+    def datagram_listener():
+        # Added in the order the channel delivers them
+        while True:
+            # network may be replaced by the main loop at any time
+            current_network = network
+            if current_network is None or current_network.datagram_peer is None:
+                time.sleep(0.5)
+                continue
+            message_inbox.extend(current_network.recv_datagrams())
+
+    _thread.start_new_thread(datagram_listener, ())
+
+    while True:
+        current_network = network
+        if current_network is None:
+            # Reconnecting after the server disconnected
+            time.sleep(0.5)
+            continue
+        incoming_data = current_network.recv()
+        if isinstance(incoming_data, list):
+            message_inbox.extend(incoming_data)
+        else:
+            # recv() returns a lone ErrorMessage when receiving fails, which it may keep doing until reconnected
+            message_inbox.append(incoming_data)
+            time.sleep(0.1)
+
+def handle_messages(time_budget: float):
+    """Handles messages from message_inbox in the order they arrived, until it is empty or time_budget seconds have passed."""
+    end_time = time.perf_counter() + time_budget
+    while message_inbox:
+        message = message_inbox.popleft()
+        with profiler.scope("network message"):
+            handle_message(message)
+        if time.perf_counter() >= end_time:
+            break
+
+def handle_message(message: Messages.Message):
+    """Applies a message from the server to the active menu or game. Only call from the main loop."""
+    if message.name == Messages.GameDataMessage.name:
+        if GameHandler.current_game:
+            GameHandler.current_game.on_data_received_private(message.data)
+    elif message.name == Messages.ErrorMessage.name:
+        # Already logged by the network. Server disconnects are handled by on_server_disconnect.
+        ...
+    elif message.name == ServerDisconnectedMessage.name:
+        handle_server_disconnect(message.network)
+    elif message.name == Messages.LobbyListMessage.name:
+        if isinstance(Menus.menu_active, MultiplayerMenu):
+            Menus.multiplayer_menu.set_lobbies(message.lobbies)
+    elif message.name == Messages.LobbyInfoMessage.name:
+        if isinstance(Menus.menu_active, LobbyRoom):
+            # If the player is in a lobby, set the currently active lobby's info
+            Menus.menu_active.set_lobby_info(message.lobby_info)
+        elif GameHandler.current_game and Menus.lobby_room_menu:
+            # If the player is in a game but there is still an instance of a lobby menu stored, set that lobby's info
+            Menus.lobby_room_menu.set_lobby_info(message.lobby_info)
+    elif message.name == Messages.KickedFromLobbyMessage.name:
+        Menus.set_active_menu(Menus.multiplayer_menu)
+    elif message.name == Messages.NewChatMessage.name:
+        if isinstance(Menus.menu_active, LobbyRoom):
+            Menus.menu_active.chat_text.text += [message.message]
+            if len(Menus.menu_active.chat_text.text) > max_chat_messages:
+                Menus.menu_active.chat_text.text = \
+                    Menus.menu_active.chat_text.text[len(Menus.menu_active.chat_text.text) - max_chat_messages:]
+            if not Menus.menu_active.chat_container.active:
+                Menus.menu_active.chat_notification.active = True
+    elif message.name == Messages.StartGameStartTimerMessage.name:
+        if isinstance(Menus.menu_active, LobbyRoom):
+            Menus.menu_active.time_of_start_button_click = message.start_time
+    elif message.name == Messages.GameStartedMessage.name:
+        if message.spectating:
+            # Spectators join from the multiplayer menu, and the game's server doesn't wait for them
             if isinstance(Menus.menu_active, MultiplayerMenu):
-                Menus.multiplayer_menu.set_lobbies(message.lobbies)
-        elif message.name == Messages.LobbyInfoMessage.name:
-            if isinstance(Menus.menu_active, LobbyRoom):
-                # If the player is in a lobby, set the currently active lobby's info
-                Menus.menu_active.set_lobby_info(message.lobby_info)
-            elif GameHandler.current_game and Menus.lobby_room_menu:
-                # If the player is in a game but there is still an instance of a lobby menu stored, set that lobby's info
-                Menus.lobby_room_menu.set_lobby_info(message.lobby_info)
-        elif message.name == Messages.KickedFromLobbyMessage.name:
+                game_data = game_datas_by_id[message.game_id]()
+                game_data.settings = message.settings
+                GameHandler.start_game(game_data, message.clients, message.host_client)
+        elif isinstance(Menus.menu_active, LobbyRoom):
+            GameHandler.start_game(Menus.menu_active.game_selected, message.clients, message.host_client)
+            network.send(Messages.GameInitializedMessage())
+    elif message.name == Messages.GameOverMessage.name:
+        if GameHandler.current_game and GameHandler.current_game.spectating:
+            # Spectators aren't in the lobby, so go back to the lobby list
+            GameHandler.end_game(False)
             Menus.set_active_menu(Menus.multiplayer_menu)
-        elif message.name == Messages.NewChatMessage.name:
-            if isinstance(Menus.menu_active, LobbyRoom):
-                Menus.menu_active.chat_text.text += [message.message]
-                if len(Menus.menu_active.chat_text.text) > max_chat_messages:
-                    Menus.menu_active.chat_text.text = \
-                        Menus.menu_active.chat_text.text[len(Menus.menu_active.chat_text.text) - max_chat_messages:]
-                if not Menus.menu_active.chat_container.active:
-                    Menus.menu_active.chat_notification.active = True
-        elif message.name == Messages.StartGameStartTimerMessage.name:
-            if isinstance(Menus.menu_active, LobbyRoom):
-                Menus.menu_active.time_of_start_button_click = message.start_time
-        elif message.name == Messages.GameStartedMessage.name:
-            if isinstance(Menus.menu_active, LobbyRoom):
-                GameHandler.start_game(Menus.menu_active.game_selected, message.clients, message.host_client)
-                network.send(Messages.GameInitializedMessage())
-        elif message.name == Messages.GameOverMessage.name:
+        elif GameHandler.current_game:
             GameHandler.end_game()
 
-    while True:
-        incoming_data = network.recv()
-        for message_to_handle in incoming_data:
-            _thread.start_new_thread(handle_message, (message_to_handle,))
-
 
 def on_frame():
     """Function to be called every frame. Handles drawing and per-frame functionality."""
     global canvas_resize_request
     global canvas
+    global updated_rects
+
+    updated_rects = None
+
+    # Handled before anything is drawn, so each frame shows every message handled so far
+    handle_messages(message_budget_seconds)
 
     if canvas_resize_request:
-        canvas_resize_request_copy, canvas_resize_request = canvas_resize_request, None
-        canvas = pygame.display.set_mode(canvas_resize_request_copy[0],
-                                         pygame.RESIZABLE if canvas_resize_request_copy[1] else 0)
-        if Menus.menu_active:
-            Menus.menu_active.resize_elements()
-        if canvas_resize_request_copy[2]:
-            canvas_resize_request_copy[2]()
+        with profiler.scope("canvas resize"):
+            canvas_resize_request_copy, canvas_resize_request = canvas_resize_request, None
+            canvas = pygame.display.set_mode(canvas_resize_request_copy[0],
+                                             pygame.RESIZABLE if canvas_resize_request_copy[1] else 0)
+            if Menus.menu_active:
+                Menus.menu_active.resize_elements()
+            if canvas_resize_request_copy[2]:
+                canvas_resize_request_copy[2]()
 
     if GameHandler.current_game:
-        GameHandler.current_game.on_frame()
+        # Games draw over the whole canvas every frame
+        renderer.invalidate_all()
+        with profiler.scope("game on_frame"):
+            GameHandler.current_game.on_frame_private()
         if GameHandler.current_game.gui:
-            GameHandler.current_game.gui.draw(canvas)
-        GameHandler.mouse_event_handler.main(GameHandler.current_game.gui)
+            with profiler.scope("gui draw"):
+                GameHandler.current_game.gui.draw(canvas)
+        with profiler.scope("mouse handlers"):
+            GameHandler.mouse_event_handler.main(GameHandler.current_game.gui)
         if GameHandler.current_game:
-            GameHandler.keyboard_event_handler.main(GameHandler.current_game.gui)
+            with profiler.scope("keyboard handlers"):
+                GameHandler.keyboard_event_handler.main(GameHandler.current_game.gui)
 
     if isinstance(Menus.menu_active, LobbyRoom):
         Menus.menu_active.update_countdown()
 
     if Menus.menu_active:
-        canvas.fill(Colors.background_color)
-        Menus.menu_active.gui.draw(canvas)
+        with profiler.scope("gui draw"):
+            updated_rects = renderer.render(canvas, Menus.menu_active.gui)
 
-        Menus.mouse_event_handler.main(Menus.menu_active.gui)
+        with profiler.scope("mouse handlers"):
+            Menus.mouse_event_handler.main(Menus.menu_active.gui)
         # Must use extra if statement, as calling the mouse event handler may change the active menu (and potentially make it None)
         if Menus.menu_active:
-            Menus.keyboard_event_handler.main(Menus.menu_active.gui)
+            with profiler.scope("keyboard handlers"):
+                Menus.keyboard_event_handler.main(Menus.menu_active.gui)
+
+    if overlay_rect := profiler.draw_overlay(canvas):
+        if updated_rects is not None:
+            updated_rects = updated_rects + [overlay_rect]
+
+def get_active_event_handlers() -> tuple[GuiKeyboardEventHandler, GuiMouseEventHandler]:
+    """Returns the keyboard and mouse event handlers that pygame events should currently be sent to."""
+    if GameHandler.current_game:
+        return GameHandler.keyboard_event_handler, GameHandler.mouse_event_handler
+    return Menus.keyboard_event_handler, Menus.mouse_event_handler
 
 def main():
     """Handles pygame loop and pygame events."""
     global canvas_active
 
+    active_event_handlers = get_active_event_handlers()
     while canvas_active:
-        for event in pygame.event.get():
-            Menus.keyboard_event_handler.handle_pygame_keyboard_event(event)
-            GameHandler.keyboard_event_handler.handle_pygame_keyboard_event(event)
-            if event.type == pygame.QUIT:
-                canvas_active = False
-            elif event.type == pygame.WINDOWRESIZED:
-                if Menus.menu_active:
-                    Menus.menu_active.resize_elements()
-                if GameHandler.current_game:
-                    GameHandler.current_game.resize_menu_button()
-                    GameHandler.current_game.resize_menu()
-                    GameHandler.current_game.on_window_resize()
+        profiler.begin_frame()
+        if (event_handlers := get_active_event_handlers()) != active_event_handlers:
+            # Inputs held when switching would otherwise never be released, as their events go to the new handlers.
+            #  This also updates the new mouse handler's mouse position, which isn't tracked while it is inactive.
+            for event_handler in active_event_handlers + event_handlers:
+                event_handler.release_all()
+            active_event_handlers = event_handlers
+
+        with profiler.scope("events"):
+            for event in pygame.event.get():
+                for event_handler in active_event_handlers:
+                    event_handler.handle_pygame_event(event)
+                if event.type == pygame.QUIT:
+                    canvas_active = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    renderer.show_stats = not renderer.show_stats
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                    profiler.show_overlay = not profiler.show_overlay
+                    if not profiler.show_overlay:
+                        renderer.invalidate_all()
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F5:
+                    frame_count = profiler.dump_chrome_trace(frame_trace_path)
+                    console_log.info(f"Wrote the last {frame_count} frames to {frame_trace_path}")
+                elif event.type == pygame.WINDOWRESIZED:
+                    with profiler.scope("window resize"):
+                        if Menus.menu_active:
+                            Menus.menu_active.resize_elements()
+                        if GameHandler.current_game:
+                            GameHandler.current_game.resize_menu_button()
+                            GameHandler.current_game.resize_menu()
+                            GameHandler.current_game.on_window_resize()
 
         on_frame()
 
-        clock.tick(60)
-        pygame.display.flip()
+        # Timed separately, as this is mostly waiting for the next frame
+        with profiler.scope("clock tick"):
+            clock.tick(frame_rate_limit)
+        with profiler.scope("display update"):
+            if updated_rects is None:
+                pygame.display.flip()
+            elif updated_rects:
+                pygame.display.update(updated_rects)
+        profiler.end_frame()
 
     if network:
         network.send(Messages.DisconnectMessage())
+    console_log.flush()
 
 
 canvas_resize_request: tuple[tuple[int, int], bool, Union[Callable, None]] | None = None
@@ -1871,8 +2063,17 @@ def on_server_not_found():
         Menus.menu_active.resize_elements()
 
 def on_server_disconnect():
-    """Function to be called when the network can no longer find a server. Resets the menu to the title screen and attempts to reconnect."""
+    """
+    Function to be called when the network can no longer find a server, from any thread. Queues the disconnect to be
+    handled by the main loop.
+    """
+    message_inbox.append(ServerDisconnectedMessage(network))
+
+def handle_server_disconnect(disconnected_network: Network | None):
+    """Resets the menu to the title screen and attempts to reconnect, unless the network has already been replaced."""
     global network
+    if disconnected_network is None or disconnected_network is not network:
+        return
 
     Menus.set_active_menu(Menus.title_screen_menu)
     GameHandler.current_game = None
@@ -169,7 +169,6 @@ class GameData:
     title: str = "No Game Selected"
     window_size: tuple[int, int] | None = None
     image: pygame.Surface = pygame.image.load("assets/none_icon.png")
-    # TODO: allow_spectators = False
 
     game_class: Type[games.Game] = games.Game
     asset_class: Type[shared_assets.GameAssets] = shared_assets.GameAssets
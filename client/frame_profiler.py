@@ -0,0 +1,200 @@
+from __future__ import annotations
+import collections
+import json
+import os
+import time
+import _thread
+
+import pygame
+
+from utilities import Colors
+
+class FrameProfiler:
+    MAX_FRAMES = 300
+    """How many of the latest frames are kept, for the overlay's statistics and for trace dumps."""
+    OVERLAY_REFRESH_SECONDS = 0.5
+    """How often the overlay's statistics are recalculated. They are drawn every frame, but sorting every scope's times every frame would show up in the times."""
+
+    class Frame:
+        def __init__(self, start: float):
+            """A frame's start and end time, and every scope timed during it (by any thread), in perf_counter seconds."""
+            self.start = start
+            self.end = start
+            self.scopes: list[tuple[str, float, float, int]] = []
+            """(name, start, end, thread id) of every scope that ended during this frame, in the order they ended."""
+
+    class Scope:
+        __slots__ = ("profiler", "name", "start")
+
+        def __init__(self, profiler: FrameProfiler, name: str):
+            self.profiler = profiler
+            self.name = name
+            self.start = 0.0
+
+        def __enter__(self):
+            self.start = time.perf_counter()
+            return self
+
+        def __exit__(self, *_):
+            self.profiler.add_scope(self.name, self.start, time.perf_counter())
+
+    class DisabledScope:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            ...
+
+    def __init__(self, enabled: bool = True, show_overlay: bool = False, max_frames: int = MAX_FRAMES):
+        """
+        Times named scopes of each frame, such as event handling and drawing, keeping the latest max_frames frames.
+        Scopes can be timed from any thread, and count towards the frame that is running when they end.
+
+        :param enabled: Whether anything is timed. When disabled, scopes do nothing but return.
+        :param show_overlay: Whether to draw an overlay of each scope's average and 99th percentile time per frame.
+        :param max_frames: How many of the latest frames to keep.
+        """
+        self.enabled = enabled
+        self.show_overlay = show_overlay
+
+        self.frames: collections.deque[FrameProfiler.Frame] = collections.deque(maxlen=max_frames)
+        self.current_frame: FrameProfiler.Frame | None = None
+        self.start_time = time.perf_counter()
+        self.main_thread_id = _thread.get_ident()
+
+        self._lock = _thread.allocate_lock()
+        self._disabled_scope = FrameProfiler.DisabledScope()
+        self._overlay_font: pygame.font.Font | None = None
+        self._overlay_lines: list[list[pygame.Surface]] = []
+        """The overlay's rendered text, as a list of cells for each line."""
+        self._overlay_refresh_time = 0.0
+        self._overlay_rect: pygame.Rect | None = None
+
+    def scope(self, name: str) -> FrameProfiler.Scope | FrameProfiler.DisabledScope:
+        """Returns a context manager that times the code run in it as part of the current frame, under name."""
+        if not self.enabled:
+            return self._disabled_scope
+        return FrameProfiler.Scope(self, name)
+
+    def add_scope(self, name: str, start: float, end: float):
+        """Adds a scope timed some other way (e.g. with time.perf_counter) to the current frame."""
+        with self._lock:
+            if self.current_frame is not None:
+                self.current_frame.scopes.append((name, start, end, _thread.get_ident()))
+
+    def begin_frame(self):
+        """Call at the start of every frame, before anything is timed. Ends the last frame if end_frame wasn't called."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            if self.current_frame is not None:
+                self.current_frame.end = now
+                self.frames.append(self.current_frame)
+            self.current_frame = FrameProfiler.Frame(now)
+
+    def end_frame(self):
+        """Call at the end of every frame. Anything timed between this and the next begin_frame isn't kept."""
+        with self._lock:
+            if self.current_frame is not None:
+                self.current_frame.end = time.perf_counter()
+                self.frames.append(self.current_frame)
+                self.current_frame = None
+
+    def get_summary(self) -> dict[str, tuple[float, float, float, int]]:
+        """
+        Returns (average, 99th percentile, max, frame count) of each scope's total time per frame in milliseconds, by
+        scope name, counting only the frames each was timed in. The whole frame's times are under "frame".
+        """
+        with self._lock:
+            frames = list(self.frames)
+        times_per_frame: dict[str, list[float]] = {"frame": [(frame.end - frame.start) * 1000 for frame in frames]}
+        for frame in frames:
+            totals: dict[str, float] = {}
+            for name, start, end, _ in frame.scopes:
+                totals[name] = totals.get(name, 0) + (end - start) * 1000
+            for name, total in totals.items():
+                times_per_frame.setdefault(name, []).append(total)
+
+        summary = {}
+        for name, times in times_per_frame.items():
+            if times:
+                times.sort()
+                summary[name] = (sum(times) / len(times), times[min(len(times) - 1, int(len(times) * 0.99))],
+                                 times[-1], len(times))
+        return summary
+
+    def get_chrome_trace(self) -> dict:
+        """
+        Returns the kept frames as a Chrome trace (as loaded by chrome://tracing or Perfetto), with an event for every
+        frame and every scope, on a track for each thread.
+        """
+        with self._lock:
+            frames = list(self.frames)
+
+        def get_microseconds(seconds: float) -> float:
+            return round((seconds - self.start_time) * 1_000_000, 3)
+
+        events = []
+        thread_ids = {self.main_thread_id}
+        for frame_number, frame in enumerate(frames):
+            events.append({"name": "frame", "cat": "frame", "ph": "X", "pid": 0, "tid": self.main_thread_id,
+                           "ts": get_microseconds(frame.start), "dur": round((frame.end - frame.start) * 1_000_000, 3),
+                           "args": {"frame": frame_number}})
+            for name, start, end, thread_id in frame.scopes:
+                thread_ids.add(thread_id)
+                events.append({"name": name, "cat": "scope", "ph": "X", "pid": 0, "tid": thread_id,
+                               "ts": get_microseconds(start), "dur": round((end - start) * 1_000_000, 3)})
+        for thread_id in thread_ids:
+            thread_name = "main" if thread_id == self.main_thread_id else f"thread {thread_id}"
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": thread_id, "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump_chrome_trace(self, path: str) -> int:
+        """Writes the kept frames as a Chrome trace JSON file. Returns the amount of frames written."""
+        trace = self.get_chrome_trace()
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(trace, file)
+        os.replace(temporary_path, path)
+        return sum(event["name"] == "frame" for event in trace["traceEvents"])
+
+    def draw_overlay(self, canvas: pygame.Surface) -> pygame.Rect | None:
+        """
+        Draws each scope's average and 99th percentile time per frame in the top right of the canvas, if show_overlay is
+        set. Returns the rect drawn over (including the area drawn over last time, if the overlay shrank), or None if
+        it wasn't drawn. Whatever is under the overlay must be repainted when it is hidden.
+        """
+        if not self.show_overlay:
+            self._overlay_rect = None
+            return None
+
+        if self._overlay_font is None:
+            self._overlay_font = pygame.font.SysFont("consolas,couriernew,monospace", 14)
+        if time.perf_counter() >= self._overlay_refresh_time or not self._overlay_lines:
+            self._overlay_refresh_time = time.perf_counter() + self.OVERLAY_REFRESH_SECONDS
+            summary = self.get_summary()
+            rows = [("ms per frame", "avg", "p99", "max")]
+            rows += [(name, f"{average:.2f}", f"{p99:.2f}", f"{maximum:.2f}")
+                     for name, (average, p99, maximum, _) in sorted(summary.items(), key=lambda item: -item[1][0])]
+            # Each cell is rendered separately and lined up, as the font may not be monospaced
+            self._overlay_lines = [[self._overlay_font.render(cell, True, Colors.white) for cell in row] for row in rows]
+
+        column_widths = [max(line[column].get_width() for line in self._overlay_lines) + 10
+                         for column in range(len(self._overlay_lines[0]))]
+        line_height = self._overlay_font.get_linesize()
+        overlay_rect = pygame.Rect(0, 0, sum(column_widths) - 2, line_height * len(self._overlay_lines) + 4)
+        overlay_rect.topright = (canvas.get_width(), 0)
+        # Redrawn over the canvas every frame, so it only needs to be painted under when it shrinks or is hidden
+        if self._overlay_rect and canvas.get_rect().contains(self._overlay_rect):
+            overlay_rect.union_ip(self._overlay_rect)
+        canvas.fill(Colors.black, overlay_rect)
+        for i, line in enumerate(self._overlay_lines):
+            # Scope names are aligned left, and times right
+            x = overlay_rect.right - sum(column_widths) + 4
+            canvas.blit(line[0], (x, 2 + i * line_height))
+            for column, cell in enumerate(line[1:], 1):
+                x += column_widths[column - 1]
+                canvas.blit(cell, (x + column_widths[column] - 10 - cell.get_width(), 2 + i * line_height))
+        self._overlay_rect = overlay_rect
+        return overlay_rect
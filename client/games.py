@@ -1,16 +1,17 @@
 from __future__ import annotations
 
-<<<<<<< HEAD
-from typing import TYPE_CHECKING, Callable, Sequence, Type
-=======
 import time
-from typing import TYPE_CHECKING, Callable, Sequence
->>>>>>> b447c737201023863d4aa403d14309b45c2ee1fc
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Sequence, Type
 import _thread
+import math
 import pygame
 from gui import Gui, get_button_functions, get_auto_center_function
-from utilities import Vert, Colliding, constrain
+from utilities import Vert, Vec2, Colliding, constrain
 import shared_assets
+from shared_assets import LockstepMessages, SnapshotMessages
+import snake_engine
+import console_log
 
 if TYPE_CHECKING:
     from client_assets import Colors
@@ -19,6 +20,13 @@ if TYPE_CHECKING:
 
 class Game:
     asset_class = shared_assets.GameAssets
+    update_rate = 60
+    """How many times per second on_update is called, however often frames are drawn."""
+    max_updates_per_frame = 5
+    """
+    The most times on_update is called before a frame is drawn. After a longer hitch than this covers, the game falls
+    behind rather than spending every later frame catching up.
+    """
 
     # region
     def while_mouse_down_private(self, button: int):
@@ -28,10 +36,51 @@ class Game:
     def on_mouse_down_private(self, button: int):
         if not self.menu.mouse_over(self.mouse_pos) and not self.menu_button.mouse_over(self.mouse_pos):
             self.on_mouse_down(button)
+
+    def on_frame_private(self):
+        # Updates are run for however much time has passed, in fixed steps, so the game plays the same at any frame rate
+        current_time = time.perf_counter()
+        self.update_time_accumulated += current_time - self.last_frame_time
+        self.last_frame_time = current_time
+
+        dt_fixed = 1 / self.update_rate
+        updates = 0
+        while self.update_time_accumulated >= dt_fixed and updates < self.max_updates_per_frame:
+            self.on_update(dt_fixed)
+            self.update_time_accumulated -= dt_fixed
+            updates += 1
+        if updates == self.max_updates_per_frame:
+            self.update_time_accumulated = min(self.update_time_accumulated, dt_fixed)
+
+        self.on_render(self.update_time_accumulated / dt_fixed)
+
+    def on_data_received_private(self, data: any):
+        if isinstance(data, SnapshotMessages.Snapshot):
+            self.on_snapshot_received(data)
+        else:
+            self.on_data_received(data)
+
+    def on_snapshot_received(self, snapshot: SnapshotMessages.Snapshot):
+        # Snapshots older than the latest one, or whose baseline is gone, are dropped. The server sends a full snapshot
+        #  once it stops getting acknowledgements.
+        if snapshot.snapshot_id <= self.latest_snapshot_id or \
+                (snapshot.baseline_id is not None and snapshot.baseline_id not in self.snapshots):
+            return
+        state = self.snapshots[snapshot.snapshot_id] = snapshot.apply_to(self.snapshots.get(snapshot.baseline_id))
+        self.latest_snapshot_id = snapshot.snapshot_id
+        for snapshot_id in [snapshot_id for snapshot_id in self.snapshots
+                            if snapshot_id <= snapshot.snapshot_id - SnapshotMessages.HISTORY]:
+            del self.snapshots[snapshot_id]
+
+        self.send_data(SnapshotMessages.Ack(snapshot.snapshot_id))
+        self.on_snapshot(SnapshotMessages.dequantize(state, self.asset_class.snapshot_quantization))
     # endregion
 
     # region Utility functions to call but not override
     def send_data(self, data: any):
+        """Sends data to the game's server. Does nothing while spectating, as the server ignores spectators."""
+        if self.spectating:
+            return
         _thread.start_new_thread(self.network.send, (shared_assets.Messages.GameDataMessage(data),))
 
     @property
@@ -62,11 +111,11 @@ class Game:
         return Vert(pygame.mouse.get_pos())
 
     @property
-    def canvas_size(self) -> Vert:
-        return Vert(self.canvas.get_size())
+    def canvas_size(self) -> Vec2:
+        return Vec2(self.canvas.get_size())
 
     @property
-    def all_keys_down(self) -> list[int]:
+    def all_keys_down(self) -> set[int]:
         return self.get_all_keys_down()
 
     def key_is_down(self, key_code: int | Sequence[int]):
@@ -103,10 +152,24 @@ class Game:
         self.clients = clients
         self._host_client = host_client
         self.this_client = this_client
+        self.spectating = all(client.client_id != this_client.client_id for client in clients)
+        """
+        Whether this client is watching rather than playing. Spectators are sent the game's state, delayed, with
+        on_snapshot, and send nothing.
+        """
         self.on_game_end = on_game_end
         self.on_game_leave = on_game_leave
         self.get_all_keys_down = get_all_keys_down
         self.gui = Gui.ContainerElement()
+        self.snapshots: dict[int, dict[str, any]] = {}
+        """The last SnapshotMessages.HISTORY (quantized) snapshots received, by id, to apply deltas to."""
+        self.latest_snapshot_id = 0
+        self.last_frame_time = time.perf_counter()
+        self.update_time_accumulated = 0.0
+        """
+        Time passed that on_update hasn't been called for yet, in seconds. At most one update's worth once a frame is
+        drawn, which it is exactly after falling behind by more than max_updates_per_frame covers.
+        """
 
         if menu is not None:
             self.menu = menu
@@ -201,6 +264,24 @@ class Game:
     def on_data_received(self, data: any):
         ...
 
+    def on_snapshot(self, state: dict[str, any]):
+        """
+        Called with the game's state whenever the server sends a snapshot with GameServer.send_snapshot_to_all(), or,
+        while spectating, with GameServer.get_spectator_state().
+        """
+        ...
+
+    def on_update(self, dt_fixed: float):
+        """Called update_rate times per second, with dt_fixed = 1 / update_rate, before drawing. Move the game forward here."""
+        ...
+
+    def on_render(self, alpha: float):
+        """
+        Called once per frame, after any updates. alpha is how far (from 0 to 1) the time drawn is between the last update
+        and the next, for drawing moving things between their last two positions. Calls on_frame by default.
+        """
+        self.on_frame()
+
     def on_frame(self):
         self.canvas.fill((245,) * 3)
 
@@ -231,25 +312,144 @@ class Game:
         ...
 
     def on_host_transfer(self, old_host: Client):
-        print(f"host has been transferred from {old_host.username} to {self.host_client.username}")
+        console_log.info(f"Host has been transferred from {old_host.username} to {self.host_client.username}")
 
     def on_window_resize(self):
         ...
     # endregion
 
-class SnakeGame(Game):
+class LockstepGame(Game, ABC):
+    """
+    Base for deterministic games where only inputs are sent (see shared_assets.LockstepMessages). Inputs sent with
+    send_input() are applied on the server's next tick, and every client applies each Tick the server sends to its own
+    simulation, in order, at the start of a frame.
+    \nSubclasses override create_simulation(), to return the same simulation as their server's, and draw
+    self.simulation in on_frame(). on_tick() is called after every tick.
+    """
+
+    # region Private functions not to override
+    def on_frame_private(self):
+        if self.simulation is not None:
+            # Ticks are kept until every tick before them has been applied, in case they arrive out of order
+            while (tick := self.received_ticks.pop(self.tick + 1, None)) is not None:
+                tick.apply_to(self.simulation)
+                self.tick = tick.tick
+                if self.tick % self.checksum_interval == 0:
+                    self.send_data(LockstepMessages.Checksum(self.tick, self.simulation.get_state_hash()))
+                self.on_tick()
+        super().on_frame_private()
+
+    def on_data_received_private(self, data: any):
+        if isinstance(data, LockstepMessages.Tick):
+            self.received_ticks[data.tick] = data
+        elif isinstance(data, LockstepMessages.Start):
+            self.checksum_interval = data.checksum_interval
+            self.simulation = self.create_simulation(data.seed)
+        elif isinstance(data, LockstepMessages.Desync):
+            self.on_desync(data.tick)
+        else:
+            super().on_data_received_private(data)
+    # endregion
+
+    # region Utility functions to call but not override
+    def send_input(self, data: any):
+        """Sends an input to be applied to every player's simulation on the server's next tick."""
+        self.send_data(LockstepMessages.Input(data))
+    # endregion
+
+    # region Automatically called functions to override
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.simulation = None
+        """The game's simulation, created once the server sends its seed."""
+        self.tick = 0
+        self.checksum_interval = 1
+        self.received_ticks: dict[int, LockstepMessages.Tick] = {}
+        """Ticks received from the server that haven't been applied yet, by tick number."""
+
+    @abstractmethod
+    def create_simulation(self, seed: int):
+        ...
+
+    def on_tick(self):
+        ...
+
+    def on_desync(self, tick: int):
+        console_log.error(f"Game state at tick {tick} doesn't match the server's")
+    # endregion
+
+class SnakeGame(LockstepGame):
     asset_class = shared_assets.SnakeAssets
 
+    background_color = (25, 25, 25)
+    board_color = (0, 0, 0)
+    food_color = (230, 60, 60)
+    snake_colors = [(80, 200, 80), (80, 140, 230), (230, 200, 60), (200, 90, 220)]
+    direction_keys = {
+        pygame.K_w: snake_engine.UP, pygame.K_UP: snake_engine.UP,
+        pygame.K_d: snake_engine.RIGHT, pygame.K_RIGHT: snake_engine.RIGHT,
+        pygame.K_s: snake_engine.DOWN, pygame.K_DOWN: snake_engine.DOWN,
+        pygame.K_a: snake_engine.LEFT, pygame.K_LEFT: snake_engine.LEFT
+    }
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.board_width = self.settings.settings["board_width"]
+        self.board_height = self.settings.settings["board_height"]
+        self.spectated_board: bytes | None = None
+        """The board from the server's latest spectator snapshot. Spectators have no simulation, so draw this instead."""
+
+    def create_simulation(self, seed: int):
+        return snake_engine.SnakeSimulation(self.board_width, self.board_height,
+                                            [client.client_id for client in self.clients], seed)
+
+    def on_key_down(self, key_code: int):
+        if key_code in self.direction_keys:
+            self.send_input(self.direction_keys[key_code])
+
+    def on_snapshot(self, state: dict[str, any]):
+        self.spectated_board = state["board"]
+
+    def on_frame(self):
+        self.canvas.fill(self.background_color)
+        canvas_size = self.canvas_size
+        cell_size = min(canvas_size.x / self.board_width, canvas_size.y / self.board_height)
+        board_pos = (canvas_size - Vec2(self.board_width, self.board_height) * cell_size) / 2
+        pygame.draw.rect(self.canvas, self.board_color,
+                         board_pos.tuple + (self.board_width * cell_size, self.board_height * cell_size))
+
+        board = self.simulation.board if self.simulation is not None else self.spectated_board
+        if board is None:
+            return
+        for cell, value in enumerate(board):
+            if value == snake_engine.EMPTY:
+                continue
+            if value == snake_engine.FOOD:
+                color = self.food_color
+            else:
+                color = self.snake_colors[(value - snake_engine.FIRST_SNAKE) % len(self.snake_colors)]
+            x, y = cell % self.board_width, cell // self.board_width
+            pygame.draw.rect(self.canvas, color, (board_pos.x + x * cell_size, board_pos.y + y * cell_size,
+                                                  math.ceil(cell_size), math.ceil(cell_size)))
+
 class PongGame(Game):
     asset_class = shared_assets.PongAssets
 
     # TODO: This should probably all be stored in shared_assets(?)
-    game_size = Vert(1000, 600)
-    ball_size = Vert(35, 35)
-    paddle_size = Vert(20, 100)
+    game_size = Vec2(1000, 600)
+    ball_size = Vec2(35, 35)
+    paddle_size = Vec2(20, 100)
 
     # TODO: Should this change as the game gets faster?
     paddle_speed = 6
+    max_bounces_per_update = 4
+    """The most times the ball can bounce in one update. Any movement left after that is lost."""
+    # Squares just outside the court on each side, for the ball to bounce off. The ball is never moved past them, so
+    #  they only need to be as thick as it is fast.
+    top_wall = (Vec2(-game_size.x, -game_size.y), Vec2(game_size.x * 3, game_size.y))
+    bottom_wall = (Vec2(-game_size.x, game_size.y), Vec2(game_size.x * 3, game_size.y))
+    left_wall = (Vec2(-game_size.x, 0), Vec2(game_size.x, game_size.y))
+    right_wall = (Vec2(game_size.x, 0), Vec2(game_size.x, game_size.y))
 
     # TODO: Pong ball should keep constant speed (but go up slowly as game progresses), just change direction when hit (add a bit of randomness).
     #  Paddle should (usually) be around the ball's vertical speed. I'd say it should probably match ball's vertical speed when the ball is going 45 degrees.
@@ -258,80 +458,142 @@ class PongGame(Game):
         super().__init__(*args)
 
         self.ball_pos = self.game_size / 2 - self.ball_size / 2
-        self.ball_vel = Vert(0, 0)
+        self.ball_vel = Vec2(0, 0)
+
+        self.paddle_pos = self.game_size * Vec2(9/10, 1/2) - self.paddle_size / 2
+        self.enemy_paddle_target_pos = self.game_size * Vec2(1/10, 1/2) - self.paddle_size / 2
+        self.enemy_paddle_pos = Vec2(self.enemy_paddle_target_pos)
+        # Spectators see the game as the first player does, with both paddles moved towards where the server says
+        self.paddle_target_pos = Vec2(self.paddle_pos)
+        self.ball_hits_seen = 0
 
-        self.paddle_pos = self.game_size * Vert(9/10, 1/2) - self.paddle_size / 2
-        self.enemy_paddle_target_pos = self.game_size * Vert(1/10, 1/2) - self.paddle_size / 2
-        self.enemy_paddle_pos = Vert(self.enemy_paddle_target_pos)
-        self.last_frame = time.time()
+        # Positions as of the update before the last, which frames are drawn between
+        self.previous_ball_pos = Vec2(self.ball_pos)
+        self.previous_paddle_pos = Vec2(self.paddle_pos)
+        self.previous_enemy_paddle_pos = Vec2(self.enemy_paddle_pos)
 
-    def get_draw_pos(self, pos) -> Vert:
-        if (x_ratio := self.canvas_size.x / self.game_size.x) < (y_ratio := self.canvas_size.y / self.game_size.y):
-            return pos * x_ratio + Vert(0, self.canvas_size.y / 2 - self.game_size.y * x_ratio / 2)
+    def get_draw_pos(self, pos) -> Vec2:
+        canvas_size = self.canvas_size
+        if (x_ratio := canvas_size.x / self.game_size.x) < (y_ratio := canvas_size.y / self.game_size.y):
+            return pos * x_ratio + Vec2(0, canvas_size.y / 2 - self.game_size.y * x_ratio / 2)
         else:
-            return pos * y_ratio + Vert(self.canvas_size.x / 2 - self.game_size.x * y_ratio / 2, 0)
+            return pos * y_ratio + Vec2(canvas_size.x / 2 - self.game_size.x * y_ratio / 2, 0)
 
-    def get_draw_size(self, size) -> Vert:
-        return size * min(self.canvas_size.x / self.game_size.x, self.canvas_size.y / self.game_size.y)
+    def get_draw_size(self, size) -> Vec2:
+        canvas_size = self.canvas_size
+        return size * min(canvas_size.x / self.game_size.x, canvas_size.y / self.game_size.y)
 
     def get_draw_rect(self, pos, size) -> tuple:
         return self.get_draw_pos(pos).tuple + self.get_draw_size(size).tuple
 
-    def on_frame(self):
-        self.canvas.fill((25,) * 3)
-        # TODO: Stuff can kinda poke off the edges of the canvas. I should be drawing the gray after the black.
-        pygame.draw.rect(self.canvas, (0,)*3, self.get_draw_rect(Vert(0, 0), self.game_size))
-        # TODO: Ball pos should be changed on server side(?). Should depend on dt?
+    def on_update(self, dt_fixed: float):
+        # TODO: Ball pos should be changed on server side(?)
+        self.previous_ball_pos = Vec2(self.ball_pos)
+        self.previous_paddle_pos = Vec2(self.paddle_pos)
+        self.previous_enemy_paddle_pos = Vec2(self.enemy_paddle_pos)
+        # Speeds are in game units per 60th of a second
+        steps = dt_fixed * 60
 
         paddle_moved = False
-        if self.key_is_down([pygame.K_w, pygame.K_UP]):
-            self.paddle_pos.y -= self.paddle_speed
-            paddle_moved = True
-        if self.key_is_down([pygame.K_s, pygame.K_DOWN]):
-            self.paddle_pos.y += self.paddle_speed
-            paddle_moved = True
+        if self.spectating:
+            self.paddle_pos += (self.paddle_target_pos - self.paddle_pos) * (1 - (2 / 3) ** steps)
+        else:
+            if self.key_is_down([pygame.K_w, pygame.K_UP]):
+                self.paddle_pos.y -= self.paddle_speed * steps
+                paddle_moved = True
+            if self.key_is_down([pygame.K_s, pygame.K_DOWN]):
+                self.paddle_pos.y += self.paddle_speed * steps
+                paddle_moved = True
 
         self.paddle_pos.y = constrain(self.paddle_pos.y, 0, self.game_size.y - self.paddle_size.y)
 
         if paddle_moved:  # self.paddle_pos.y != prev_paddle_y:
             self.send_data(self.asset_class.Messages.PaddleMove(self.paddle_pos.y))
 
-        current_time = time.time()
-        dt = current_time - self.last_frame
-        self.last_frame = current_time
-        print(dt)
-
-        self.ball_pos += self.ball_vel * dt * 60
-
-        if self.ball_pos.x + self.ball_size.x >= self.game_size.x:
-            self.ball_pos.x = 2 * (self.game_size.x - self.ball_size.x) - self.ball_pos.x
-            self.ball_vel.x *= -1
-        elif self.ball_pos.x <= 0:
-            self.send_data(self.asset_class.Messages.PlayerDied())
-            self.ball_pos.x = 0 - self.ball_pos.x
-            self.ball_vel.x *= -1
-        if self.ball_pos.y + self.ball_size.y >= self.game_size.y:
-            self.ball_pos.y = 2 * (self.game_size.y - self.ball_size.y) - self.ball_pos.y
-            self.ball_vel.y *= -1
-        elif self.ball_pos.y <= 0:
-            self.ball_pos.y = 0 - self.ball_pos.y
-            self.ball_vel.y *= -1
+        self.move_ball(steps)
 
+        # The paddle can also be moved onto the ball, which sweeping the ball doesn't catch
         if Colliding.square_square(self.ball_pos, self.ball_size, self.paddle_pos, self.paddle_size) and self.ball_vel.x > 0:
             self.ball_vel.x = -self.ball_vel.x
             self.send_data(self.asset_class.Messages.BallHit(self.ball_pos.tuple, self.ball_vel.tuple))
 
-        self.enemy_paddle_pos += (self.enemy_paddle_target_pos - self.enemy_paddle_pos) / 3
+        self.enemy_paddle_pos += (self.enemy_paddle_target_pos - self.enemy_paddle_pos) * (1 - (2 / 3) ** steps)
+
+    def move_ball(self, steps: float):
+        """
+        Moves the ball by its velocity, bouncing off the walls and paddle at the moment it touches them, so it can't pass
+        through them however fast it goes or however long the update is.
+        """
+        # In case the other player's BallHit put it somewhere it couldn't get to
+        self.ball_pos = Vec2(constrain(self.ball_pos.x, 0, self.game_size.x - self.ball_size.x),
+                             constrain(self.ball_pos.y, 0, self.game_size.y - self.ball_size.y))
+
+        movement_left = 1.0
+        for _ in range(self.max_bounces_per_update):
+            movement = self.ball_vel * steps * movement_left
+            first_collision, first_obstacle = None, None
+            obstacles = [self.top_wall, self.bottom_wall, self.left_wall, self.right_wall, (self.paddle_pos, self.paddle_size)]
+            if self.spectating:
+                # Players only bounce the ball off their own paddle, and send where it went, which spectators get late
+                obstacles.append((self.enemy_paddle_pos, self.paddle_size))
+            for obstacle in obstacles:
+                collision = Colliding.swept_square_square(self.ball_pos, self.ball_size, movement, *obstacle)
+                if collision and (first_collision is None or collision.time < first_collision.time):
+                    first_collision, first_obstacle = collision, obstacle
+
+            if first_collision is None:
+                self.ball_pos += movement
+                return
+
+            self.ball_pos += movement * first_collision.time
+            movement_left *= 1 - first_collision.time
+            if first_collision.normal.x:
+                self.ball_vel.x = -self.ball_vel.x
+            else:
+                self.ball_vel.y = -self.ball_vel.y
 
-        pygame.draw.rect(self.canvas, (255,)*3, self.get_draw_rect(self.ball_pos, self.ball_size))
-        pygame.draw.rect(self.canvas, (255,)*3, self.get_draw_rect(self.paddle_pos, self.paddle_size))
-        pygame.draw.rect(self.canvas, (255,)*3, self.get_draw_rect(self.enemy_paddle_pos, self.paddle_size))
+            if first_obstacle is self.left_wall:
+                self.send_data(self.asset_class.Messages.PlayerDied())
+            elif first_obstacle[0] is self.paddle_pos and first_collision.normal.x < 0:
+                # Only the paddle's face, towards the other player, sends the ball back. Glancing off its top or bottom,
+                #  or hitting its back after that, doesn't count as a hit.
+                self.send_data(self.asset_class.Messages.BallHit(self.ball_pos.tuple, self.ball_vel.tuple))
+
+    def on_render(self, alpha: float):
+        self.canvas.fill((25,) * 3)
+        # TODO: Stuff can kinda poke off the edges of the canvas. I should be drawing the gray after the black.
+        pygame.draw.rect(self.canvas, (0,)*3, self.get_draw_rect(Vec2(0, 0), self.game_size))
+
+        for previous_pos, pos, size in ((self.previous_ball_pos, self.ball_pos, self.ball_size),
+                                        (self.previous_paddle_pos, self.paddle_pos, self.paddle_size),
+                                        (self.previous_enemy_paddle_pos, self.enemy_paddle_pos, self.paddle_size)):
+            pygame.draw.rect(self.canvas, (255,)*3, self.get_draw_rect(previous_pos + (pos - previous_pos) * alpha, size))
+
+    def on_snapshot(self, state: dict[str, any]):
+        view_client_id = self.clients[0].client_id
+        for client_id, paddle_y in state["paddle_ys"]:
+            (self.paddle_target_pos if client_id == view_client_id else self.enemy_paddle_target_pos).y = paddle_y
+
+        if state["ball_hits"] == self.ball_hits_seen:
+            return
+        # Only moved on a new hit. In between, the ball is moved here as it is in the players' games.
+        self.ball_hits_seen = state["ball_hits"]
+        ball_pos = Vec2(state["ball_pos"]) if state["ball_pos"] else self.game_size / 2 - self.ball_size / 2
+        ball_vel = Vec2(state["ball_vel"])
+        if state["ball_hit_by"] != view_client_id:
+            ball_pos.x = self.game_size.x - ball_pos.x - self.ball_size.x
+            ball_vel.x = -ball_vel.x
+        self.ball_pos, self.ball_vel = ball_pos, ball_vel
+        self.move_ball(state["ball_age"] * 60)
+        self.previous_ball_pos = Vec2(self.ball_pos)
 
     def on_data_received(self, data):
         if isinstance(data, self.asset_class.Messages.BallHit):
             if data.ball_pos:
-                self.ball_pos = Vert(self.game_size.x - data.ball_pos[0] - self.ball_size.x, data.ball_pos[1])
+                # Moved straight there, rather than drawn moving across the court
+                self.ball_pos = Vec2(self.game_size.x - data.ball_pos[0] - self.ball_size.x, data.ball_pos[1])
+                self.previous_ball_pos = Vec2(self.ball_pos)
             if data.ball_vel:
-                self.ball_vel = Vert(-data.ball_vel[0], data.ball_vel[1])
+                self.ball_vel = Vec2(-data.ball_vel[0], data.ball_vel[1])
         elif isinstance(data, self.asset_class.Messages.PaddleMove):
             self.enemy_paddle_target_pos.y = data.paddle_y
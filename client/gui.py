@@ -1,10 +1,11 @@
 from __future__ import annotations
 import math
 import time
-from utilities import IVert, AnyVert, Vert, Colors
+from utilities import IVec2, AnyVert, Vert, Colors
 from typing import Sequence, Callable
 import pygame
 import copy
+from contextlib import contextmanager
 
 # TODO: When clicking off of a text_input onto another text_input, it doesn't deselect the first
 
@@ -67,6 +68,9 @@ class Gui:
         def bottom_right(self):
             return self.pos + self.size
 
+        def __eq__(self, other):
+            return isinstance(other, Gui.BoundingBox) and self.pos == other.pos and self.size == other.size
+
         def __getitem__(self, index):
             if index == 0:
                 return self.pos
@@ -78,12 +82,55 @@ class Gui:
         def __str__(self):
             return f"{self.pos}, {self.size}"
 
+    @staticmethod
+    @contextmanager
+    def batch_layout(root: Gui.GuiElement):
+        """
+        Context manager that delays recalculating bounding boxes under root until the with block is finished, then
+        recalculates each changed one exactly once. Use when moving or resizing many elements at once, e.g.:
+        \n``with Gui.batch_layout(menu.gui): ...``
+
+        Bounding boxes read inside the with block may be out of date.
+
+        :param root: The root element of the gui being changed.
+        """
+        root._layout_batch_depth += 1
+        try:
+            yield root
+        finally:
+            root._layout_batch_depth -= 1
+            if root._layout_batch_depth == 0:
+                root.finish_layout_batch()
+
     class GuiElement:
+        # Dirty tracking used by DirtyRectRenderer. These are class level so that setters called before __init__ (which
+        #  some subclasses do) can still invalidate the element.
+        parent = None
+        _active: bool = True
+        _dirty: bool = True
+        """Whether this element has changed since it was last drawn."""
+        _subtree_dirty: bool = False
+        """Whether any element under this one has changed since it was last drawn."""
+        _drawn_rect: pygame.Rect | None = None
+        """The absolute rect this element (ignoring children) covered when it was last drawn."""
+        _subtree_rect: pygame.Rect | None = None
+        """The absolute rect this element and all of its active children covered when they were last drawn."""
+        _damaged_rects: list[pygame.Rect] | None = None
+        _scheduled_rects: list[pygame.Rect] | None = None
+        cache_surface: bool = False
+        _cached_surface: pygame.Surface | None = None
+        # Used by Gui.batch_layout. Only used on the root element of a gui.
+        _layout_batch_depth: int = 0
+        _pending_layout: set[Gui.GuiElement] | None = None
+        _hit_grid: HitGrid | None = None
+        """Spatial index of the elements under this one, used by get_element_over. Cleared whenever its layout changes."""
+        _ignored_by_mouse: bool = False
 
         def __init__(self, pos: AnyVert,
                      on_draw_before: Sequence[Callable] | Callable | None = None,
                      on_draw_after: Sequence[Callable] | Callable | None = None,
-                     ignore_bounding_box: bool = False, ignored_by_mouse: bool = False, active: bool = True, **_):
+                     ignore_bounding_box: bool = False, ignored_by_mouse: bool = False, active: bool = True,
+                     animated: bool = False, **_):
             """
             A base gui element to provides basic framework to child classes.
 
@@ -91,9 +138,11 @@ class Gui:
             :param on_draw_before: A function or list of functions called right before element is drawn. When called, the passed parameters are: the element being drawn, the position of the element, and the size of the element.
             :param on_draw_after: A function or list of functions called right after element is drawn. When called, the passed parameters are: the element being drawn, the position of the element, and the size of the element.
             :param ignore_bounding_box: Whether to ignore this element's bounding box when making calculations. Does not ignore any potential children's bounding boxes.
+            :param animated: Whether this element changes how it looks without any of its setters being called (e.g. through an on_draw_before function), meaning it has to be redrawn every frame.
             """
-            self._pos: IVert = IVert(pos)
+            self._pos: IVec2 = IVec2(pos)
             self.active: bool = active
+            self.animated: bool = animated
             self.on_draw_before: list[Callable] = get_list_of_input(on_draw_before)
 
             self.on_draw_after: list[Callable] = get_list_of_input(on_draw_after)
@@ -102,7 +151,13 @@ class Gui:
             self._ignore_bounding_box: bool = ignore_bounding_box
             self.ignored_by_mouse: bool = ignored_by_mouse
 
-        def draw(self, canvas: pygame.Surface, parent_absolute_pos: AnyVert = Vert(0, 0), force_draw: bool = False):
+        def draw(self, canvas: pygame.Surface, parent_absolute_pos: AnyVert = Vert(0, 0), force_draw: bool = False,
+                 clip_rect: pygame.Rect | None = None):
+            """
+            Draws this element (and any children) onto the canvas.
+
+            :param clip_rect: The absolute area being redrawn. Children that have not changed and were not drawn within this area last time are skipped. Leave None to draw every child.
+            """
             if self.active or force_draw:
                 for func in self.on_draw_before:
                     func(self, self.bounding_box)
@@ -112,9 +167,151 @@ class Gui:
                 for func in self.on_draw_after:
                     func(self, self.bounding_box)
 
+                drawn_rect = self.get_absolute_visual_rect(parent_absolute_pos)
+                subtree_rect = self.draw_contents(canvas, parent_absolute_pos, drawn_rect, clip_rect) \
+                    if self.active else drawn_rect
+                self.set_drawn_rect(drawn_rect, subtree_rect)
+
         def draw_element(self, canvas: pygame.Surface, parent_absolute_pos: AnyVert = Vert(0, 0)):
             pass
 
+        def draw_contents(self, canvas: pygame.Surface, parent_absolute_pos: AnyVert, drawn_rect: pygame.Rect | None,
+                          clip_rect: pygame.Rect | None) -> pygame.Rect | None:
+            """Draws any children of this element. Returns the absolute rect covered by this element and its children."""
+            _ = canvas, parent_absolute_pos, clip_rect
+            return drawn_rect
+
+        # region Dirty tracking
+        def get_absolute_visual_rect(self, parent_absolute_pos: AnyVert = Vert(0, 0)) -> pygame.Rect | None:
+            """Returns the absolute rect this element (ignoring children) is drawn in, or None if it is not visual."""
+            bounding_box = self.bounding_box_ignoring_children
+            if bounding_box is None:
+                return None
+            rect = pygame.Rect(math.floor(parent_absolute_pos[0] + self._pos[0] + bounding_box.pos[0]),
+                               math.floor(parent_absolute_pos[1] + self._pos[1] + bounding_box.pos[1]),
+                               math.ceil(bounding_box.size[0]) + 1, math.ceil(bounding_box.size[1]) + 1)
+            # Inflate slightly to cover antialiasing and strokes that poke out of the bounding box
+            return rect.inflate(4, 4)
+
+        def get_root(self) -> Gui.GuiElement:
+            root = self
+            while root.parent is not None:
+                root = root.parent
+            return root
+
+        def get_outermost_cached_parent(self) -> Gui.ContainerElement | None:
+            """Returns the outermost parent of this element with cache_surface enabled, or None if there isn't one."""
+            cached_parent = None
+            container = self.parent
+            while container is not None:
+                if container.cache_surface:
+                    cached_parent = container
+                container = container.parent
+            return cached_parent
+
+        def invalidate(self, include_children: bool = False):
+            """
+            Marks this element as changed so that it is redrawn by DirtyRectRenderer. Called by any setter that changes how this element looks.
+
+            :param include_children: Whether the area covered by this element's children should be redrawn too (e.g. when this element moves or is disabled).
+            """
+            self._dirty = True
+            self._cached_surface = None
+
+            old_rect = self._subtree_rect if include_children else self._drawn_rect
+            root = self
+            while root.parent is not None:
+                root = root.parent
+                root._subtree_dirty = True
+                if root.cache_surface:
+                    # Anything under a cached element is only drawn as part of that element's surface, so the whole
+                    #  surface has to be redrawn.
+                    root._cached_surface = None
+                    old_rect = root._drawn_rect
+
+            if old_rect is not None:
+                root.add_damage(old_rect)
+
+        def schedule_redraw(self):
+            """Marks the area this element was last drawn in to be redrawn next frame."""
+            if (cached_parent := self.get_outermost_cached_parent()) is not None:
+                container = self
+                while container is not cached_parent:
+                    container = container.parent
+                    container._cached_surface = None
+                return cached_parent.schedule_redraw()
+
+            if self._drawn_rect is not None:
+                root = self.get_root()
+                if root._scheduled_rects is None:
+                    root._scheduled_rects = []
+                root._scheduled_rects.append(self._drawn_rect)
+
+        def add_damage(self, rect: pygame.Rect):
+            """Adds an absolute area to be redrawn. Should only be called on the root element of a gui."""
+            if self._damaged_rects is None:
+                self._damaged_rects = []
+            self._damaged_rects.append(rect)
+            # Guis that are never drawn through a DirtyRectRenderer would otherwise build up damage forever
+            if len(self._damaged_rects) > DirtyRectRenderer.MAX_RECTS * 4:
+                self._damaged_rects = merge_rects(self._damaged_rects)
+
+        def take_damage(self, include_scheduled: bool = True) -> list[pygame.Rect]:
+            """Returns and clears all areas that need to be redrawn. Should only be called on the root element of a gui."""
+            damaged_rects = self._damaged_rects or []
+            self._damaged_rects = None
+            if include_scheduled and self._scheduled_rects:
+                damaged_rects += self._scheduled_rects
+                self._scheduled_rects = None
+            return damaged_rects
+
+        def set_drawn_rect(self, drawn_rect: pygame.Rect | None, subtree_rect: pygame.Rect | None):
+            # Elements under a cached element are drawn relative to its surface, and that whole surface is already
+            #  being redrawn, so there is no need to add damage for them.
+            if drawn_rect != self._drawn_rect and self.get_outermost_cached_parent() is None:
+                root = self.get_root()
+                if self._drawn_rect is not None:
+                    root.add_damage(self._drawn_rect)
+                if drawn_rect is not None:
+                    root.add_damage(drawn_rect)
+            self._drawn_rect = drawn_rect
+            self._subtree_rect = subtree_rect
+            self._dirty = False
+
+            if self.animated:
+                self.schedule_redraw()
+
+        @property
+        def active(self):
+            return self._active
+
+        @active.setter
+        def active(self, value):
+            if value != self._active:
+                self._active = value
+                self.invalidate(True)
+                self.clear_hit_grids()
+        # endregion
+
+        # region Hit testing
+        def clear_hit_grids(self):
+            """Clears the HitGrid of this element and all of its parents. Called whenever the layout under them changes."""
+            element = self
+            while element is not None:
+                element._hit_grid = None
+                element = element.parent
+
+        @property
+        def ignored_by_mouse(self):
+            return self._ignored_by_mouse
+
+        @ignored_by_mouse.setter
+        def ignored_by_mouse(self, value):
+            if value != self._ignored_by_mouse:
+                self._ignored_by_mouse = value
+                self.clear_hit_grids()
+        # endregion
+
         def mouse_over(self, mouse_pos: AnyVert, parent_absolute_pos: AnyVert = Vert(0, 0), force_check: bool = False):
             """
             Function that calculates whether the mouse is over this element. Ignores any obstructions.
@@ -178,27 +375,69 @@ class Gui:
             """
             return None
 
-        def reevaluate_bounding_box(self):
+        def calculate_bounding_box(self):
+            """Sets this element's bounding box, without updating any parent's bounding box."""
             self.bounding_box = None if self.ignore_bounding_box else self.bounding_box_ignoring_children
-            if self.parent is not None:
-                self.parent.reevaluate_bounding_box()
+
+        def reevaluate_bounding_box(self):
+            """
+            Sets this element's bounding box, then those of all of its parents. Should be called whenever this element's size or draw position relative to it's stored position changes.
+            \nIf this element is under a gui in a Gui.batch_layout, this is instead done once when the batch is finished.
+            """
+            self.clear_hit_grids()
+            root = self.get_root()
+            if root._layout_batch_depth:
+                if root._pending_layout is None:
+                    root._pending_layout = set()
+                root._pending_layout.add(self)
+                return
+
+            element = self
+            while element is not None:
+                element.calculate_bounding_box()
+                element = element.parent
+
+        def finish_layout_batch(self):
+            """
+            Sets the bounding box of every element under this gui that changed during a Gui.batch_layout. Each bounding
+            box is only calculated once, deepest elements first. Should only be called on the root element of a gui.
+            """
+            pending_by_depth: dict[int, set[Gui.GuiElement]] = {}
+            for element in self._pending_layout or ():
+                depth, container = 0, element
+                while container.parent is not None:
+                    depth, container = depth + 1, container.parent
+                pending_by_depth.setdefault(depth, set()).add(element)
+            self._pending_layout = None
+
+            for depth in range(max(pending_by_depth, default=-1), -1, -1):
+                for element in pending_by_depth.get(depth, ()):
+                    prev_bounding_box = element.bounding_box
+                    element.calculate_bounding_box()
+                    # A parent's bounding box only depends on its children's bounding boxes and positions (position
+                    #  changes add the parent themselves), so it only has to be recalculated if this one changed.
+                    if element.parent is not None and element.bounding_box != prev_bounding_box:
+                        pending_by_depth.setdefault(depth - 1, set()).add(element.parent)
 
         @property
         def pos(self):
-            return IVert(self._pos)
+            return self._pos
 
         @pos.setter
         def pos(self, value):
             if not isinstance(value, AnyVert) or value.len != 2:
                 raise ValueError(f"Input pos ({value}) must be Vert of length 2")
             prev_value = self._pos
-            self._pos = IVert(value)
-            if self.parent is not None and prev_value != self._pos:
-                self.parent.reevaluate_bounding_box()
+            self._pos = IVec2(value)
+            if prev_value != self._pos:
+                self.invalidate(True)
+                if self.parent is not None:
+                    self.parent.reevaluate_bounding_box()
 
     class ContainerElement(GuiElement):
         def __init__(self, pos: AnyVert = Vert(0, 0),
                      contents: Gui.GuiElement | Sequence[Gui.GuiElement] | None = None,
+                     cache_surface: bool = False,
                      **kwargs):
             """
             A group that contains a list of Gui Elements. Can be disabled or moved, which affects all elements contained.
@@ -206,11 +445,13 @@ class Gui:
             :param pos: The position of the element group relative to its parent (if it has one).
             :param contents: The list of GuiElements or ElementGroups contained within this group. First elements are on the bottom, later elements overlap them.
             :param active: Whether to draw this group and its contents when the draw function is called.
+            :param cache_surface: Whether to draw this element and its contents onto a separate surface once, then only draw that surface until anything under this element changes. Anything drawn outside of this element's bounding box is cut off. Only worth it for elements with many children that rarely change.
             """
             super().__init__(pos, **kwargs)
             self.parent: Gui.ContainerElement | None = None
             # Bounding box is relative to position
             self.bounding_box: Gui.BoundingBox | None = None
+            self.cache_surface: bool = cache_surface
 
             self._contents: list[Gui.GuiElement] = []
             self.contents = contents
@@ -229,6 +470,7 @@ class Gui:
 
             for element in elements:
                 element.parent = self
+                element.invalidate()
 
             self._contents += elements
             self.reevaluate_bounding_box()
@@ -253,13 +495,15 @@ class Gui:
 
             for i, element in enumerate(self._contents):
                 if element in elements:
+                    if element._subtree_rect is not None:
+                        self.get_root().add_damage(element._subtree_rect)
                     del self._contents[i]
 
             self.reevaluate_bounding_box()
 
-        def reevaluate_bounding_box(self):
+        def calculate_bounding_box(self):
             """
-            Sets this element's bounding box. Should be called whenever this element's size or draw position relative to it's stored position changes.
+            Sets this element's bounding box, without updating any parent's bounding box. Should be called (through reevaluate_bounding_box) whenever this element's size or draw position relative to it's stored position changes.
             \nShould also be called if the position/size of any child element changes, or if a child is added or removed.
             """
             top_left, bottom_right = Vert(math.inf, math.inf), Vert(-math.inf, -math.inf)
@@ -284,9 +528,6 @@ class Gui:
 
             self.bounding_box = None if no_bounding_box else Gui.BoundingBox(top_left, bottom_right - top_left)
 
-            if self.parent is not None:
-                self.parent.reevaluate_bounding_box()
-
         def mouse_over(self, mouse_pos: AnyVert, parent_absolute_pos: AnyVert = Vert(0, 0), force_check: bool = False):
             """
             Function that calculates whether the mouse is over this element or any child elements. Ignores any obstructions.
@@ -303,21 +544,70 @@ class Gui:
             return False
 
         def get_element_over(self, mouse_pos: AnyVert, parent_absolute_pos: AnyVert = Vert(0, 0)):
-            if self.active:
-                for element in reversed(self._contents):
-                    if isinstance(element, Gui.ContainerElement):
-                        if element_over := element.get_element_over(mouse_pos, parent_absolute_pos + self._pos):
-                            return element_over
-                    if element.mouse_over_element(mouse_pos - self._pos - parent_absolute_pos) \
-                            and element.active and not element.ignored_by_mouse:
-                        return element
-            return None
+            """
+            Returns the topmost active element under this one that the mouse is directly over, or None if there isn't one.
+            \nUses a HitGrid of this element's children, which is only rebuilt after the layout under this element changes.
+            """
+            if not self.active:
+                return None
+            if self._hit_grid is None:
+                self._hit_grid = HitGrid(self)
+            return self._hit_grid.get_element_over(mouse_pos[0] - parent_absolute_pos[0] - self._pos[0],
+                                                   mouse_pos[1] - parent_absolute_pos[1] - self._pos[1])
 
-        def draw(self, canvas: pygame.Surface, parent_absolute_pos=Vert(0, 0), force_draw: bool = False):
-            super().draw(canvas, parent_absolute_pos, force_draw)
+        def draw(self, canvas: pygame.Surface, parent_absolute_pos: AnyVert = Vert(0, 0), force_draw: bool = False,
+                 clip_rect: pygame.Rect | None = None):
+            if not self.cache_surface or not (self.active or force_draw) or \
+                    (self.bounding_box_ignoring_children or self.bounding_box) is None:
+                return super().draw(canvas, parent_absolute_pos, force_draw, clip_rect)
+
+            for func in self.on_draw_before:
+                func(self, self.bounding_box)
+
+            cached_box = self.bounding_box_ignoring_children or self.bounding_box
+            cached_pos = (self._pos + parent_absolute_pos + cached_box.pos).floor
+            if self._cached_surface is None or self._cached_surface.get_size() != tuple(cached_box.size.ceil):
+                self._cached_surface = self.get_cached_surface(parent_absolute_pos - cached_pos, cached_box)
+
+            for func in self.on_draw_after:
+                func(self, self.bounding_box)
+
+            canvas.blit(self._cached_surface, cached_pos.list)
+
+            drawn_rect = pygame.Rect(cached_pos.list, self._cached_surface.get_size())
+            self._subtree_dirty = False
+            self.set_drawn_rect(drawn_rect, drawn_rect)
+
+        def get_cached_surface(self, surface_offset: AnyVert, cached_box: Gui.BoundingBox) -> pygame.Surface:
+            """
+            Returns a new surface with this element and its contents drawn onto it.
+
+            :param surface_offset: The position of this element's parent relative to the surface's top left corner.
+            :param cached_box: The area of this element (relative to its position) that is drawn onto the surface.
+            """
+            surface = pygame.Surface(cached_box.size.ceil.list, pygame.SRCALPHA)
+            self.draw_element(surface, surface_offset)
             if self.active:
-                for element in self._contents:
-                    element.draw(canvas, self._pos + parent_absolute_pos)
+                self.draw_contents(surface, surface_offset, None, None)
+            return surface
+
+        def draw_contents(self, canvas: pygame.Surface, parent_absolute_pos: AnyVert, drawn_rect: pygame.Rect | None,
+                          clip_rect: pygame.Rect | None) -> pygame.Rect | None:
+            absolute_pos = self._pos + parent_absolute_pos
+            # If this element changed, its children may have moved with it, so none of them can be skipped
+            clip_rect = None if self._dirty else clip_rect
+            subtree_rect = drawn_rect
+
+            for element in self._contents:
+                if clip_rect is None or element._dirty or element._subtree_dirty or element._subtree_rect is None \
+                        or element._subtree_rect.colliderect(clip_rect):
+                    element.draw(canvas, absolute_pos, clip_rect=clip_rect)
+                if element.active and element._subtree_rect is not None:
+                    subtree_rect = element._subtree_rect if subtree_rect is None else \
+                        subtree_rect.union(element._subtree_rect)
+
+            self._subtree_dirty = False
+            return subtree_rect
 
         @property
         def contents(self) -> list[Gui.GuiElement]:
@@ -325,6 +615,7 @@ class Gui:
 
         @contents.setter
         def contents(self, value):
+            self.invalidate(True)
             self._contents = []
             if value:
                 self.add_element(get_list_of_input(value))
@@ -337,20 +628,21 @@ class Gui:
         A container element that has a custom bounding box. Acts basically like a Rect, but without drawing or mouse interaction.
         """
         def __init__(self, pos: AnyVert = Vert(0, 0), size: AnyVert = Vert(0, 0), **kwargs):
-            self._size: IVert = IVert(size)
+            self._size: IVec2 = IVec2(size)
             super().__init__(pos, **kwargs)
 
         @property
         def size(self):
-            return IVert(self._size)
+            return self._size
 
         @size.setter
         def size(self, value):
             if not isinstance(value, AnyVert) or value.len != 2:
                 raise ValueError(f"Input size ({value}) must be Vert of length 2")
             prev_value = self._size
-            self._size = IVert(value)
+            self._size = IVec2(value)
             if prev_value != self._size:
+                self.invalidate()
                 self.reevaluate_bounding_box()
 
         @property
@@ -467,6 +759,17 @@ class Gui:
             self.stroke_weight: int = stroke_weight
             self.no_fill: bool = no_fill
 
+        @property
+        def col(self):
+            return self._col
+
+        @col.setter
+        def col(self, value):
+            prev_value = getattr(self, "_col", None)
+            self._col = value
+            if prev_value != self._col:
+                self.invalidate()
+
     class Rect(ContainerElement, Shape, MouseInteractable):
 
         def __init__(self,
@@ -480,7 +783,7 @@ class Gui:
             :param size: A vertex storing the width and height of this rectangle.
             :param col: Color of this rectangle.
             """
-            self._size: IVert = IVert(size)
+            self._size: IVec2 = IVec2(size)
             Gui.ContainerElement.__init__(self, pos=pos, **kwargs)
             Gui.Shape.__init__(self, col=col, **kwargs)
             Gui.MouseInteractable.__init__(self, **kwargs)
@@ -498,15 +801,16 @@ class Gui:
 
         @property
         def size(self):
-            return IVert(self._size)
+            return self._size
 
         @size.setter
         def size(self, value):
             if not isinstance(value, AnyVert) or value.len != 2:
                 raise ValueError(f"Input size ({value}) must be Vert of length 2")
             prev_value = self._size
-            self._size = IVert(value)
+            self._size = IVec2(value)
             if prev_value != self._size:
+                self.invalidate()
                 self.reevaluate_bounding_box()
 
         @property
@@ -528,7 +832,7 @@ class Gui:
             :param image: The image this element draws.
             """
             self._image = None
-            self._size: IVert = IVert(size) if size else (IVert(image.get_size()) if image else IVert(0, 0))
+            self._size: IVec2 = IVec2(size) if size else (IVec2(image.get_size()) if image else IVec2(0, 0))
             Gui.ContainerElement.__init__(self, pos=pos, **kwargs)
             Gui.MouseInteractable.__init__(self, **kwargs)
             self.unscaled_image = image
@@ -549,16 +853,19 @@ class Gui:
 
         @property
         def size(self):
-            return IVert(self._size)
+            return self._size
 
         @size.setter
         def size(self, value):
             if not isinstance(value, AnyVert) or value.len != 2:
                 raise ValueError(f"Input size ({value}) must be Vert of length 2")
             prev_value = self._size
-            self._size = IVert(value)
-            if prev_value != self._size and self._image:
-                self._image = pygame.transform.scale(self.unscaled_image, self.size.list)
+            self._size = IVec2(value)
+            if prev_value != self._size:
+                self.invalidate()
+                self.reevaluate_bounding_box()
+                if self._image:
+                    self._image = pygame.transform.scale(self.unscaled_image, self.size.list)
 
         @property
         def image(self):
@@ -569,6 +876,7 @@ class Gui:
             self.unscaled_image = self._image = value
             if value and value.get_size() != self._size.list:
                 self._image = pygame.transform.scale(self._image, self.size.list)
+            self.invalidate()
 
         @property
         def bounding_box_ignoring_children(self):
@@ -613,6 +921,7 @@ class Gui:
             prev_value = self._rad
             self._rad = value
             if prev_value != self._rad:
+                self.invalidate()
                 self.reevaluate_bounding_box()
 
     class Text(GuiElement):
@@ -635,7 +944,7 @@ class Gui:
             :param adjust_height: Whether to adjust this element's height to be more accurate (pygame usually draws text higher than what looks correct)
             """
 
-            self._pos: IVert = IVert(pos)
+            self._pos: IVec2 = IVec2(pos)
             self._draw_pos = Vert(0, 0)
             self.rendered_size = Vert(0, 0)
             self.adjust_height = adjust_height
@@ -659,6 +968,7 @@ class Gui:
             self._draw_pos = self._pos - self.rendered_size * Vert([OFFSETS[align] for align in self._text_align])
             if self.adjust_height:
                 self._draw_pos += Vert(0, self.font_size * self.HEIGHT_ADJUSTMENT)
+            self.invalidate()
             self.reevaluate_bounding_box()
 
         def calculate_size_per_font_size(self):
@@ -684,14 +994,14 @@ class Gui:
 
         @property
         def pos(self):
-            return IVert(self._pos)
+            return self._pos
 
         @pos.setter
         def pos(self, value):
             if not isinstance(value, AnyVert) or value.len != 2:
                 raise ValueError(f"Input pos ({value}) must be Vert of length 2")
             prev_value = self._pos
-            self._pos = IVert(value)
+            self._pos = IVec2(value)
             if prev_value != self._pos:
                 self.calculate_pos()
 
@@ -997,6 +1307,9 @@ class Gui:
             :param selected: Whether to select or deselect this element. True: select, False: deselect.
             :param button: What mouse button was clicked to select/deselect this element.
             """
+            # Selected text inputs have to be redrawn every frame so that the cursor can blink
+            self.animated = selected
+            self.invalidate()
             if selected:
                 self.is_selected = True
                 self.reset_cursor()
@@ -1051,17 +1364,18 @@ class Gui:
 
         @property
         def size(self):
-            return IVert(self._size)
+            return self._size
 
         @size.setter
         def size(self, value):
             prev_value = self._size
-            self._size = IVert(value)
+            self._size = IVec2(value)
 
             self.default_font_size = int(value.y * 0.75)
             self.text_element.font_size = self.default_font_size
 
             if prev_value != self._size:
+                self.invalidate()
                 self.reevaluate_bounding_box()
 
         @property
@@ -1148,49 +1462,248 @@ def get_button_functions(default_color, mouse_over_color, mouse_holding_color):
             "on_mouse_not_over": [element_on_mouse_not_over]
         }
 
+def merge_rects(rects: Sequence[pygame.Rect], max_rects: int | None = None) -> list[pygame.Rect]:
+    """
+    Merges any overlapping rects together. If there are still more than max_rects rects afterwards, they are all merged into one.
+
+    :param rects: The rects to merge.
+    :param max_rects: The maximum amount of rects to return. Leave None for DirtyRectRenderer.MAX_RECTS.
+    """
+    max_rects = DirtyRectRenderer.MAX_RECTS if max_rects is None else max_rects
+    merged: list[pygame.Rect] = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        # Keep merging until the rect no longer overlaps anything, as growing it can make it overlap rects it didn't before
+        while (index := rect.collidelist(merged)) != -1:
+            rect.union_ip(merged.pop(index))
+        merged.append(rect)
+
+    if len(merged) > max_rects:
+        return [merged[0].unionall(merged[1:])]
+    return merged
+
+class HitGrid:
+    CELL_SIZE = 64
+    """Width and height of each cell of the grid, in pixels."""
+
+    def __init__(self, container: Gui.ContainerElement):
+        """
+        A uniform grid storing which elements under a container could be under each area, so finding the element the
+        mouse is over only has to check the few elements in the mouse's cell. Built by ContainerElement.get_element_over.
+
+        :param container: The container whose active children (and their children) are put in the grid.
+        """
+        self.cells: dict[tuple[int, int], list[tuple[int, Gui.GuiElement, Vert]]] = {}
+        """The elements that could be under the mouse within each cell, along with their draw order and the position of their parent relative to the container. Elements drawn later come later in each list."""
+        self.unbounded: list[tuple[int, Gui.GuiElement, Vert]] = []
+        """Elements that can be under the mouse but do not have a bounding box, so are checked everywhere."""
+        self.last_mouse_pos: tuple[float, float] | None = None
+        self.last_element_over: Gui.GuiElement | None = None
+
+        self.draw_order = 0
+        self.add_contents(container, Vert(0, 0))
+
+    def add_contents(self, container: Gui.ContainerElement, offset: Vert):
+        for element in container.contents:
+            if not element.active:
+                continue
+            self.draw_order += 1
+            # Elements that use GuiElement's mouse_over_element can never be under the mouse
+            if not element.ignored_by_mouse and \
+                    type(element).mouse_over_element is not Gui.GuiElement.mouse_over_element:
+                entry = (self.draw_order, element, offset)
+                bounding_box = element.bounding_box_ignoring_children
+                if bounding_box is None:
+                    self.unbounded.append(entry)
+                else:
+                    # Padded by a pixel so rounding never leaves out part of the element
+                    top_left = offset + element.pos + bounding_box.top_left
+                    bottom_right = offset + element.pos + bounding_box.bottom_right
+                    for x in range(math.floor((top_left.x - 1) / self.CELL_SIZE),
+                                   math.floor((bottom_right.x + 1) / self.CELL_SIZE) + 1):
+                        for y in range(math.floor((top_left.y - 1) / self.CELL_SIZE),
+                                       math.floor((bottom_right.y + 1) / self.CELL_SIZE) + 1):
+                            self.cells.setdefault((x, y), []).append(entry)
+
+            if isinstance(element, Gui.ContainerElement):
+                self.add_contents(element, offset + element.pos)
+
+    def get_element_over(self, x: float, y: float) -> Gui.GuiElement | None:
+        """
+        Returns the element drawn last that the mouse is directly over, or None if there isn't one.
+
+        :param x: The x position of the mouse relative to the container.
+        :param y: The y position of the mouse relative to the container.
+        """
+        if self.last_mouse_pos == (x, y):
+            return self.last_element_over
+
+        candidates = self.cells.get((math.floor(x / self.CELL_SIZE), math.floor(y / self.CELL_SIZE)), [])
+        if self.unbounded:
+            candidates = sorted(candidates + self.unbounded, key=lambda entry: entry[0])
+
+        element_over = None
+        mouse_pos = Vert(x, y)
+        for _, element, offset in reversed(candidates):
+            if element.mouse_over_element(mouse_pos - offset):
+                element_over = element
+                break
+
+        self.last_mouse_pos, self.last_element_over = (x, y), element_over
+        return element_over
+
+class DirtyRectRenderer:
+    MAX_RECTS = 12
+    """Maximum amount of separate rects repainted in one frame before they are all combined into one."""
+    MAX_PASSES = 3
+    """Maximum amount of times a frame is repainted when drawing causes more elements to change (e.g. auto centering)."""
+
+    def __init__(self, background_color: tuple[int, int, int], show_stats: bool = False):
+        """
+        Draws a gui onto a canvas, only repainting the areas that have changed since the last frame.
+
+        :param background_color: The color drawn behind the gui.
+        :param show_stats: Whether to draw an overlay showing how much of the canvas was repainted each frame.
+        """
+        self.background_color = background_color
+        self.show_stats = show_stats
+
+        self.repainted_rects: list[pygame.Rect] = []
+        self.repainted_area: int = 0
+        """The area in pixels repainted last frame, not including the stats overlay."""
+        self.canvas_area: int = 0
+
+        self._full_redraw = True
+        self._last_root: Gui.GuiElement | None = None
+        self._last_canvas_size: tuple[int, int] | None = None
+        self._stats_font: pygame.font.Font | None = None
+        self._stats_rect: pygame.Rect | None = None
+
+    def invalidate_all(self):
+        """Makes the next frame repaint the whole canvas. Call whenever something other than this renderer draws onto the canvas."""
+        self._full_redraw = True
+
+    def render(self, canvas: pygame.Surface, root: Gui.GuiElement) -> list[pygame.Rect]:
+        """
+        Repaints any changed areas of root. Returns the list of rects that were repainted, to be passed into pygame.display.update().
+        """
+        canvas_rect = canvas.get_rect()
+        damaged_rects = root.take_damage()
+        if self._full_redraw or root is not self._last_root or canvas_rect.size != self._last_canvas_size:
+            damaged_rects = [canvas_rect]
+            self._full_redraw = False
+            self._last_root, self._last_canvas_size = root, canvas_rect.size
+        if self._stats_rect and not self.show_stats:
+            damaged_rects.append(self._stats_rect)
+            self._stats_rect = None
+
+        repainted_rects: list[pygame.Rect] = []
+        for _ in range(self.MAX_PASSES):
+            rects_to_repaint = []
+            for rect in merge_rects(damaged_rects):
+                rect = rect.clip(canvas_rect)
+                # Areas that were already repainted this frame were drawn with the element's newest position
+                if rect.width > 0 and rect.height > 0 and \
+                        not any(repainted_rect.contains(rect) for repainted_rect in repainted_rects):
+                    rects_to_repaint.append(rect)
+            if not rects_to_repaint:
+                damaged_rects = []
+                if not (root._dirty or root._subtree_dirty):
+                    break
+                # Elements that have never been drawn don't know where they'll be drawn yet. Drawing with an empty
+                #  clip finds that out (adding damage where they are) without painting anything.
+                rects_to_repaint = [pygame.Rect(0, 0, 0, 0)]
+
+            for rect in rects_to_repaint:
+                canvas.set_clip(rect)
+                canvas.fill(self.background_color)
+                root.draw(canvas, clip_rect=rect)
+            repainted_rects += [rect for rect in rects_to_repaint if rect.width and rect.height]
+            damaged_rects = root.take_damage(False)
+        canvas.set_clip(None)
+
+        # Anything still changing after the last pass gets repainted next frame
+        for rect in damaged_rects:
+            root.add_damage(rect)
+
+        self.repainted_rects = repainted_rects
+        self.repainted_area = sum(rect.width * rect.height for rect in merge_rects(repainted_rects, len(repainted_rects)))
+        self.canvas_area = canvas_rect.width * canvas_rect.height
+
+        if self.show_stats:
+            self._stats_rect = self.draw_stats(canvas)
+            repainted_rects = repainted_rects + [self._stats_rect]
+
+        return repainted_rects
+
+    def draw_stats(self, canvas: pygame.Surface) -> pygame.Rect:
+        """Draws the repainted area of the last frame in the top left of the canvas. Returns the rect drawn over."""
+        if self._stats_font is None:
+            self._stats_font = pygame.font.SysFont("calibri", 16)
+        percent_repainted = self.repainted_area / self.canvas_area * 100 if self.canvas_area else 0
+        rendered_stats = self._stats_font.render(
+            f"Repainted: {self.repainted_area} px ({percent_repainted:.1f}%) in {len(self.repainted_rects)} rect(s)",
+            True, Colors.white)
+
+        stats_rect = rendered_stats.get_rect().inflate(8, 4)
+        stats_rect.topleft = (0, 0)
+        # The overlay is redrawn on top of the gui every frame, so it never has to be repainted under unless it shrinks
+        if self._stats_rect:
+            stats_rect.union_ip(self._stats_rect)
+        canvas.fill(Colors.black, stats_rect)
+        canvas.blit(rendered_stats, (4, 2))
+        return stats_rect
+
 class InputHandler:
-    # The code for MouseEventHandler and KeyboardEventHandler is almost identical, the only difference is how
-    #  I track which buttons are down at a given moment
+    # The code for MouseEventHandler and KeyboardEventHandler is almost identical, the only difference is which pygame
+    #  events they turn into inputs being pressed and released
     def __init__(self,
                  main: Sequence[Callable] | Callable = (),
                  on_input_down: Sequence[Callable] | Callable = (),
                  on_input_up: Sequence[Callable] | Callable = (),
                  while_input_down: Sequence[Callable] | Callable = ()):
-        self.inputs_down = []
-        self.p_inputs_down = []
+        self.inputs_down: set = set()
+        self.input_changes: list[tuple[any, bool]] = []
+        """Inputs pressed (True) or released (False) since main was last called, in the order they happened."""
 
         self.main_funcs = get_list_of_input(main)
         self.on_input_down_funcs = get_list_of_input(on_input_down)
         self.on_input_up_funcs = get_list_of_input(on_input_up)
         self.while_input_down_funcs = get_list_of_input(while_input_down)
 
-    def find_inputs_down(self):
-        ...
+    def handle_pygame_event(self, event: pygame.event.Event):
+        """Updates which inputs are down from a pygame event. Call this for every event while this handler is active."""
+        if event.type == pygame.WINDOWFOCUSLOST:
+            self.release_all()
 
-    def main(self, *_):
-        self.find_inputs_down()
+    def press(self, inp):
+        if inp not in self.inputs_down:
+            self.inputs_down.add(inp)
+            self.input_changes.append((inp, True))
 
-        inputs_pressed: list = []
-        inputs_released: list = []
+    def release(self, inp):
+        if inp in self.inputs_down:
+            self.inputs_down.remove(inp)
+            self.input_changes.append((inp, False))
 
-        for i in self.inputs_down:
-            if i not in self.p_inputs_down:
-                inputs_pressed.append(i)
-        for p_i in self.p_inputs_down:
-            if p_i not in self.inputs_down:
-                inputs_released.append(p_i)
+    def release_all(self):
+        """Releases every input that is down. Call when this handler stops being sent events."""
+        for inp in list(self.inputs_down):
+            self.release(inp)
 
+    def main(self, *_):
         for main_func in self.main_funcs:
             main_func()
 
-        for input_pressed in inputs_pressed:
-            self.on_input_down(input_pressed)
+        if self.input_changes:
+            input_changes, self.input_changes = self.input_changes, []
+            for inp, pressed in input_changes:
+                if pressed:
+                    self.on_input_down(inp)
+                else:
+                    self.on_input_up(inp)
         for input_down in self.inputs_down:
             self.while_input_down(input_down)
-        for input_released in inputs_released:
-            self.on_input_up(input_released)
-
-        self.p_inputs_down = copy.copy(self.inputs_down)
 
     def on_input_down(self, inp):
         for on_input_down_func in self.on_input_down_funcs:
@@ -1214,17 +1727,21 @@ class MouseEventHandler(InputHandler):
                  while_mouse_up: Sequence[Callable] | Callable = ()):
         super().__init__(main, on_mouse_down, on_mouse_up, while_mouse_down)
         self.while_input_up_funcs = get_list_of_input(while_mouse_up)
-        self.mouse_buttons_list: list[bool, bool, bool] = []
 
-    def find_inputs_down(self):
-        self.mouse_buttons_list = pygame.mouse.get_pressed(3)
-        self.inputs_down = [i for i, val in enumerate(self.mouse_buttons_list) if val]
+    def handle_pygame_event(self, event: pygame.event.Event):
+        # Buttons 1-3 are left, middle and right. Higher buttons are the scroll wheel and extra buttons.
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button <= 3:
+            self.press(event.button - 1)
+        elif event.type == pygame.MOUSEBUTTONUP and event.button <= 3:
+            self.release(event.button - 1)
+        else:
+            super().handle_pygame_event(event)
 
     def main(self, *_):
         super().main()
         if self.while_input_up_funcs:
-            for i, val in enumerate(self.mouse_buttons_list):
-                if not val:
+            for i in range(3):
+                if i not in self.inputs_down:
                     self.while_input_up(i)
 
     def while_input_up(self, inp):
@@ -1240,6 +1757,7 @@ class GuiMouseEventHandler(MouseEventHandler):
                  main: Sequence[Callable] | Callable = ()):
         super().__init__(main, on_mouse_down, on_mouse_up, while_mouse_down, while_mouse_up)
         self.mouse_pos = self.p_mouse_pos = Vert(pygame.mouse.get_pos())
+        """Updated from mouse events, so it only changes while this handler is being sent events."""
 
         self.elements_holding_per_button: list[Gui.GuiElement | Gui.MouseInteractable | None] = [None, None, None]
         self.element_over = self.p_element_over = None
@@ -1264,9 +1782,17 @@ class GuiMouseEventHandler(MouseEventHandler):
         self.p_guis = self.guis
         self.p_element_over = self.element_over
 
-    def main_gui(self):
+    def handle_pygame_event(self, event: pygame.event.Event):
+        if event.type in (pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+            self.mouse_pos = Vert(event.pos)
+        super().handle_pygame_event(event)
+
+    def release_all(self):
+        super().release_all()
+        # The mouse may have moved while this handler wasn't being sent events
         self.mouse_pos = Vert(pygame.mouse.get_pos())
 
+    def main_gui(self):
         for active_gui in reversed(self.guis):
             self.element_over = active_gui.get_element_over(self.mouse_pos, active_gui.pos)
             if self.element_over is not None:
@@ -1351,11 +1877,13 @@ class KeyboardEventHandler(InputHandler):
         self.main_funcs.append(self.keyboard_main)
         self.keys_down_timing = {}
 
-    def handle_pygame_keyboard_event(self, event):
+    def handle_pygame_event(self, event: pygame.event.Event):
         if event.type == pygame.KEYDOWN:
-            self.inputs_down.append(event.key)
+            self.press(event.key)
         elif event.type == pygame.KEYUP:
-            self.inputs_down.remove(event.key)
+            self.release(event.key)
+        else:
+            super().handle_pygame_event(event)
 
     def keyboard_main(self):
         for key in self.keys_down_timing:
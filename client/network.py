@@ -3,11 +3,22 @@ import socket
 from typing import Callable
 import shared_assets
 import pickle
+import _thread
+import datagram_channel
+from datagram_channel import DatagramPeer
+import frame_compression
+from frame_compression import FrameEncoder, FrameDecoder
+import console_log
 
 class Network:
+    UDP_HELLO_ATTEMPTS = 10
+    UDP_HELLO_INTERVAL = 0.2
+
     def __init__(self,
                  on_server_not_found: Callable = None,
-                 on_server_disconnect: Callable = None):
+                 on_server_disconnect: Callable = None,
+                 use_udp: bool = True,
+                 use_compression: bool = True):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server = "localhost"  # "216.71.110.17"
         self.port = shared_assets.port
@@ -16,27 +27,66 @@ class Network:
         self.on_server_not_found = on_server_not_found
 
         self.client_id = None
+        self.use_udp = use_udp
+        self.datagram_peer: DatagramPeer | None = None
+        """UDP channel for game data, or None to send everything over TCP."""
+        self.use_compression = use_compression
+        self.frame_encoder: FrameEncoder | None = None
+        self.frame_decoder: FrameDecoder | None = None
+        """Set once compression has been negotiated, after which everything sent over TCP is in frames."""
+        self.send_lock = _thread.allocate_lock()
+        """Held while encoding and sending a frame, as frames must be sent in the order they're encoded."""
         self.connect()
 
     def connect(self):
-        print("Connecting to server...")
+        console_log.info("Connecting to server...")
         while True:
             try:
                 self.client.connect(self.address)
                 break
             except ConnectionRefusedError:
-                print("Could not find server, trying again...")
+                console_log.info("Could not find server, trying again...")
                 if self.on_server_not_found:
                     self.on_server_not_found()
             except OSError:
-                print("Unable to reconnect to client. Creating a new client.")
+                console_log.info("Unable to reconnect to client. Creating a new client.")
                 self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         connected_message = self.recv()[0]
-        print(f"Connected with address {connected_message.address} and client_id {connected_message.client_id}!")
+        console_log.info(f"Connected with address {connected_message.address} and client_id {connected_message.client_id}!")
         self.client_id = connected_message.client_id
 
-        self.send(shared_assets.Messages.ConnectedMessage(None, None))
+        compression = getattr(connected_message, "compression", None)
+        if not self.use_compression or compression != frame_compression.COMPRESSION_METHOD:
+            compression = None
+        self.send(shared_assets.Messages.ConnectedMessage(None, None, compression=compression))
+        if compression is not None:
+            self.frame_encoder = FrameEncoder()
+            self.frame_decoder = FrameDecoder()
+
+        if self.use_udp and getattr(connected_message, "udp_port", None) is not None:
+            self.open_datagram_channel(connected_message.udp_port, connected_message.udp_token)
+
+    def open_datagram_channel(self, udp_port: int, udp_token: bytes):
+        """Sends the server the UDP token it gave this client until it replies, then sends game data over UDP."""
+        datagram_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        datagram_socket.settimeout(self.UDP_HELLO_INTERVAL)
+        hello = datagram_channel.HEADER.pack(datagram_channel.HELLO, self.client_id, 0) + udp_token
+
+        for _ in range(self.UDP_HELLO_ATTEMPTS):
+            try:
+                datagram_socket.sendto(hello, (self.server, udp_port))
+                packet, address = datagram_socket.recvfrom(65536)
+            except (socket.timeout, ConnectionResetError):
+                continue
+            if (parsed := datagram_channel.parse_packet(packet)) and parsed[0] == datagram_channel.HELLO:
+                datagram_socket.settimeout(DatagramPeer.RESEND_INTERVAL)
+                self.datagram_peer = DatagramPeer(datagram_socket, address, self.client_id)
+                console_log.info(f"Opened UDP channel to server at address {address}")
+                return
+
+        console_log.warning("Could not open UDP channel to server, sending all game data over TCP.")
+        datagram_socket.close()
 
     def send(self, message: shared_assets.Messages.Message):
         if not isinstance(message, shared_assets.Messages.Message):
@@ -45,54 +95,102 @@ class Network:
         try:
             outgoing_message = pickle.dumps(message)
         except Exception as err:
-            print(f"Error: Error when attempting to pickle {message.name}: {repr(err)}")
+            console_log.error(f"Error when attempting to pickle {message.name}: {repr(err)}")
             return False
 
+        if isinstance(message, shared_assets.Messages.GameDataMessage) and self.datagram_peer is not None and \
+                len(outgoing_message) <= datagram_channel.MAX_PAYLOAD_SIZE:
+            self.datagram_peer.send(outgoing_message, not message.droppable, message.type_key)
+            return True
+
         try:
-            self.client.send(outgoing_message)
+            if self.frame_encoder is not None:
+                with self.send_lock:
+                    self.client.sendall(self.frame_encoder.encode(outgoing_message))
+            else:
+                self.client.send(outgoing_message)
         except ConnectionResetError:
-            print(f"Could not find server to send message of type {message.name}. Assuming server is disconnected.")
+            console_log.info(f"Could not find server to send message of type {message.name}. Assuming server is disconnected.")
             if self.on_server_disconnect:
                 self.on_server_disconnect()
             return False
         except Exception as err:
-            print(f"Error: Error when attempting to send {message.name} to server: {repr(err)}")
+            console_log.error(f"Error when attempting to send {message.name} to server: {repr(err)}")
             return False
 
-        if message.notify_to_console:
-            print(f"  [S] Sent message of type {message.name} to the server")
+        console_log.log_message(message, False, "the server")
 
         return True
 
     def recv(self) -> list:
         try:
             incoming_message = self.client.recv(4096)
+            if not incoming_message:
+                raise ConnectionResetError("Server closed the connection")
         except ConnectionResetError as err:
-            print(f"Could not find server to receive message from (ConnectionResetError: {err}). Assuming server is disconnected.")
+            console_log.info(f"Could not find server to receive message from (ConnectionResetError: {err}). Assuming server is disconnected.")
             if self.on_server_disconnect:
                 self.on_server_disconnect()
             return shared_assets.Messages.ErrorMessage(err)
         except Exception as err:
-            print(f"Error: Error when attempting to receive message from server: {repr(err)}")
+            console_log.error(f"Error when attempting to receive message from server: {repr(err)}")
             return shared_assets.Messages.ErrorMessage(err)
 
+        if self.frame_decoder is not None:
+            try:
+                incoming_message = b"".join(self.frame_decoder.feed(incoming_message))
+            except Exception as err:
+                console_log.error(f"Error when attempting to decompress message from server: {repr(err)}")
+                return shared_assets.Messages.ErrorMessage(err)
+
         data_pieces = []
         try:
-            unpickler = pickle.Unpickler(io.BytesIO(incoming_message))
+            incoming_message = io.BytesIO(incoming_message)
             while True:
-                data_pieces.append(unpickler.load())
+                # A new unpickler for each message, as one keeps its memo between loads, which breaks later messages
+                data_pieces.append(pickle.load(incoming_message))
         except EOFError:
             ...
         except Exception as err:
-            print(f"Error: Error when attempting to unpickle message from server: {repr(err)}")
+            console_log.error(f"Error when attempting to unpickle message from server: {repr(err)}")
             return shared_assets.Messages.ErrorMessage(err)
 
         if not all([isinstance(message, shared_assets.Messages.Message) for message in data_pieces]):
-            print(f"Error: Received data that is not a Message class from server: {', '.join(data_pieces)}")
+            console_log.error(f"Received data that is not a Message class from server: {', '.join(data_pieces)}")
             return shared_assets.Messages.ErrorMessage()
 
         for message in data_pieces:
-            if message.notify_to_console:
-                print(f"  [R] Received message of type {message.name} from server.")
+            console_log.log_message(message, True, "the server")
 
         return data_pieces
+
+    def recv_datagrams(self) -> list:
+        """
+        Waits up to DatagramPeer.RESEND_INTERVAL for a packet on the UDP channel, and returns the messages ready to be
+        handled, in order. Also resends reliable packets that haven't been acknowledged, so call this in a loop.
+        """
+        peer = self.datagram_peer
+        try:
+            packet, address = peer.socket.recvfrom(65536)
+        except (socket.timeout, ConnectionResetError):
+            packet, address = None, None
+        except OSError as err:
+            console_log.error(f"Error when attempting to receive datagram from server: {repr(err)}")
+            return []
+        peer.resend_unacknowledged()
+
+        if not packet or address != peer.address or not (parsed := datagram_channel.parse_packet(packet)):
+            return []
+        kind, _, sequence, payload = parsed
+
+        messages = []
+        for payload in peer.receive(kind, sequence, payload):
+            try:
+                message = pickle.loads(payload)
+            except Exception as err:
+                console_log.error(f"Error when attempting to unpickle datagram from server: {repr(err)}")
+                continue
+            if isinstance(message, shared_assets.Messages.Message):
+                console_log.log_message(message, True, "the server over UDP")
+                messages.append(message)
+        return messages
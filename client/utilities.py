@@ -1,4 +1,6 @@
 import math
+# Lives next to shared_assets so the server can use it too
+from spatial_hash import SpatialHash
 
 class Colors:
     white = (255, 255, 255)
@@ -10,6 +12,7 @@ class Colors:
 class AnyVert:
     """Vertex that can store any amount of floating point or integer values,
        with functionality for value-wise operations (e.g. <2, 3> * <4, 5> = <8, 15>)"""
+    __slots__ = ("_list", "vert_type")
 
     @classmethod
     def get_list(cls, *components):
@@ -217,11 +220,15 @@ class AnyVert:
         return Vert(new_list)
 
 class IVert(AnyVert):
+    __slots__ = ()
+
     def __init__(self, *components):
         super().__init__(components)
         self.vert_type = IVert
 
 class Vert(AnyVert):
+    __slots__ = ()
+
     def __init__(self, *components):
         super().__init__(components)
         self.vert_type = Vert
@@ -303,7 +310,358 @@ class Vert(AnyVert):
             raise IndexError("Vertex is not 3D")
         self._list[2] = value
 
+class AnyVec2(AnyVert):
+    """
+    2D vertex that stores its components in slots instead of a list, making it much faster to create and do math with
+    than a Vert. Can be used anywhere an AnyVert of length 2 can, and can do math with any AnyVert of length 2.
+    """
+    __slots__ = ("_x", "_y")
+
+    def __init__(self, *components):
+        if len(components) == 2 and type(components[0]) in (int, float) and type(components[1]) in (int, float):
+            self._x, self._y = components
+        elif len(components) == 1 and isinstance(components[0], AnyVec2):
+            self._x, self._y = components[0]._x, components[0]._y
+        else:
+            components = self.get_list(*components)
+            if len(components) != 2:
+                raise ValueError(f"{type(self).__name__} must have exactly 2 components, not {len(components)}")
+            self._x, self._y = components
+
+    @classmethod
+    def _new(cls, x, y):
+        """Creates a vertex of this type without checking the components."""
+        vert = cls.__new__(cls)
+        vert._x = x
+        vert._y = y
+        return vert
+
+    def __reduce__(self):
+        # Otherwise copy and pickle would try to save the unused slots inherited from AnyVert
+        return type(self), (self._x, self._y)
+
+    @property
+    def vert_type(self):
+        return type(self)
+
+    @property
+    def list(self):
+        return [self._x, self._y]
+
+    @property
+    def len(self):
+        return 2
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    @property
+    def z(self):
+        raise IndexError("Vertex is not 3D")
+
+    @property
+    def w(self):
+        return self._x
+
+    @property
+    def h(self):
+        return self._y
+
+    @property
+    def d(self):
+        raise IndexError("Vertex is not 3D")
+
+    @property
+    def magnitude(self):
+        return math.hypot(self._x, self._y)
+
+    @property
+    def unit(self):
+        return self if self._x == 0 and self._y == 0 else self / self.magnitude
+
+    @property
+    def ceil(self):
+        return self._new(math.ceil(self._x), math.ceil(self._y))
+
+    @property
+    def floor(self):
+        return self._new(math.floor(self._x), math.floor(self._y))
+
+    @property
+    def round(self):
+        return self._new(round(self._x), round(self._y))
+
+    @property
+    def tuple(self):
+        return self._x, self._y
+
+    def __str__(self):
+        return f"<{self._x}, {self._y}>"
+
+    def __add__(self, other):
+        if isinstance(other, AnyVec2):
+            return self._new(self._x + other._x, self._y + other._y)
+        elif isinstance(other, (float, int)):
+            return self._new(self._x + other, self._y + other)
+        elif isinstance(other, AnyVert):
+            if other.len != 2:
+                raise ValueError("Length of vertices must be the same")
+            return self._new(self._x + other[0], self._y + other[1])
+        else:
+            raise ValueError("Can only add numbers or other vertices")
+
+    def __radd__(self, other):
+        return self + other
+
+    def __mul__(self, other):
+        if isinstance(other, AnyVec2):
+            return self._new(self._x * other._x, self._y * other._y)
+        elif isinstance(other, (float, int)):
+            return self._new(self._x * other, self._y * other)
+        elif isinstance(other, AnyVert):
+            if other.len != 2:
+                raise ValueError("Length of vertices must be the same")
+            return self._new(self._x * other[0], self._y * other[1])
+        else:
+            raise ValueError("Can only multiply numbers or other vertices")
+
+    def __rmul__(self, other):
+        return self * other
+
+    def __sub__(self, other):
+        if isinstance(other, AnyVec2):
+            return self._new(self._x - other._x, self._y - other._y)
+        elif isinstance(other, (float, int)):
+            return self._new(self._x - other, self._y - other)
+        elif isinstance(other, AnyVert):
+            if other.len != 2:
+                raise ValueError("Length of vertices must be the same")
+            return self._new(self._x - other[0], self._y - other[1])
+        else:
+            raise ValueError("Can only subtract numbers or other vertices")
+
+    def __rsub__(self, other):
+        if isinstance(other, (float, int)):
+            return self._new(other - self._x, other - self._y)
+        else:
+            raise ValueError("Can only subtract numbers or other vertices")
+
+    def __truediv__(self, other):
+        if isinstance(other, AnyVec2):
+            return self._new(self._x / other._x, self._y / other._y)
+        elif isinstance(other, (float, int)):
+            return self._new(self._x / other, self._y / other)
+        elif isinstance(other, AnyVert):
+            if other.len != 2:
+                raise ValueError("Length of vertices must be the same")
+            return self._new(self._x / other[0], self._y / other[1])
+        else:
+            raise ValueError("Can only divide by numbers or other vertices")
+
+    def __rtruediv__(self, other):
+        if isinstance(other, (float, int)):
+            return self._new(other / self._x, other / self._y)
+        else:
+            raise ValueError("Can only divide by numbers or other vertices")
+
+    def __mod__(self, other):
+        if isinstance(other, AnyVert):
+            if other.len != 2:
+                raise IndexError("Vert lengths are not the same")
+            return self._new(self._x % other[0], self._y % other[1])
+        elif isinstance(other, (int, float)):
+            return self._new(self._x % other, self._y % other)
+        else:
+            raise ValueError("Other must be Vert, int, or float")
+
+    def __neg__(self):
+        return self._new(-self._x, -self._y)
+
+    def __getitem__(self, item: int):
+        if item == 0:
+            return self._x
+        elif item == 1:
+            return self._y
+        return (self._x, self._y)[item]
+
+    def __setitem__(self, key: int, value):
+        raise TypeError(f"{type(self).__name__} does not support item assignment")
+
+    def __iter__(self):
+        yield self._x
+        yield self._y
+
+    def __round__(self, n=None):
+        return self._new(round(self._x, n), round(self._y, n))
+
+    def __eq__(self, other):
+        if isinstance(other, AnyVec2):
+            return self._x == other._x and self._y == other._y
+        return isinstance(other, AnyVert) and other.len == 2 and self._x == other[0] and self._y == other[1]
+
+    __hash__ = None
+
+    def __len__(self):
+        return 2
+
+class IVec2(AnyVec2):
+    """Immutable AnyVec2. As it can't be changed, it is safe to share between elements without copying."""
+    __slots__ = ()
+
+class Vec2(AnyVec2):
+    """
+    Mutable AnyVec2. Unlike Vert, in-place operators (+=, -=, *=, /=) change this vertex rather than creating a new
+    one, so be careful when the same Vec2 is stored in multiple places.
+    """
+    __slots__ = ()
+
+    @property
+    def list(self):
+        return [self._x, self._y]
+
+    @list.setter
+    def list(self, value):
+        self._x, self._y = AnyVec2(value)
+
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x = value
+
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        self._y = value
+
+    @property
+    def w(self):
+        return self._x
+
+    @w.setter
+    def w(self, value):
+        self._x = value
+
+    @property
+    def h(self):
+        return self._y
+
+    @h.setter
+    def h(self, value):
+        self._y = value
+
+    def __setitem__(self, key: int, value):
+        if key in (0, -2):
+            self._x = value
+        elif key in (1, -1):
+            self._y = value
+        else:
+            raise IndexError("Vec2 index out of range")
+
+    def __iadd__(self, other):
+        if isinstance(other, (float, int)):
+            self._x += other
+            self._y += other
+        else:
+            self._x += other[0]
+            self._y += other[1]
+        return self
+
+    def __isub__(self, other):
+        if isinstance(other, (float, int)):
+            self._x -= other
+            self._y -= other
+        else:
+            self._x -= other[0]
+            self._y -= other[1]
+        return self
+
+    def __imul__(self, other):
+        if isinstance(other, (float, int)):
+            self._x *= other
+            self._y *= other
+        else:
+            self._x *= other[0]
+            self._y *= other[1]
+        return self
+
+    def __itruediv__(self, other):
+        if isinstance(other, (float, int)):
+            self._x /= other
+            self._y /= other
+        else:
+            self._x /= other[0]
+            self._y /= other[1]
+        return self
+
+class SweptCollision:
+    __slots__ = ("time", "normal")
+
+    def __init__(self, time: float, normal: Vec2):
+        """
+        Where something moving first touches something else.
+
+        :param time: How far through its movement it touches, from 0 (where it started) to 1 (where it would have ended).
+        :param normal: The unit vector pointing out of the side it touched (e.g. <-1, 0> for the left side of a square).
+        """
+        self.time = time
+        self.normal = normal
+
 class Colliding:
+    @staticmethod
+    def ray_square(ray_pos, ray_vel, square_pos, square_size) -> SweptCollision | None:
+        """
+        Returns where a point moving from ray_pos to ray_pos + ray_vel first enters the square, or None if it doesn't. A
+        point starting inside the square doesn't collide with it, and neither does one moving along its edge.
+        """
+        times_in: list[float] = []
+        times_out: list[float] = []
+        for start, movement, low, high in ((ray_pos[0], ray_vel[0], square_pos[0], square_pos[0] + square_size[0]),
+                                           (ray_pos[1], ray_vel[1], square_pos[1], square_pos[1] + square_size[1])):
+            if movement == 0:
+                # Never enters or leaves this axis' range, so is either always in it or never is
+                if not low < start < high:
+                    return None
+                times_in.append(-math.inf)
+                times_out.append(math.inf)
+            elif movement > 0:
+                times_in.append((low - start) / movement)
+                times_out.append((high - start) / movement)
+            else:
+                times_in.append((high - start) / movement)
+                times_out.append((low - start) / movement)
+
+        time_in, time_out = max(times_in), min(times_out)
+        if time_in >= time_out or not 0 <= time_in <= 1:
+            return None
+        # The side hit is on the axis that entered last
+        if times_in[0] > times_in[1]:
+            return SweptCollision(time_in, Vec2(-1.0 if ray_vel[0] > 0 else 1.0, 0.0))
+        return SweptCollision(time_in, Vec2(0.0, -1.0 if ray_vel[1] > 0 else 1.0))
+
+    @staticmethod
+    def swept_square_square(square1_pos, square1_size, square1_vel, square2_pos, square2_size,
+                            square2_vel=(0, 0)) -> SweptCollision | None:
+        """
+        Returns where square1 first touches square2 while both move by their velocities, or None if they don't, so
+        squares moving fast enough to pass through each other in one step still collide. The normal is for the side of
+        square2 that was hit. Squares that already overlap (as checked by square_square) don't collide.
+        """
+        # The same as a point at square1's corner moving relative to square2, grown by square1's size
+        return Colliding.ray_square(square1_pos, (square1_vel[0] - square2_vel[0], square1_vel[1] - square2_vel[1]),
+                                    (square2_pos[0] - square1_size[0], square2_pos[1] - square1_size[1]),
+                                    (square2_size[0] + square1_size[0], square2_size[1] + square1_size[1]))
+
     @staticmethod
     def circle_square(circle_pos, circle_rad, square_pos, square_size):
         pos = Vert(constrain(circle_pos.x, square_pos.x, square_pos.x + square_size.x),
@@ -0,0 +1,158 @@
+from __future__ import annotations
+import collections
+import sys
+import time
+import _thread
+from typing import TextIO, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from shared_assets import Messages
+
+# region Levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 50
+"""Lines at or above this level are never logged, so setting a level to it turns that logging off."""
+# endregion
+
+level_names = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+minimum_level = INFO
+"""Lines below this level are dropped before being formatted or queued."""
+message_levels: dict[str, int] = {}
+"""
+Levels of the lines logged for every message sent or received, by message name, overriding each message class'
+log_level. Set one to OFF to never log a type, or to DEBUG to hide it unless debugging.
+"""
+message_sampling: dict[str, int] = {}
+"""Only every nth message of a type is logged, by message name, so busy types can be watched without flooding."""
+show_time = True
+output: TextIO = sys.stdout
+
+MAX_QUEUED_LINES = 10_000
+"""Lines logged while this many are waiting to be written are dropped (and counted), rather than using more memory."""
+
+_queue: collections.deque[tuple[float, int, str]] = collections.deque()
+_lock = _thread.allocate_lock()
+_write_lock = _thread.allocate_lock()
+"""Held from taking lines off the queue until they're written, so lines taken earlier are never written later."""
+_wake_lock = _thread.allocate_lock()
+_wake_lock.acquire()
+_writer_waiting = False
+_writer_started = False
+_message_counts: dict[str, int] = {}
+dropped_lines = 0
+
+def log(level: int, text: str):
+    """
+    Queues a line to be written by the background writer, so the caller never waits on the console.
+    \nLines are written in the order they are logged, prefixed with the time they were logged at if show_time is set.
+    """
+    global _writer_waiting, _writer_started, dropped_lines
+    if level < minimum_level or level >= OFF:
+        return
+    with _lock:
+        if len(_queue) >= MAX_QUEUED_LINES:
+            dropped_lines += 1
+            return
+        _queue.append((time.time(), level, text))
+        if not _writer_started:
+            _writer_started = True
+            _thread.start_new_thread(_write_queued_lines, ())
+        wake = _writer_waiting
+        _writer_waiting = False
+    if wake:
+        _wake_lock.release()
+
+def debug(text: str):
+    log(DEBUG, text)
+
+def info(text: str):
+    log(INFO, text)
+
+def warning(text: str):
+    log(WARNING, text)
+
+def error(text: str):
+    log(ERROR, text)
+
+def is_enabled(level: int) -> bool:
+    """Whether lines at this level are logged, to skip building text that would be dropped anyway."""
+    return minimum_level <= level < OFF
+
+def log_message(message: Messages.Message, received: bool, peer: str):
+    """
+    Logs a message sent to or received from peer, at the level set for its type in message_levels (or its class'
+    log_level), and only every nth time if it is in message_sampling. Does nothing but a few lookups if it isn't logged.
+    """
+    name = message.name
+    level = message_levels.get(name, message.log_level)
+    if level < minimum_level or level >= OFF:
+        return
+    if (every := message_sampling.get(name, 1)) > 1:
+        with _lock:
+            count = _message_counts[name] = _message_counts.get(name, 0) + 1
+        if count % every != 1:
+            return
+    if received:
+        log(level, f"  [R] Received message of type {name} from {peer}")
+    else:
+        log(level, f"  [S] Sent message of type {name} to {peer}")
+
+def parse_level(text: str) -> int | None:
+    """Returns the level named by text (e.g. "debug", or a number), or None if it doesn't name one."""
+    text = text.lower()
+    for level, name in level_names.items():
+        if name == text:
+            return level
+    if text in ("off", "none"):
+        return OFF
+    return int(text) if text.isdigit() else None
+
+def flush():
+    """Writes every queued line now, from the calling thread. Call before exiting so no lines are lost."""
+    _write_queued()
+
+def _format(logged_time: float, level: int, text: str) -> str:
+    if level >= WARNING:
+        text = f"{level_names.get(level, str(level)).capitalize()}: {text}"
+    if show_time:
+        text = f"{time.strftime('%H:%M:%S', time.localtime(logged_time))}.{int(logged_time % 1 * 1000):03} {text}"
+    return text
+
+def _write_queued(wait_if_empty: bool = False) -> bool:
+    """
+    Writes every queued line, and how many were dropped. Returns whether there was anything to write.
+
+    :param wait_if_empty: Whether to mark the writer as waiting if there wasn't, so the next line logged wakes it.
+    """
+    global dropped_lines, _writer_waiting
+    with _write_lock:
+        with _lock:
+            lines = list(_queue)
+            _queue.clear()
+            dropped, dropped_lines = dropped_lines, 0
+            if not lines and not dropped and wait_if_empty:
+                _writer_waiting = True
+        if not lines and not dropped:
+            return False
+        _write(lines, dropped)
+    return True
+
+def _write(lines: list[tuple[float, int, str]], dropped: int):
+    text = "".join(_format(*line) + "\n" for line in lines)
+    if dropped:
+        text += _format(time.time(), WARNING, f"{dropped} log lines were dropped, as too many were waiting") + "\n"
+    try:
+        output.write(text)
+        output.flush()
+    except (OSError, ValueError):
+        ...  # Output closed; nowhere left to report it
+
+def _write_queued_lines():
+    """Writes queued lines in batches, waiting while there are none."""
+    while True:
+        if not _write_queued(True):
+            _wake_lock.acquire()
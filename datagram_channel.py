@@ -0,0 +1,143 @@
+from __future__ import annotations
+import random
+import socket
+import struct
+import time
+import zlib
+import _thread
+import console_log
+
+# region Packet kinds
+HELLO = 0
+"""Sent by a client with its UDP token to open its channel, and sent back by the server once it has."""
+UNRELIABLE = 1
+RELIABLE = 2
+ACK = 3
+"""Acknowledges every reliable packet up to its sequence, and the one whose sequence is its payload."""
+# endregion
+
+HEADER = struct.Struct("!BHI")
+"""Every packet starts with its kind, the client id, and a sequence number (the acknowledged sequence for ACKs)."""
+ACK_PAYLOAD = struct.Struct("!I")
+STREAM = struct.Struct("!I")
+"""Unreliable payloads start with the id of their stream, a hash of the stream name they were sent with."""
+MAX_PAYLOAD_SIZE = 1200 - HEADER.size - STREAM.size
+"""Payloads bigger than this shouldn't be sent over UDP, as they'd likely be fragmented. Send them over TCP instead."""
+
+class DatagramPeer:
+    RESEND_INTERVAL = 0.1
+    """Seconds between resends of reliable packets that haven't been acknowledged."""
+
+    def __init__(self, sock: socket.socket, address: tuple[str, int], client_id: int):
+        """
+        One end of a UDP channel between the server and a client, used for game data alongside the TCP connection.
+        \nUnreliable packets have their own sequence numbers, and are sent on a named stream. Any that arrive after a newer
+        one on the same stream are dropped as stale.
+        Reliable packets are resent until acknowledged, and are delivered in order, exactly once.
+        Sequence numbers are 32 bit and don't wrap, which at 60 packets per second lasts over two years.
+
+        :param sock: The UDP socket to send from. Receiving is left to the caller, who passes packets to receive().
+        :param address: The (host, port) to send to.
+        :param client_id: The client id of the client end of this channel. Every packet includes it.
+        """
+        self.socket = sock
+        self.address = address
+        self.client_id = client_id
+        self.lock = _thread.allocate_lock()
+        self.simulated_loss = 0.0
+        """Chance of dropping each packet sent, to test on localhost."""
+
+        self.next_unreliable_sequence = 1
+        self.latest_unreliable_sequences: dict[int, int] = {}
+        """Sequence of the newest unreliable packet received on each stream, by stream id. Older ones are dropped."""
+
+        self.next_reliable_sequence = 1
+        self.unacknowledged: dict[int, tuple[bytes, float]] = {}
+        """Reliable packets sent but not yet acknowledged, and when they were last sent, by sequence."""
+        self.next_expected_reliable_sequence = 1
+        self.reliable_out_of_order: dict[int, bytes] = {}
+        """Reliable payloads received before ones sent earlier, by sequence. Delivered once the gap is filled."""
+
+        self.packets_sent = 0
+        self.packets_resent = 0
+        self.stale_packets_dropped = 0
+
+    def send(self, payload: bytes, reliable: bool, stream: str = ""):
+        """
+        :param stream: For unreliable payloads, what kind they are. Only newer payloads on the same stream make one stale.
+        """
+        with self.lock:
+            if reliable:
+                sequence = self.next_reliable_sequence
+                self.next_reliable_sequence += 1
+                packet = HEADER.pack(RELIABLE, self.client_id, sequence) + payload
+                self.unacknowledged[sequence] = (packet, time.perf_counter())
+            else:
+                sequence = self.next_unreliable_sequence
+                self.next_unreliable_sequence += 1
+                packet = HEADER.pack(UNRELIABLE, self.client_id, sequence) + \
+                    STREAM.pack(zlib.crc32(stream.encode())) + payload
+        self._send_packet(packet)
+
+    def receive(self, kind: int, sequence: int, payload: bytes) -> list[bytes]:
+        """Handles a packet from the other end, and returns the payloads ready to be delivered, in order."""
+        if kind == UNRELIABLE:
+            if len(payload) < STREAM.size:
+                return []
+            stream_id = STREAM.unpack_from(payload)[0]
+            with self.lock:
+                if sequence <= self.latest_unreliable_sequences.get(stream_id, 0):
+                    self.stale_packets_dropped += 1
+                    return []
+                self.latest_unreliable_sequences[stream_id] = sequence
+            return [payload[STREAM.size:]]
+
+        if kind == ACK:
+            with self.lock:
+                for acknowledged in [s for s in self.unacknowledged if s <= sequence]:
+                    del self.unacknowledged[acknowledged]
+                if len(payload) == ACK_PAYLOAD.size:
+                    self.unacknowledged.pop(ACK_PAYLOAD.unpack(payload)[0], None)
+            return []
+
+        if kind == RELIABLE:
+            payloads = []
+            with self.lock:
+                if sequence >= self.next_expected_reliable_sequence:
+                    self.reliable_out_of_order[sequence] = payload
+                while (payload := self.reliable_out_of_order.pop(self.next_expected_reliable_sequence, None)) is not None:
+                    payloads.append(payload)
+                    self.next_expected_reliable_sequence += 1
+                acknowledged = self.next_expected_reliable_sequence - 1
+            # Acknowledged every time, in case earlier acknowledgements were lost. Packets received out of order are
+            #  acknowledged on their own too, so they aren't resent while waiting for the gap to be filled.
+            self._send_packet(HEADER.pack(ACK, self.client_id, acknowledged) + ACK_PAYLOAD.pack(sequence))
+            return payloads
+
+        return []
+
+    def resend_unacknowledged(self):
+        current_time = time.perf_counter()
+        with self.lock:
+            to_resend = [(sequence, packet) for sequence, (packet, sent_time) in self.unacknowledged.items()
+                         if current_time - sent_time >= self.RESEND_INTERVAL]
+            for sequence, packet in to_resend:
+                self.unacknowledged[sequence] = (packet, current_time)
+        for _, packet in to_resend:
+            self.packets_resent += 1
+            self._send_packet(packet)
+
+    def _send_packet(self, packet: bytes):
+        self.packets_sent += 1
+        if self.simulated_loss and random.random() < self.simulated_loss:
+            return
+        try:
+            self.socket.sendto(packet, self.address)
+        except OSError as err:
+            console_log.error(f"Error when attempting to send datagram to {self.address}: {repr(err)}")
+
+def parse_packet(packet: bytes) -> tuple[int, int, int, bytes] | None:
+    """Returns the kind, client id, sequence and payload of a packet, or None if it is too short to be one."""
+    if len(packet) < HEADER.size:
+        return None
+    return *HEADER.unpack_from(packet), packet[HEADER.size:]
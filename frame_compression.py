@@ -0,0 +1,79 @@
+from __future__ import annotations
+import struct
+import time
+import zlib
+
+COMPRESSION_METHOD = "zlib"
+"""Offered by the server in ConnectedMessage, and sent back by clients that accept it."""
+
+# region Frame kinds
+RAW = 0
+ZLIB = 1
+# endregion
+
+FRAME_HEADER = struct.Struct("!BI")
+"""Every frame starts with its kind and the length of its payload."""
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+class FrameEncoder:
+    DEFAULT_THRESHOLD = 64
+    DEFAULT_LEVEL = 6
+
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD, level: int = DEFAULT_LEVEL):
+        """
+        Frames pickled messages for a connection that negotiated compression, compressing those at least threshold
+        bytes long. Every frame is compressed with the same zlib stream, so repeated structure across messages (class
+        names, lobby titles, usernames) only costs a few bytes after the first time it is sent.
+        \nFrames must be sent in the order they are encoded, and decoded by the other end's FrameDecoder.
+
+        :param threshold: Messages shorter than this are sent uncompressed, as compressing them saves too little. Kept
+         low by default, since even short messages share most of their bytes with earlier ones in the stream.
+        :param level: zlib compression level, from 1 (fastest) to 9 (smallest).
+        """
+        self.threshold = threshold
+        self._compressor = zlib.compressobj(level)
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compression_time = 0
+        """Total seconds spent compressing."""
+
+    def encode(self, payload: bytes) -> bytes:
+        self.bytes_in += len(payload)
+        if len(payload) < self.threshold:
+            frame = FRAME_HEADER.pack(RAW, len(payload)) + payload
+        else:
+            start = time.perf_counter()
+            # A sync flush ends the frame on a byte boundary the decoder can decompress up to, without ending the stream
+            compressed = self._compressor.compress(payload) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.compression_time += time.perf_counter() - start
+            frame = FRAME_HEADER.pack(ZLIB, len(compressed)) + compressed
+        self.bytes_out += len(frame)
+        return frame
+
+class FrameDecoder:
+    def __init__(self):
+        """Splits data received from a connection into the payloads of the FrameEncoder frames in it, in order."""
+        self._decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Adds data received from the connection, and returns the payloads of every frame it completes. Data may hold any
+        amount of frames, including parts of them. Raises ValueError or zlib.error on data that isn't valid frames.
+        """
+        buffer = self._buffer
+        buffer += data
+        payloads = []
+        while len(buffer) >= FRAME_HEADER.size:
+            kind, length = FRAME_HEADER.unpack_from(buffer)
+            if kind not in (RAW, ZLIB) or length > MAX_FRAME_SIZE:
+                raise ValueError(f"Invalid frame header (kind {kind}, length {length})")
+            end = FRAME_HEADER.size + length
+            if len(buffer) < end:
+                break
+
+            payload = bytes(buffer[FRAME_HEADER.size:end])
+            del buffer[:end]
+            payloads.append(self._decompressor.decompress(payload) if kind == ZLIB else payload)
+        return payloads
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import os
+import pickle
+import struct
+import time
+import _thread
+from typing import Iterator, IO
+
+import console_log
+
+MAGIC = b"GREC"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sB")
+RECORD_HEADER = struct.Struct("<BdiI")
+"""Kind, seconds since the game started, client id (-1 for none), and payload length, before every record's payload."""
+NO_CLIENT = -1
+
+# region Record kinds
+START = 0
+"""Payload: a dict with the game's id, settings, start time, clients (as (client id, username) pairs) and host's id."""
+GAME_START = 1
+"""GameServer.on_game_start was called."""
+INPUT = 2
+"""Payload: game data received from the record's client."""
+OUTPUT = 3
+"""Payload: game data sent to the record's client."""
+FRAME = 4
+"""GameServer.on_frame_private was called."""
+DISCONNECT = 5
+"""The record's client left the game."""
+HOST_TRANSFER = 6
+"""The record's client was made the host."""
+END = 7
+"""The game ended, and nothing else was recorded."""
+# endregion
+
+kind_names = {START: "start", GAME_START: "game start", INPUT: "input", OUTPUT: "output", FRAME: "frame",
+              DISCONNECT: "disconnect", HOST_TRANSFER: "host transfer", END: "end"}
+
+recording_directory: str | None = None
+"""Every game started is recorded to a new file in this directory, or none are if it is None."""
+_recordings_started = 0
+
+class GameRecorder:
+    FLUSH_INTERVAL = 1
+    """Most seconds between records being written to the file, so little is lost if the server stops."""
+
+    def __init__(self, file: IO[bytes], start_time: float):
+        """
+        Appends everything a game server receives and sends to a file as it happens, to be played back with
+        server/replay.py. Each record is a RECORD_HEADER and a pickled payload. Records can be added from any thread.
+
+        :param file: The file to write to, opened in binary mode. Closed once the game ends.
+        :param start_time: The time the game started, which each record's time is relative to.
+        """
+        self.file = file
+        self.start_time = start_time
+        self.lock = _thread.allocate_lock()
+        self.closed = False
+        self.time_of_last_flush = time.time()
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+    @classmethod
+    def open_new(cls, game_id: str | None, start_time: float) -> GameRecorder | None:
+        """Returns a recorder writing to a new file in recording_directory, or None if games aren't being recorded."""
+        global _recordings_started
+        directory = recording_directory
+        if directory is None:
+            return None
+        _recordings_started += 1
+        path = os.path.join(directory, f"{game_id or 'none'}_{time.strftime('%Y%m%d_%H%M%S')}_{_recordings_started}.grec")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            recorder = cls(open(path, "xb"), start_time)
+        except OSError as err:
+            console_log.error(f"Error when attempting to start recording game to {path}: {repr(err)}")
+            return None
+        console_log.info(f"Recording game to {path}")
+        return recorder
+
+    def record(self, kind: int, current_time: float, client_id: int | None = None, payload: any = None):
+        """Appends a record. Payloads that can't be pickled are recorded as None, and logged."""
+        if self.closed:
+            return
+        try:
+            payload_bytes = pickle.dumps(payload, pickle.HIGHEST_PROTOCOL) if payload is not None else b""
+        except Exception as err:
+            console_log.error(f"Error when attempting to pickle {kind_names[kind]} record: {repr(err)}")
+            payload_bytes = b""
+        header = RECORD_HEADER.pack(kind, current_time - self.start_time,
+                                    NO_CLIENT if client_id is None else client_id, len(payload_bytes))
+
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.file.write(header + payload_bytes)
+                if kind == END:
+                    self.closed = True
+                    self.file.close()
+                elif current_time - self.time_of_last_flush >= self.FLUSH_INTERVAL:
+                    self.time_of_last_flush = current_time
+                    self.file.flush()
+            except OSError as err:
+                console_log.error(f"Error when attempting to record game, stopping recording: {repr(err)}")
+                self.closed = True
+                self.file.close()
+
+def read_recording(file: IO[bytes]) -> Iterator[tuple[int, float, int | None, any]]:
+    """
+    Yields (kind, seconds since the game started, client id or None, payload) for each record in a recording, in the
+    order they were recorded. A record cut off at the end (as when the server stopped mid-write) is ignored.
+    """
+    header = file.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != MAGIC:
+        raise ValueError("Not a game recording")
+    if (version := FILE_HEADER.unpack(header)[1]) != VERSION:
+        raise ValueError(f"Recording is version {version}, only version {VERSION} can be read")
+
+    while len(record_header := file.read(RECORD_HEADER.size)) == RECORD_HEADER.size:
+        kind, record_time, client_id, payload_length = RECORD_HEADER.unpack(record_header)
+        payload_bytes = file.read(payload_length)
+        if len(payload_bytes) < payload_length:
+            return
+        yield kind, record_time, None if client_id == NO_CLIENT else client_id, \
+            pickle.loads(payload_bytes) if payload_bytes else None
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import bisect
+import os
+import time
+import _thread
+from typing import Callable
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+        """A value that only goes up, e.g. the amount of messages received, kept separately for each set of labels."""
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values: dict[tuple[str, ...], float] = {}
+        self.lock = _thread.allocate_lock()
+
+    def increment(self, amount: float = 1, *labels: str):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get_prometheus_lines(self) -> list[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in values.items()]
+
+class Gauge:
+    def __init__(self, name: str, description: str, get_value: Callable[[], float]):
+        """A value that can go up and down, e.g. the amount of connected clients, read with get_value when needed."""
+        self.name = name
+        self.description = description
+        self.get_value = get_value
+
+    def get_prometheus_lines(self) -> list[str]:
+        return [f"{self.name} {self.get_value()}"]
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+    """Upper bounds in seconds, suited to timing message handling and game ticks."""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        """Counts of observed values (e.g. durations) in buckets, kept separately for each set of labels."""
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        """[count in each bucket (plus one for values above every bucket)], [total count, sum] for each set of labels."""
+        self.lock = _thread.allocate_lock()
+
+    def observe(self, value: float, *labels: str):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if (values := self.values.get(labels)) is None:
+                values = self.values[labels] = ([0] * (len(self.buckets) + 1), [0, 0.0])
+            values[0][bucket] += 1
+            values[1][0] += 1
+            values[1][1] += value
+
+    def time(self, *labels: str) -> _Timer:
+        """Returns a context manager that observes how long its block took."""
+        return _Timer(self, labels)
+
+    def get_summary(self, labels: tuple[str, ...]) -> tuple[int, float, float]:
+        """Returns the count, mean and (upper bound of the bucket holding the) 99th percentile for a set of labels."""
+        with self.lock:
+            bucket_counts, (count, total) = self.values[labels][0][:], self.values[labels][1]
+        target, seen = count * 0.99, 0
+        for bucket, bucket_count in enumerate(bucket_counts):
+            seen += bucket_count
+            if seen >= target:
+                break
+        p99 = self.buckets[bucket] if bucket < len(self.buckets) else float("inf")
+        return count, total / count, p99
+
+    def get_prometheus_lines(self) -> list[str]:
+        with self.lock:
+            values = {labels: (bucket_counts[:], totals[:]) for labels, (bucket_counts, totals) in self.values.items()}
+        lines = []
+        for labels, (bucket_counts, (count, total)) in values.items():
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if upper_bound == float("inf") else repr(upper_bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + (le,))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        """Every metric the server keeps, to print with the stats console command or dump in Prometheus' text format."""
+        self.metrics: list[Counter | Gauge | Histogram] = []
+        self.start_time = time.time()
+
+    def counter(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str, get_value: Callable[[], float]) -> Gauge:
+        return self._add(Gauge(name, description, get_value))
+
+    def histogram(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, description, label_names, buckets))
+
+    def get_prometheus_text(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            metric_type = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric_type}")
+            lines += metric.get_prometheus_lines()
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """Writes every metric to a file in Prometheus' text format, replacing it all at once so readers never see half."""
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            file.write(self.get_prometheus_text())
+        os.replace(temporary_path, path)
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+def _format_labels(label_names: tuple[str, ...], labels: tuple[str, ...]) -> str:
+    if not label_names:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(label_names, labels)) + "}"
+
+registry = MetricsRegistry()
+
+# region Server metrics
+messages_sent = registry.counter("server_messages_sent_total", "Messages sent to clients.", ("type",))
+bytes_sent = registry.counter("server_bytes_sent_total", "Pickled bytes of messages sent to clients, before compression.",
+                              ("type",))
+messages_received = registry.counter("server_messages_received_total", "Messages received from clients.", ("type",))
+bytes_received = registry.counter("server_bytes_received_total",
+                                  "Pickled bytes of messages received from clients, after decompression.", ("type",))
+process_message_seconds = registry.histogram("server_process_message_seconds",
+                                             "Time taken to handle each message received.", ("type",))
+tick_seconds = registry.histogram("server_game_tick_seconds", "Time taken by each game server frame.", ("game",))
+# endregion
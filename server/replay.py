@@ -0,0 +1,166 @@
+"""
+Plays a game recording (see game_recording) back through a new game server of the recorded game, headlessly and as
+fast as it can, with the game's clock (GameServer.get_time) set to the time of each record. Every input, frame,
+disconnect and host transfer is handled again in the order it was recorded. What the game sends is checked against what
+it sent while recorded, so a bug that was recorded happens again, and the first difference shows where a game isn't
+deterministic.
+\nAlso reports how long each frame took to handle, to benchmark games' ticks without running a server.
+
+Run from the repository root with ``python server/replay.py recording.grec [--repeat N] [--verbose]``.
+"""
+import argparse
+import collections
+import os
+import pickle
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root, os.path.join(root, "server")]
+
+import console_log
+import game_recording
+from server_assets import GameServer, game_servers_by_id
+from shared_assets import Messages
+
+class ReplayClient:
+    def __init__(self, client_id: int, username: str):
+        """Stands in for a ConnectedClient, as game servers only use their id and username."""
+        self.client_id = client_id
+        self.username = username
+
+class ReplayServer:
+    def __init__(self):
+        """Stands in for the Server, keeping the game data sent to each client instead of sending it."""
+        self.sent: collections.deque[tuple[int, any]] = collections.deque()
+        """(client id, data) of everything sent that hasn't been checked against the recording yet, oldest first."""
+
+    def send(self, client: ReplayClient | list[ReplayClient], message: Messages.Message) -> bool:
+        if isinstance(message, Messages.GameDataMessage):
+            for client_to in client if isinstance(client, list) else [client]:
+                self.sent.append((client_to.client_id, message.data))
+        return True
+
+def get_replay_class(game_class: type[GameServer]) -> type[GameServer]:
+    class ReplayGame(game_class):
+        FPS = None
+        """Frames are played back from the recording, rather than run on a timer."""
+        replay_time = 0.0
+
+        def get_time(self) -> float:
+            return ReplayGame.replay_time
+
+    return ReplayGame
+
+def describe(data: any) -> str:
+    text = repr(vars(data) if hasattr(data, "__dict__") else data)
+    return f"{type(data).__name__} {text if len(text) <= 200 else text[:200] + '...'}"
+
+def replay(records: list[tuple[int, float, int | None, any]]) -> dict[str, any]:
+    """Plays records back through a new game server. Returns the time each frame took, and every difference found."""
+    results = {"frame_times": [], "outputs_checked": 0, "outputs_matched": 0, "differences": [], "wall_time": 0.0}
+    game: GameServer | None = None
+    server = ReplayServer()
+    clients: dict[int, ReplayClient] = {}
+    replay_class = None
+
+    def add_difference(index: int, record_time: float, text: str):
+        results["differences"].append(f"record {index} at {record_time:.3f}s: {text}")
+
+    start = time.perf_counter()
+    for index, (kind, record_time, client_id, payload) in enumerate(records):
+        if kind == game_recording.START:
+            replay_class = get_replay_class(game_servers_by_id[payload["game_id"]])
+            replay_class.replay_time = payload["start_time"]
+            clients = {client_id: ReplayClient(client_id, username) for client_id, username in payload["clients"]}
+            # Built from the recorded list, rather than the clients by id, in case a client was in it twice
+            game = replay_class(server, payload["settings"], [clients[client_id] for client_id, _ in payload["clients"]],
+                                clients[payload["host_client_id"]], lambda: None)
+            continue
+        if game is None:
+            raise ValueError("Recording doesn't start with a start record")
+        replay_class.replay_time = game.start_time + record_time
+
+        if kind == game_recording.GAME_START:
+            game.start_game_private()
+        elif kind == game_recording.INPUT:
+            game.receive_data_private(clients[client_id], payload)
+        elif kind == game_recording.FRAME:
+            frame_start = time.perf_counter()
+            game.on_frame_private()
+            results["frame_times"].append(time.perf_counter() - frame_start)
+        elif kind == game_recording.DISCONNECT:
+            game.disconnect_client_private(clients[client_id])
+        elif kind == game_recording.HOST_TRANSFER:
+            game.transfer_host_private(clients[client_id])
+        elif kind == game_recording.OUTPUT:
+            results["outputs_checked"] += 1
+            if not server.sent:
+                add_difference(index, record_time, f"expected {describe(payload)} to be sent to client {client_id}, "
+                                                   f"but nothing was sent")
+                continue
+            sent_client_id, sent_data = server.sent.popleft()
+            if sent_client_id != client_id or \
+                    pickle.dumps(sent_data, pickle.HIGHEST_PROTOCOL) != pickle.dumps(payload, pickle.HIGHEST_PROTOCOL):
+                add_difference(index, record_time, f"expected {describe(payload)} to be sent to client {client_id}, "
+                                                   f"but {describe(sent_data)} was sent to client {sent_client_id}")
+            else:
+                results["outputs_matched"] += 1
+        elif kind == game_recording.END:
+            game.stop()
+            break
+    results["wall_time"] = time.perf_counter() - start
+
+    for client_id, data in server.sent:
+        results["differences"].append(f"after the recording: {describe(data)} was also sent to client {client_id}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1], formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("recording")
+    parser.add_argument("--repeat", type=int, default=1, help="times to play the recording, for steadier frame times")
+    parser.add_argument("--verbose", action="store_true",
+                        help="print every difference, rather than the first few, and what the game logs")
+    options = parser.parse_args()
+    if not options.verbose:
+        console_log.minimum_level = console_log.WARNING
+
+    with open(options.recording, "rb") as file:
+        records = list(game_recording.read_recording(file))
+    if not records or records[0][0] != game_recording.START:
+        print("Recording is empty, or doesn't start with a start record")
+        sys.exit(1)
+
+    start_info = records[0][3]
+    kind_counts = collections.Counter(game_recording.kind_names.get(kind, kind) for kind, *_ in records)
+    recorded_duration = records[-1][1]
+    print(f"{start_info['game_id']} game with {', '.join(username for _, username in start_info['clients'])}, "
+          f"recorded over {recorded_duration:.1f}s" + ("" if records[-1][0] == game_recording.END else " (unfinished)"))
+    print(", ".join(f"{count} {kind}" for kind, count in kind_counts.items()))
+
+    frame_times = []
+    results = None
+    for _ in range(options.repeat):
+        results = replay(records)
+        frame_times += results["frame_times"]
+
+    print(f"\nReplayed in {results['wall_time'] * 1000:.1f}ms"
+          + (f", {recorded_duration / results['wall_time']:.0f}x real time" if results["wall_time"] else ""))
+    if frame_times:
+        frame_times.sort()
+        print(f"Frames: {len(frame_times)}, mean {sum(frame_times) / len(frame_times) * 1000:.3f}ms, "
+              f"p50 {frame_times[len(frame_times) // 2] * 1000:.3f}ms, "
+              f"p99 {frame_times[min(len(frame_times) - 1, int(len(frame_times) * 0.99))] * 1000:.3f}ms, "
+              f"max {frame_times[-1] * 1000:.3f}ms")
+
+    differences = results["differences"]
+    print(f"\n{results['outputs_matched']}/{results['outputs_checked']} outputs matched the recording"
+          + (", replay is deterministic" if not differences else f", {len(differences)} differences:"))
+    for difference in differences if options.verbose else differences[:5]:
+        print(f"  {difference}")
+    if len(differences) > 5 and not options.verbose:
+        print(f"  ...and {len(differences) - 5} more (see --verbose)")
+    sys.exit(1 if differences else 0)
+
+if __name__ == "__main__":
+    main()
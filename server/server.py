@@ -1,11 +1,21 @@
 from __future__ import annotations
+import os
 import socket
+import time
 import _thread
 import pickle
+from collections import deque
 from typing import Sequence
 import shared_assets
 from shared_assets import GameAssets, Messages, port, max_chat_messages, Client
 from server_assets import GameServer, game_servers_by_id
+import datagram_channel
+from datagram_channel import DatagramPeer
+import frame_compression
+from frame_compression import FrameEncoder, FrameDecoder
+import metrics
+import console_log
+import game_recording
 import io
 
 _ = shared_assets
@@ -25,6 +35,10 @@ class Lobby:
 
         self._host_client: ConnectedClient = host
         self.player_clients: list[ConnectedClient] = [host]
+        self.spectator_clients: list[ConnectedClient] = []
+        """Clients watching the running game. They aren't sent anything about the lobby, and don't count towards max_players."""
+        self.spectator_ids: set[int] = set()
+        """Ids of spectator_clients, to check whether a client is spectating without searching the list."""
 
         self.game_selected_id = None
         self.game_settings = settings
@@ -45,9 +59,36 @@ class Lobby:
     def host_client(self, value: ConnectedClient):
         self._host_client = value
         if self.current_game:
-            self.current_game.host_client = value
+            self.current_game.transfer_host_private(value)
+
+    def add_spectator(self, spectator: ConnectedClient):
+        """Starts sending the running game to a client. The game must allow spectators."""
+        spectator.lobby_in = self
+        self.spectator_clients.append(spectator)
+        self.spectator_ids.add(spectator.client_id)
+
+        game = self.current_game
+        clients = [Client(client.username, client.client_id) for client in game.clients]
+        host_client = Client(game.host_client.username, game.host_client.client_id)
+        # Sent before the spectator is added, so it has started the game before the first snapshot
+        server.send(spectator, Messages.GameStartedMessage(clients, host_client, self.game_selected_id, True,
+                                                           self.game_settings))
+        game.add_spectator(spectator)
+        send_lobbies_to_each_client()
+
+    def remove_spectator(self, spectator: ConnectedClient):
+        self.spectator_clients = [client for client in self.spectator_clients if client.client_id != spectator.client_id]
+        self.spectator_ids.discard(spectator.client_id)
+        spectator.lobby_in = None
+        if self.current_game:
+            self.current_game.remove_spectator(spectator)
+        send_lobbies_to_each_client(spectator)
 
     def remove_player(self, player: ConnectedClient):
+        if player.client_id in self.spectator_ids:
+            self.remove_spectator(player)
+            return
+
         for i, client_in_lobby in enumerate(self.player_clients):
             if client_in_lobby.client_id == player.client_id:
                 client_in_lobby.lobby_in = None
@@ -62,7 +103,7 @@ class Lobby:
             self.host_client = self.player_clients[0]
 
         if self.current_game:
-            self.current_game.on_client_disconnect_private(player)
+            self.current_game.disconnect_client_private(player)
 
         self.send_lobby_info_to_members()
         send_lobbies_to_each_client(player)
@@ -74,7 +115,9 @@ class Lobby:
             "host": (self._host_client.username, self._host_client.client_id),
             "players": [(client.username, client.client_id) for client in self.player_clients],
             "game_id": self.game_selected_id,
-            "max_players": self.max_players
+            "max_players": self.max_players,
+            "in_game": self.current_game is not None,
+            "spectators": [(client.username, client.client_id) for client in self.spectator_clients]
         }
         if include_in_lobby_info:
             parameters["private"] = self.private
@@ -97,6 +140,11 @@ class Lobby:
     def start_game(self):
         def on_game_end():
             self.current_game = None
+            # Still sent the rest of the game by the game server, which they are behind (see GameServer.SPECTATOR_DELAY)
+            for spectator in self.spectator_clients:
+                spectator.lobby_in = None
+            self.spectator_clients = []
+            self.spectator_ids = set()
             send_lobbies_to_each_client()
 
         self.current_game = game_servers_by_id[self.game_selected_id](server,
@@ -105,10 +153,175 @@ class Lobby:
                                                                       self._host_client,
                                                                       on_game_end)
 
-        _thread.start_new_thread(self.current_game.on_game_start, ())
+        _thread.start_new_thread(self.current_game.start_game_private, ())
         _thread.start_new_thread(self.current_game.call_on_frame, ())
+        if self.current_game.asset_class.allow_spectators:
+            _thread.start_new_thread(self.current_game.call_send_to_spectators, ())
         send_lobbies_to_each_client()
 
+class SendBuffer:
+    HIGH_WATERMARK = 256 * 1024
+    """Once more than this many bytes are waiting to be sent, droppable messages that a newer queued message of the
+    same type supersedes are dropped, oldest first..."""
+    LOW_WATERMARK = 64 * 1024
+    """...until this many are left, or there are no droppable messages left."""
+    EVICTION_LIMIT = 1024 * 1024
+    EVICTION_TIME = 5
+    """Clients whose buffer stays above EVICTION_LIMIT bytes for this many seconds are disconnected."""
+
+    def __init__(self, client: ConnectedClient):
+        """
+        Outgoing messages waiting to be sent to one client. Messages are sent in order on this buffer's own thread, so
+        a client that stops reading only holds up its own messages, not whichever thread is sending to it.
+        \nMessages that newer ones supersede (see Messages.Message.droppable) are dropped when the client falls behind,
+        and clients that stay too far behind are evicted.
+        """
+        self.client = client
+        self.lock = _thread.allocate_lock()
+        self.queue: deque[tuple[Messages.Message, bytes]] = deque()
+        self.queued_bytes = 0
+        self.closed = False
+        self._sender_running = False
+        self._sender_waiting = False
+        self._wake_lock = _thread.allocate_lock()
+        """Held except while waking the sending thread, which waits on it while there is nothing to send."""
+        self._wake_lock.acquire()
+        self._time_over_limit: float | None = None
+        self.frame_encoder: FrameEncoder | None = None
+        """Set once the client accepts compression. Messages are encoded as they're sent, so they stay in order."""
+
+        # region Metrics
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.peak_queued_bytes = 0
+        self.dropped_messages: dict[str, int] = {}
+        """Amount of droppable messages dropped, by message name."""
+        self.evicted = False
+        # endregion
+
+    def add(self, message: Messages.Message, outgoing_message: bytes):
+        with self.lock:
+            if self.closed:
+                return
+            self.queue.append((message, outgoing_message))
+            self.queued_bytes += len(outgoing_message)
+            self.peak_queued_bytes = max(self.peak_queued_bytes, self.queued_bytes)
+            if self.queued_bytes > self.HIGH_WATERMARK:
+                self._drop_oldest_droppable()
+            evict = self._should_evict()
+
+            if not self._sender_running:
+                self._sender_running = True
+                _thread.start_new_thread(self._send_loop, ())
+            else:
+                self._wake_sender()
+
+        if evict:
+            self._evict()
+
+    def close(self):
+        """Drops every message waiting to be sent, and stops the sending thread."""
+        with self.lock:
+            self.closed = True
+            self.queue.clear()
+            self.queued_bytes = 0
+            self._wake_sender()
+
+    def get_metrics(self) -> dict[str, any]:
+        with self.lock:
+            return {
+                "queued_messages": len(self.queue),
+                "queued_bytes": self.queued_bytes,
+                "peak_queued_bytes": self.peak_queued_bytes,
+                "messages_sent": self.messages_sent,
+                "bytes_sent": self.bytes_sent,
+                "dropped_messages": dict(self.dropped_messages),
+                "evicted": self.evicted,
+                "compressed_from_bytes": self.frame_encoder.bytes_in if self.frame_encoder else None
+            }
+
+    def _should_evict(self) -> bool:
+        """Call with self.lock held. Whether the buffer has stayed above EVICTION_LIMIT for EVICTION_TIME seconds."""
+        if self.queued_bytes <= self.EVICTION_LIMIT:
+            self._time_over_limit = None
+        elif self._time_over_limit is None:
+            self._time_over_limit = time.perf_counter()
+        return self._time_over_limit is not None and \
+            time.perf_counter() - self._time_over_limit >= self.EVICTION_TIME
+
+    def _evict(self):
+        console_log.warning(f"Client at address {self.client.address} has had over {self.EVICTION_LIMIT} bytes waiting to "
+              f"be sent for {self.EVICTION_TIME} seconds. Disconnecting client.")
+        self.evicted = True
+        self.close()
+        if self.client.client_id in clients_listening_to:
+            clients_listening_to.remove(self.client.client_id)
+        try:
+            # Also stops the thread listening to this client
+            self.client.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            ...
+
+    def _drop_oldest_droppable(self):
+        # Indices of droppable messages that a newer queued message supersedes
+        superseded: set[int] = set()
+        newer = set()
+        for i, (message, _) in zip(range(len(self.queue) - 1, -1, -1), reversed(self.queue)):
+            key = message.type_key
+            if message.droppable and key in newer:
+                superseded.add(i)
+            newer.add(key)
+
+        kept: deque[tuple[Messages.Message, bytes]] = deque()
+        for i, (message, outgoing_message) in enumerate(self.queue):
+            if self.queued_bytes > self.LOW_WATERMARK and i in superseded:
+                self.queued_bytes -= len(outgoing_message)
+                self.dropped_messages[message.name] = self.dropped_messages.get(message.name, 0) + 1
+            else:
+                kept.append((message, outgoing_message))
+        self.queue = kept
+
+    def _wake_sender(self):
+        """Call with self.lock held."""
+        if self._sender_waiting:
+            self._sender_waiting = False
+            self._wake_lock.release()
+
+    def _send_loop(self):
+        while True:
+            with self.lock:
+                if self.closed:
+                    return
+                if self.queue:
+                    message, outgoing_message = self.queue.popleft()
+                    self.queued_bytes -= len(outgoing_message)
+                else:
+                    message = None
+                    self._sender_waiting = True
+            if message is None:
+                self._wake_lock.acquire()
+                continue
+            if self.frame_encoder is not None:
+                outgoing_message = self.frame_encoder.encode(outgoing_message)
+
+            try:
+                self.client.conn.sendall(outgoing_message)
+            except ConnectionResetError:
+                console_log.debug(f"Attempted to send message of type {message.name} to closed client at address {self.client.address}. This is likely not an issue.")
+                continue
+            except Exception as err:
+                console_log.error(f"Error when attempting to send {message.name} to client at address {self.client.address}: {repr(err)}")
+                continue
+
+            with self.lock:
+                self.messages_sent += 1
+                self.bytes_sent += len(outgoing_message)
+                evict = self._should_evict()
+            console_log.log_message(message, False, f"address {self.client.address}")
+            if evict:
+                self._evict()
+                return
+
 class ConnectedClient(Client):
     """A class representing a client that is connected to the server, including all information necessary for server to communicate with said client."""
 
@@ -120,6 +333,16 @@ class ConnectedClient(Client):
         self.username = username
 
         self.lobby_in: Lobby | None = None
+        self.send_buffer = SendBuffer(self)
+        self.connected = False
+        """Whether the ConnectedMessage handshake has finished. Nothing but the handshake is sent to the client before."""
+        self.frame_decoder: FrameDecoder | None = None
+        """Set once the client accepts compression, after which everything it sends over TCP is in frames."""
+
+        self.udp_token = os.urandom(16)
+        """Sent to the client over TCP, and sent back over UDP to prove the datagrams are from it."""
+        self.datagram_peer: DatagramPeer | None = None
+        """This client's UDP channel for game data, or None to send everything over TCP."""
 
 class Server:
     # Should the client join the server when they start the game, or when they join the lobby?
@@ -136,11 +359,24 @@ class Server:
                 self.socket.bind(("", port_to_try))
                 break
             except socket.error as e:
-                print("Unable to bind socket: ", e)
+                console_log.error(f"Unable to bind socket: {e}")
                 port_to_try = int(input("Input new port: "))
 
         self.socket.listen()
-        print("Server started, waiting for client(s) to connect")
+
+        # Game data can also go over UDP on the same port number, so one lost packet doesn't hold up everything after it
+        self.datagram_socket: socket.socket | None = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.datagram_socket.bind(("", port_to_try))
+            self.datagram_socket.settimeout(DatagramPeer.RESEND_INTERVAL)
+        except socket.error as e:
+            console_log.warning(f"Unable to bind UDP socket, sending all game data over TCP: {e}")
+            self.datagram_socket = None
+        self.udp_port = port_to_try if self.datagram_socket else None
+        self.compression = frame_compression.COMPRESSION_METHOD
+        """Compression offered to clients in ConnectedMessage. Set to None to send everything uncompressed."""
+
+        console_log.info("Server started, waiting for client(s) to connect")
 
     @staticmethod
     def send(client, message: Messages.Message) -> bool:
@@ -150,22 +386,44 @@ class Server:
         try:
             outgoing_message = pickle.dumps(message)
         except Exception as err:
-            print(f"Error: Error when attempting to pickle {message.name}: {repr(err)}")
+            console_log.error(f"Error when attempting to pickle {message.name}: {repr(err)}")
             return False
 
+        Server.send_pickled(client, message, outgoing_message)
+        return True
+
+    @staticmethod
+    def send_to_each(clients: list[ConnectedClient], message: Messages.Message) -> bool:
+        """
+        Sends the same message to every client, pickling it once rather than once per client as send() would. Each
+        client then only costs queueing the same bytes (and compressing them, if it accepted compression).
+        """
+        if not isinstance(message, Messages.Message):
+            raise TypeError("Message must be a child of the Message class.")
+
         try:
-            client.conn.sendall(outgoing_message)
-        except ConnectionResetError:
-            print(f"Error: Attempted to send message of type {message.name} to closed client at address {client.address}. This is likely not an issue.")
-            return False
+            outgoing_message = pickle.dumps(message)
         except Exception as err:
-            print(f"Error: Error when attempting to send {message.name} to client at address {client.address}: {repr(err)}")
+            console_log.error(f"Error when attempting to pickle {message.name}: {repr(err)}")
             return False
 
-        if message.notify_to_console:
-            print(f"  [S] Sent message of type {message.name} to address {client.address}")
-
+        for client in clients:
+            Server.send_pickled(client, message, outgoing_message)
         return True
+
+    @staticmethod
+    def send_pickled(client, message: Messages.Message, outgoing_message: bytes):
+        """Sends a message that has already been pickled to outgoing_message."""
+        metrics.messages_sent.increment(1, message.name)
+        metrics.bytes_sent.increment(len(outgoing_message), message.name)
+
+        if isinstance(message, Messages.GameDataMessage) and client.datagram_peer is not None and \
+                len(outgoing_message) <= datagram_channel.MAX_PAYLOAD_SIZE:
+            client.datagram_peer.send(outgoing_message, not message.droppable, message.type_key)
+            return
+
+        # Sent on the client's own thread, so a client that stops reading can't hold up the thread sending to it
+        client.send_buffer.add(message, outgoing_message)
         # TODO: I'm catching all errors, but what if I dont want to?
         #  (I'm getting some spammed unpickling errors (ran out of input, from some random IP). I should fix that)
 
@@ -182,13 +440,18 @@ class Server:
 
             data_pieces = []
             try:
-                unpickler = pickle.Unpickler(io.BytesIO(received_data))
+                received_data = io.BytesIO(received_data)
                 while True:
-                    data_pieces.append(unpickler.load())
+                    start = received_data.tell()
+                    # A new unpickler for each message, as one keeps its memo between loads, which breaks later messages
+                    data_pieces.append(pickle.load(received_data))
+                    message_name = getattr(data_pieces[-1], "name", "invalid")
+                    metrics.messages_received.increment(1, message_name)
+                    metrics.bytes_received.increment(received_data.tell() - start, message_name)
             except EOFError:
                 ...
             except Exception as err:
-                print(f"Error: Error when attempting to unpickle message from client at address {client.address}: {repr(err)}")
+                console_log.error(f"Error when attempting to unpickle message from client at address {client.address}: {repr(err)}")
                 return process_message(Messages.ErrorMessage(err), client)
 
             for data_piece in data_pieces:
@@ -199,34 +462,101 @@ class Server:
             self.buffer.pop(0)
         self.handling_buffer = False
 
+    def listen_for_datagrams(self):
+        time_of_last_resend = time.perf_counter()
+        while True:
+            try:
+                packet, address = self.datagram_socket.recvfrom(65536)
+            except socket.timeout:
+                packet = None
+            except OSError:
+                # Windows raises ConnectionResetError when a datagram sent to a closed client bounces
+                packet = None
+
+            if packet and (parsed := datagram_channel.parse_packet(packet)):
+                self.handle_datagram(address, *parsed)
+
+            if (current_time := time.perf_counter()) - time_of_last_resend >= DatagramPeer.RESEND_INTERVAL:
+                time_of_last_resend = current_time
+                for client in list(clients_connected.values()):
+                    if client.datagram_peer is not None:
+                        client.datagram_peer.resend_unacknowledged()
+
+    def handle_datagram(self, address: tuple[str, int], kind: int, client_id: int, sequence: int, payload: bytes):
+        client = clients_connected.get(client_id)
+        if client is None:
+            return
+
+        if kind == datagram_channel.HELLO:
+            if payload == client.udp_token:
+                if client.datagram_peer is None or client.datagram_peer.address != address:
+                    client.datagram_peer = DatagramPeer(self.datagram_socket, address, client_id)
+                    console_log.info(f"Opened UDP channel to client at address {address}")
+                # Sent back every time, as the client keeps trying until it gets one
+                self.datagram_socket.sendto(datagram_channel.HEADER.pack(datagram_channel.HELLO, client_id, 0), address)
+            return
+
+        if client.datagram_peer is None or client.datagram_peer.address != address:
+            return
+        for payload in client.datagram_peer.receive(kind, sequence, payload):
+            try:
+                message = pickle.loads(payload)
+            except Exception as err:
+                console_log.error(f"Error when attempting to unpickle datagram from client at address {address}: {repr(err)}")
+                continue
+            metrics.messages_received.increment(1, getattr(message, "name", "invalid"))
+            metrics.bytes_received.increment(len(payload), getattr(message, "name", "invalid"))
+            if client.client_id in clients_listening_to:
+                process_message(message, client)
+
     def recv(self, client):
         try:
             incoming_message = client.conn.recv(4096)
         except (ConnectionAbortedError, ConnectionResetError) as err:
             if client.client_id in clients_listening_to:
-                print(f"Could not find client at address {client.address} ({repr(err)}). Assuming client is disconnected.")
+                console_log.info(f"Could not find client at address {client.address} ({repr(err)}). Assuming client is disconnected.")
                 clients_listening_to.remove(client.client_id)
             return
         except Exception as err:
             if client.client_id in clients_listening_to:
-                print(f"Error: Error when attempting to receive message from client at address {client.address}: {repr(err)}")
+                console_log.error(f"Error when attempting to receive message from client at address {client.address}: {repr(err)}")
                 process_message(Messages.ErrorMessage(err), client)
             return
 
         if client.client_id in clients_listening_to and incoming_message:
-            self.buffer.append((client, incoming_message))
-            if not self.handling_buffer:
-                self.handling_buffer = True
-                _thread.start_new_thread(self.handle_buffer, ())
+            self.add_to_buffer(client, incoming_message)
+
+    def add_to_buffer(self, client, incoming_message: bytes):
+        if client.frame_decoder is not None:
+            # Decoded here, on the client's listening thread, as compressed frames have to be decompressed in order
+            try:
+                incoming_message = b"".join(client.frame_decoder.feed(incoming_message))
+            except Exception as err:
+                console_log.error(f"Error when attempting to decompress message from client at address {client.address}: {repr(err)}")
+                return process_message(Messages.ErrorMessage(err), client)
+            if not incoming_message:
+                return
+
+        self.buffer.append((client, incoming_message))
+        if not self.handling_buffer:
+            self.handling_buffer = True
+            _thread.start_new_thread(self.handle_buffer, ())
 
 
 clients_connected: dict[int, ConnectedClient] = {}
 clients_listening_to: list[int] = []
+client_id_lock = _thread.allocate_lock()
+"""Held while picking a new client's id, so clients connecting at once don't get the same one."""
 
 def delete_lobby(lobby: Lobby, player_to_ignore: ConnectedClient = None):
+    if lobby.current_game:
+        lobby.current_game.stop()
     for client in lobby.player_clients:
         server.send(client, Messages.KickedFromLobbyMessage())
         client.lobby_in = None
+    # Sent a GameOverMessage once they have seen the rest of the game
+    for spectator in lobby.spectator_clients:
+        spectator.lobby_in = None
 
     del lobbies[lobby.lobby_id]
 
@@ -234,7 +564,8 @@ def delete_lobby(lobby: Lobby, player_to_ignore: ConnectedClient = None):
 
 def get_lobby_infos_to_send(include_inaccessible_lobbies=False):
     return [lobby.get_lobby_info(False) for lobby in lobbies.values()
-            if (not lobby.private and lobby.current_game is None) or include_inaccessible_lobbies]
+            if (not lobby.private and (lobby.current_game is None or lobby.current_game.asset_class.allow_spectators))
+            or include_inaccessible_lobbies]
 
 
 def send_lobbies_to_each_client(players_to_ignore: ConnectedClient | Sequence[ConnectedClient] = None):
@@ -244,21 +575,25 @@ def send_lobbies_to_each_client(players_to_ignore: ConnectedClient | Sequence[Co
     elif isinstance(players_to_ignore, Sequence):
         ids_to_ignore = [player_to_ignore.client_id for player_to_ignore in players_to_ignore]
 
-    for client in clients_connected.values():
-        if client.lobby_in is None and client.client_id not in ids_to_ignore:
+    for client in list(clients_connected.values()):
+        if client.connected and client.lobby_in is None and client.client_id not in ids_to_ignore:
             server.send(client, Messages.LobbyListMessage(get_lobby_infos_to_send()))
 
 def process_message(message: Messages.Message, client: ConnectedClient):
+    with metrics.process_message_seconds.time(getattr(message, "name", "invalid")):
+        handle_message(message, client)
+
+def handle_message(message: Messages.Message, client: ConnectedClient):
     if not isinstance(message, Messages.Message):
-        print(f"Error: Received data that is not a Message class from client at address {client.address}")
+        console_log.error(f"Received data that is not a Message class from client at address {client.address}")
         return process_message(Messages.ErrorMessage(), client)
 
-    if message.notify_to_console:
-        print(f"  [R] Received message of type {message.name} from address {client.address}")
+    console_log.log_message(message, True, f"address {client.address}")
 
     if isinstance(message, Messages.GameDataMessage):
-        if client.lobby_in.current_game:
-            client.lobby_in.current_game.on_data_received(client, message.data)
+        # Spectators only watch, so anything they send is ignored
+        if client.lobby_in and client.lobby_in.current_game and client.client_id not in client.lobby_in.spectator_ids:
+            client.lobby_in.current_game.receive_data_private(client, message.data)
 
     elif isinstance(message, Messages.LobbyListRequest):
         server.send(client, Messages.LobbyListMessage(get_lobby_infos_to_send()))
@@ -272,6 +607,17 @@ def process_message(message: Messages.Message, client: ConnectedClient):
     elif isinstance(message, Messages.JoinLobbyMessage):
         if message.lobby_id not in lobbies:
             server.send(client, Messages.KickedFromLobbyMessage("Lobby no longer exists."))
+        elif message.spectate:
+            lobby = lobbies[message.lobby_id]
+            if client.lobby_in is not None:
+                server.send(client, Messages.KickedFromLobbyMessage("Already in a lobby."))
+            elif lobby.private:
+                server.send(client, Messages.KickedFromLobbyMessage("Lobby is private."))
+            elif lobby.current_game is None or not lobby.current_game.asset_class.allow_spectators:
+                server.send(client, Messages.KickedFromLobbyMessage("Game can't be spectated."))
+            else:
+                client.username = message.username
+                lobby.add_spectator(client)
         elif lobbies[message.lobby_id].current_game:
             server.send(client, Messages.KickedFromLobbyMessage("Game already started."))
         elif lobbies[message.lobby_id].private:
@@ -287,7 +633,9 @@ def process_message(message: Messages.Message, client: ConnectedClient):
         clients_listening_to.remove(client.client_id)
 
     elif isinstance(message, Messages.LeaveLobbyMessage):
-        client.lobby_in.remove_player(client)
+        # Spectators are taken out of the lobby when its game ends, and may leave after
+        if client.lobby_in:
+            client.lobby_in.remove_player(client)
 
     elif isinstance(message, Messages.ChangeLobbySettingsMessage):
         old_host = client.lobby_in.host_client
@@ -348,6 +696,8 @@ def process_message(message: Messages.Message, client: ConnectedClient):
                 server.send(client_in_lobby, Messages.StartGameStartTimerMessage(message.start_time))
 
     elif isinstance(message, Messages.StartGameMessage):
+        # Reset before telling anyone, as their GameInitializedMessages may be handled before this finishes
+        client.lobby_in.clients_with_game_initialized = 0
         for client_in_lobby in client.lobby_in.player_clients:
             clients = [Client(connected_client.username, connected_client.client_id)
                        for connected_client in client.lobby_in.player_clients]
@@ -356,7 +706,6 @@ def process_message(message: Messages.Message, client: ConnectedClient):
             server.send(client_in_lobby, Messages.GameStartedMessage(clients,
                                                                      host_client,
                                                                      client.lobby_in.game_selected_id))
-        client.lobby_in.clients_with_game_initialized = 0
 
     elif isinstance(message, Messages.GameInitializedMessage):
         # Once each player's game class has been initialized, they will send this message. Makes sure that the
@@ -368,44 +717,178 @@ def process_message(message: Messages.Message, client: ConnectedClient):
             client.lobby_in.start_game()
 
 def listen_to_client(client: ConnectedClient):
-    clients_listening_to.append(client.client_id)
+    if client.client_id not in clients_listening_to:
+        clients_listening_to.append(client.client_id)
 
     while client.client_id in clients_listening_to:
         server.recv(client)
 
-    print(f"Disconnected from {client.address}")
+    console_log.info(f"Disconnected from {client.address}")
+    client.send_buffer.close()
 
     del clients_connected[client.client_id]
 
     if client.lobby_in is not None:
         client.lobby_in.remove_player(client)
 
+def print_send_buffers():
+    for client in list(clients_connected.values()):
+        metrics = client.send_buffer.get_metrics()
+        dropped = ", ".join(f"{name}: {count}" for name, count in metrics["dropped_messages"].items()) or "none"
+        print(f"{client.client_id} ({client.username}, {client.address}): {metrics['queued_messages']} messages "
+              f"({metrics['queued_bytes']} bytes) waiting, peak {metrics['peak_queued_bytes']} bytes, "
+              f"{metrics['messages_sent']} messages ({metrics['bytes_sent']} bytes) sent, dropped {dropped}")
+
+# region Metrics
+metrics.registry.gauge("server_connected_clients", "Clients connected.", lambda: len(clients_connected))
+metrics.registry.gauge("server_active_lobbies", "Lobbies open.", lambda: len(lobbies))
+metrics.registry.gauge("server_active_games", "Lobbies with a game running.",
+                       lambda: sum(lobby.current_game is not None for lobby in list(lobbies.values())))
+
+def print_stats():
+    print(f"Up for {time.time() - metrics.registry.start_time:.0f}s, {len(clients_connected)} clients connected, "
+          f"{len(lobbies)} lobbies, {sum(lobby.current_game is not None for lobby in list(lobbies.values()))} games")
+
+    print(f"{'message type':<36}{'sent':>10}{'bytes':>12}{'received':>10}{'bytes':>12}{'handled in (mean/p99)':>26}")
+    message_names = sorted({labels[0] for metric in (metrics.messages_sent, metrics.messages_received,
+                                                     metrics.process_message_seconds) for labels in list(metric.values)})
+    for message_name in message_names:
+        row = f"{message_name:<36}"
+        for counter in (metrics.messages_sent, metrics.bytes_sent, metrics.messages_received, metrics.bytes_received):
+            row += f"{counter.values.get((message_name,), 0):>{12 if 'bytes' in counter.name else 10}.0f}"
+        if (message_name,) in metrics.process_message_seconds.values:
+            _, mean, p99 = metrics.process_message_seconds.get_summary((message_name,))
+            row += f"{mean * 1000:>17.3f}ms/<{p99 * 1000:g}ms"
+        print(row)
+
+    for labels in list(metrics.tick_seconds.values):
+        count, mean, p99 = metrics.tick_seconds.get_summary(labels)
+        print(f"{labels[0]} ticks: {count}, mean {mean * 1000:.3f}ms, p99 <{p99 * 1000:g}ms")
+
+stats_dump_generation = 0
+"""Incremented by "stats dump stop", which stops every dump started before it."""
+
+def dump_stats(path: str, interval: float | None, generation: int):
+    """
+    Writes every metric to path in Prometheus' text format, then again every interval seconds if it isn't None, until
+    stats_dump_generation is no longer generation.
+    """
+    while generation == stats_dump_generation:
+        try:
+            metrics.registry.dump(path)
+        except OSError as err:
+            console_log.error(f"Error when attempting to write stats to {path}: {repr(err)}")
+            return
+        if interval is None:
+            return
+        time.sleep(interval)
+# endregion
+
+def set_log_verbosity(arguments: list[str]):
+    """
+    Handles the log console command:
+    \n"log <level>" sets the minimum level logged (debug, info, warning, error or off).
+    \n"log <message name> <level> [every]" sets the level sending or receiving that message type is logged at, and to only
+    log every nth one.
+    \n"log" on its own prints the current settings.
+    """
+    if not arguments:
+        print(f"Logging {console_log.level_names.get(console_log.minimum_level, console_log.minimum_level)} and above, "
+              f"message levels {console_log.message_levels}, sampling {console_log.message_sampling}, "
+              f"{console_log.dropped_lines} lines dropped")
+        return
+
+    level_text = arguments[0] if len(arguments) == 1 else arguments[1]
+    if (level := console_log.parse_level(level_text)) is None:
+        print(f"Invalid level: {level_text}")
+        return
+    if len(arguments) == 1:
+        console_log.minimum_level = level
+        return
+
+    message_name = arguments[0]
+    console_log.message_levels[message_name] = level
+    if len(arguments) > 2:
+        if not arguments[2].isdigit() or int(arguments[2]) < 1:
+            print(f"Invalid sampling: {arguments[2]}")
+            return
+        console_log.message_sampling[message_name] = int(arguments[2])
+    else:
+        console_log.message_sampling.pop(message_name, None)
+
 def console_commands():
+    global stats_dump_generation
     while True:
         inp = input("")
         if inp in ["k", "kill"]:
             break
+        elif inp in ["b", "buffers"]:
+            print_send_buffers()
+        elif inp == "stats":
+            print_stats()
+        elif inp.startswith("stats dump"):
+            # stats dump [path] [interval in seconds], or stats dump stop
+            arguments = inp.split()[2:]
+            if arguments == ["stop"]:
+                stats_dump_generation += 1
+                print("Stopped writing stats")
+                continue
+            path = arguments[0] if arguments else "server_stats.prom"
+            try:
+                interval = float(arguments[1]) if len(arguments) > 1 else None
+            except ValueError:
+                interval = 0
+            if interval is not None and not 0 < interval < float("inf"):
+                print(f"Invalid interval: {arguments[1]}")
+                continue
+            _thread.start_new_thread(dump_stats, (path, interval, stats_dump_generation))
+            print(f"Writing stats to {path}" + (f" every {interval:g}s" if interval else ""))
+        elif inp.startswith("log"):
+            set_log_verbosity(inp.split()[1:])
+        elif inp.startswith("record"):
+            # record [directory|off]
+            arguments = inp.split()[1:]
+            if arguments:
+                game_recording.recording_directory = None if arguments[0] == "off" else arguments[0]
+            if game_recording.recording_directory is None:
+                print("Not recording games")
+            else:
+                print(f"Recording games started from now on to {game_recording.recording_directory}")
 
 def listen_for_clients():
     def add_client():
-        print(f"Connected to {address}")
+        console_log.info(f"Connected to {address}")
 
-        client_id = 0
-        while client_id in clients_connected:
-            client_id += 1
-        clients_connected[client_id] = client = ConnectedClient(client_id, conn, address)
+        with client_id_lock:
+            client_id = 0
+            while client_id in clients_connected:
+                client_id += 1
+            clients_connected[client_id] = client = ConnectedClient(client_id, conn, address)
 
         try:
-            server.send(client, Messages.ConnectedMessage(address, client_id))
+            server.send(client, Messages.ConnectedMessage(address, client_id, server.udp_port, client.udp_token,
+                                                          server.compression))
 
-            connected_message = conn.recv(4096)
-            if not isinstance(pickle.loads(connected_message), Messages.ConnectedMessage):
+            received_data = io.BytesIO(conn.recv(4096))
+            connected_message = pickle.Unpickler(received_data).load()
+            if not isinstance(connected_message, Messages.ConnectedMessage):
                 raise TypeError("Connected message is not of type ConnectedMessage.")
         except Exception as err:
-            print(f"Got {repr(err)} when attempting to send/receive connected message from client. Disconnecting client.")
+            console_log.warning(f"Got {repr(err)} when attempting to send/receive connected message from client. Disconnecting client.")
+            client.send_buffer.close()
             del clients_connected[client.client_id]
             return
 
+        if server.compression is not None and getattr(connected_message, "compression", None) == server.compression:
+            client.frame_decoder = FrameDecoder()
+            client.send_buffer.frame_encoder = FrameEncoder()
+        client.connected = True
+
+        clients_listening_to.append(client.client_id)
+        # The client may have sent more after its ConnectedMessage, which would have been received with it
+        if remaining_data := received_data.read():
+            server.add_to_buffer(client, remaining_data)
+
         listen_to_client(client)
 
     while True:
@@ -417,4 +900,7 @@ def listen_for_clients():
 if __name__ == "__main__":
     server = Server()
     _thread.start_new_thread(listen_for_clients, ())
+    if server.datagram_socket:
+        _thread.start_new_thread(server.listen_for_datagrams, ())
     console_commands()
+    console_log.flush()
@@ -1,27 +1,203 @@
 from __future__ import annotations
+from abc import ABC, abstractmethod
 from typing import TYPE_CHECKING, Type, Callable
 import shared_assets
+from shared_assets import LockstepMessages, SnapshotMessages
 import time
+import _thread
+import pickle
+from collections import deque
+from snake_engine import SnakeSimulation
+import metrics
+import console_log
+import game_recording
+from game_recording import GameRecorder
 
 if TYPE_CHECKING:
     from server import Server, ConnectedClient
 
+class SnapshotEncoder:
+    def __init__(self, quantization: dict[str, float], measure_bytes: bool = False):
+        """
+        Encodes snapshots of a game's state for each client against the last snapshot that client acknowledged (see
+        shared_assets.SnapshotMessages), and can keep track of how many bytes that saves.
+        \nClients with the same baseline share one encoded Snapshot, so encoding costs per distinct baseline, not per
+        client.
+
+        :param quantization: Step to round each field to, by field name.
+        :param measure_bytes: Whether to pickle every snapshot encoded, and a full one, to measure their sizes for
+            get_bytes_report(). Doubles the pickling done per snapshot sent, so it's off for games.
+        """
+        self.quantization = quantization
+        self.measure_bytes = measure_bytes
+        self.snapshot_id = 0
+        self.history: dict[int, dict[str, any]] = {}
+        """The last SnapshotMessages.HISTORY quantized snapshots, by id."""
+        self.acked: dict[int, int] = {}
+        """Id of the latest snapshot each client has acknowledged, by client id."""
+        self._encoded: dict[int | None, SnapshotMessages.Snapshot] = {}
+        """The latest snapshot encoded against each baseline id (None for a full snapshot)."""
+        self._sizes: dict[int | None, int] = {}
+        """Size in bytes of each of _encoded once measured, by baseline id."""
+
+        self.snapshots_sent: dict[int, int] = {}
+        self.bytes_sent: dict[int, int] = {}
+        self.full_bytes: dict[int, int] = {}
+        """Bytes each client would have been sent if every snapshot was a full one, by client id. Only if measure_bytes."""
+
+    def add_snapshot(self, state: dict[str, any]):
+        self.snapshot_id += 1
+        self.history[self.snapshot_id] = SnapshotMessages.quantize(state, self.quantization)
+        self.history.pop(self.snapshot_id - SnapshotMessages.HISTORY, None)
+        self._encoded.clear()
+        self._sizes.clear()
+
+    def encode_for(self, client_id: int) -> SnapshotMessages.Snapshot:
+        """Returns the latest snapshot, encoded against the latest one the client has acknowledged that is still kept."""
+        baseline_id = self.acked.get(client_id)
+        if baseline_id not in self.history:
+            baseline_id = None
+
+        snapshot = self._encode(baseline_id)
+        self.snapshots_sent[client_id] = self.snapshots_sent.get(client_id, 0) + 1
+        if self.measure_bytes:
+            self.bytes_sent[client_id] = self.bytes_sent.get(client_id, 0) + self._get_size(baseline_id)
+            self.full_bytes[client_id] = self.full_bytes.get(client_id, 0) + self._get_size(None)
+        return snapshot
+
+    def on_ack(self, client_id: int, snapshot_id: int):
+        if snapshot_id > self.acked.get(client_id, 0):
+            self.acked[client_id] = snapshot_id
+
+    def remove_client(self, client_id: int):
+        for client_values in (self.acked, self.snapshots_sent, self.bytes_sent, self.full_bytes):
+            client_values.pop(client_id, None)
+
+    def get_bytes_report(self) -> dict[int, tuple[float, float]]:
+        """
+        Returns the average bytes sent per snapshot to each client, with and without deltas, by client id. Empty unless
+        measure_bytes is set.
+        """
+        if not self.measure_bytes:
+            return {}
+        return {client_id: (self.bytes_sent[client_id] / sent, self.full_bytes[client_id] / sent)
+                for client_id, sent in self.snapshots_sent.items()}
+
+    def _get_size(self, baseline_id: int | None) -> int:
+        if (size := self._sizes.get(baseline_id)) is None:
+            size = self._sizes[baseline_id] = \
+                len(pickle.dumps(shared_assets.Messages.GameDataMessage(self._encode(baseline_id))))
+        return size
+
+    def _encode(self, baseline_id: int | None) -> SnapshotMessages.Snapshot:
+        if (encoded := self._encoded.get(baseline_id)) is not None:
+            return encoded
+
+        state = self.history[self.snapshot_id]
+        if baseline_id is None:
+            snapshot = SnapshotMessages.Snapshot(self.snapshot_id, None, state)
+        else:
+            baseline = self.history[baseline_id]
+            snapshot = SnapshotMessages.Snapshot(
+                self.snapshot_id, baseline_id,
+                {field_name: value for field_name, value in state.items()
+                 if field_name not in baseline or baseline[field_name] != value},
+                tuple(field_name for field_name in baseline if field_name not in state))
+
+        self._encoded[baseline_id] = snapshot
+        return snapshot
+
 class GameServer:
     asset_class = shared_assets.GameAssets
     FPS: int | None = None
     """Amount of times per second this game server's on_frame() should be called. Leave 0 or None for never."""
+    SPECTATOR_SEND_RATE = 10
+    """Amount of times per second spectators are sent the game's state, if the game allows spectators."""
+    SPECTATOR_DELAY = 3
+    """Seconds behind the players that spectators see the game, so they can't tell players anything they can't see yet."""
 
     # region Private functions not to override
+    # The server calls these *_private entry points rather than the on_* functions directly, so everything is recorded
+    #  (see game_recording), in the order it is handled
     def call_on_frame(self):
         while self.seconds_per_frame and self.game_running:
             current_time = time.time()
             if current_time - self.time_of_last_frame >= 1 / self.FPS:
-                self.on_frame()
+                with metrics.tick_seconds.time(self.asset_class.game_id or "none"):
+                    with self.handling_lock:
+                        if self.game_running:
+                            self.record(game_recording.FRAME)
+                            self.on_frame_private()
                 self.time_of_last_frame = current_time
 
             time.sleep(self.seconds_per_frame / 5)
 
+    def call_send_to_spectators(self):
+        """
+        While the game runs, keeps get_spectator_state() SPECTATOR_SEND_RATE times a second, and sends each to every
+        spectator SPECTATOR_DELAY seconds after. Once the game is over, the rest are sent as they come due, then
+        spectators are told the game is over.
+        """
+        while self.game_running:
+            with self.handling_lock:
+                if self.game_running and (state := self.get_spectator_state()) is not None:
+                    self.spectator_states.append(
+                        (self.get_time(), SnapshotMessages.quantize(state, self.asset_class.snapshot_quantization)))
+            self.send_due_spectator_state()
+            time.sleep(1 / self.SPECTATOR_SEND_RATE)
+
+        while self.spectator_states and self.spectators:
+            time.sleep(max(0.0, self.spectator_states[0][0] + self.SPECTATOR_DELAY - self.get_time()))
+            self.send_due_spectator_state()
+        if spectators := self.spectators:
+            self.server.send_to_each(spectators, shared_assets.Messages.GameOverMessage())
+
+    def send_due_spectator_state(self):
+        """
+        Sends the newest kept state that is at least SPECTATOR_DELAY seconds old to every spectator, as a full snapshot
+        pickled once for all of them. Spectators don't acknowledge snapshots, so none are sent as deltas.
+        """
+        due_time = self.get_time() - self.SPECTATOR_DELAY
+        state = None
+        while self.spectator_states and self.spectator_states[0][0] <= due_time:
+            state = self.spectator_states.popleft()[1]
+        if state is None or not (spectators := self.spectators):
+            return
+        self.spectator_snapshot_id += 1
+        self.server.send_to_each(spectators, shared_assets.Messages.GameDataMessage(
+            SnapshotMessages.Snapshot(self.spectator_snapshot_id, None, state)))
+
+    def start_game_private(self):
+        with self.handling_lock:
+            self.record(game_recording.GAME_START)
+            self.on_game_start()
+
+    def receive_data_private(self, client_from: ConnectedClient, data):
+        with self.handling_lock:
+            self.record(game_recording.INPUT, client_from.client_id, data)
+            self.on_data_received_private(client_from, data)
+
+    def disconnect_client_private(self, client: ConnectedClient):
+        with self.handling_lock:
+            self.record(game_recording.DISCONNECT, client.client_id)
+            self.on_client_disconnect_private(client)
+
+    def transfer_host_private(self, client: ConnectedClient):
+        with self.handling_lock:
+            self.record(game_recording.HOST_TRANSFER, client.client_id)
+            self.host_client = client
+
+    def on_frame_private(self):
+        self.on_frame()
+
+    def on_data_received_private(self, client_from: ConnectedClient, data):
+        if isinstance(data, SnapshotMessages.Ack):
+            self.snapshot_encoder.on_ack(client_from.client_id, data.snapshot_id)
+        else:
+            self.on_data_received(client_from, data)
+
     def on_client_disconnect_private(self, client: ConnectedClient):
+        self.snapshot_encoder.remove_client(client.client_id)
         host_left = client.client_id == self.host_client.client_id
         self.clients = list(filter(lambda c: c.client_id != client.client_id, self.clients))
         if host_left:
@@ -31,18 +207,51 @@ class GameServer:
 
     # region Utility functions to call but not override
     def send_data(self, client: ConnectedClient | list[ConnectedClient], data):
+        if self.recorder:
+            for client_to in client if isinstance(client, list) else [client]:
+                self.record(game_recording.OUTPUT, client_to.client_id, data)
         self.server.send(client, shared_assets.Messages.GameDataMessage(data))
 
     def send_data_to_all(self, data):
         for client in self.clients:
             self.send_data(client, data)
 
+    def send_snapshot_to_all(self, state: dict[str, any]):
+        """
+        Sends a snapshot of the game's state to every client, as only the fields that changed since the last snapshot
+        each client received (see shared_assets.SnapshotMessages). Received with games.Game.on_snapshot().
+        """
+        self.snapshot_encoder.add_snapshot(state)
+        for client in self.clients:
+            self.send_data(client, self.snapshot_encoder.encode_for(client.client_id))
+
     def end_game(self):
-        self.game_running = False
+        self.stop()
         self._on_game_over()
         for client in self.clients:
             self.server.send(client, shared_assets.Messages.GameOverMessage())
 
+    def stop(self):
+        """Stops the game without telling its clients, as when they have all left."""
+        self.game_running = False
+        self.record(game_recording.END)
+
+    def add_spectator(self, client: ConnectedClient):
+        # Replaced rather than changed, so sending to the spectators never needs a lock
+        self.spectators = self.spectators + [client]
+
+    def remove_spectator(self, client: ConnectedClient):
+        self.spectators = [spectator for spectator in self.spectators if spectator.client_id != client.client_id]
+
+    def get_time(self) -> float:
+        """Returns the current time.time(). Games should use this for anything that affects them, so replays match."""
+        return time.time()
+
+    def record(self, kind: int, client_id: int | None = None, payload: any = None):
+        """Adds a record to this game's recording, if it is being recorded."""
+        if self.recorder:
+            self.recorder.record(kind, self.get_time(), client_id, payload)
+
     @property
     def host_client(self):
         return self._host_client
@@ -74,7 +283,25 @@ class GameServer:
         self.time_of_last_frame = 0
         self.seconds_per_frame = 1 / self.FPS if self.FPS else None
 
-        self.start_time = time.time()
+        self.start_time = self.get_time()
+        self.snapshot_encoder = SnapshotEncoder(self.asset_class.snapshot_quantization)
+
+        self.spectators: list[ConnectedClient] = []
+        """Clients watching the game. They aren't in clients, and aren't recorded, as nothing they do affects the game."""
+        self.spectator_states: deque[tuple[float, dict[str, any]]] = deque()
+        """(time kept, quantized state) of every spectator state not yet sent, oldest first."""
+        self.spectator_snapshot_id = 0
+
+        self.handling_lock = _thread.RLock()
+        """Held while handling anything, so it is recorded in the same order it is handled."""
+        self.recorder = GameRecorder.open_new(self.asset_class.game_id, self.start_time)
+        self.record(game_recording.START, payload={
+            "game_id": self.asset_class.game_id,
+            "settings": settings,
+            "start_time": self.start_time,
+            "clients": [(client.client_id, client.username) for client in clients],
+            "host_client_id": host_client.client_id
+        })
 
     def on_game_start(self):
         ...
@@ -89,27 +316,158 @@ class GameServer:
         ...
 
     def on_host_transfer(self, old_host: ConnectedClient):
-        print(f"host has been transferred from {old_host.username} to {self.host_client.username}")
+        console_log.info(f"Host has been transferred from {old_host.username} to {self.host_client.username}")
+
+    def get_spectator_state(self) -> dict[str, any] | None:
+        """
+        Returns a snapshot of the game's state for spectators (see shared_assets.SnapshotMessages), received with
+        games.Game.on_snapshot(). Nothing is sent if None. Must not return anything the game will change later, as it is
+        kept for SPECTATOR_DELAY seconds before it is sent.
+        """
+        return None
+    # endregion
+
+class LockstepGameServer(GameServer, ABC):
+    """
+    Base for deterministic games where only inputs are sent (see shared_assets.LockstepMessages). Every frame, the
+    inputs received since the last one are bundled into a Tick, applied to this server's own simulation, and sent to
+    every client to apply to theirs. Clients send a checksum of their state every CHECKSUM_INTERVAL ticks, which is
+    checked against the server's to detect desyncs.
+    \nSubclasses override create_simulation(). Their on_frame() is called after every tick.
+    """
+    CHECKSUM_INTERVAL = 20
+    CHECKSUM_HISTORY = 50
+    """Amount of checksums kept to check clients' against. Checksums from clients further behind than this are ignored."""
+
+    # region Private functions not to override
+    def on_frame_private(self):
+        with self.inputs_lock:
+            inputs, self.pending_inputs = self.pending_inputs, []
+        tick = LockstepMessages.Tick(self.tick + 1, inputs)
+        tick.apply_to(self.simulation)
+        self.tick = tick.tick
+
+        if self.tick % self.CHECKSUM_INTERVAL == 0:
+            self.state_hashes[self.tick] = self.simulation.get_state_hash()
+            self.state_hashes.pop(self.tick - self.CHECKSUM_INTERVAL * self.CHECKSUM_HISTORY, None)
+        self.send_data_to_all(tick)
+
+        self.on_frame()
+
+    def on_data_received_private(self, client_from: ConnectedClient, data):
+        if isinstance(data, LockstepMessages.Input):
+            with self.inputs_lock:
+                self.pending_inputs.append((client_from.client_id, data.input))
+        elif isinstance(data, LockstepMessages.Checksum):
+            state_hash = self.state_hashes.get(data.tick)
+            if state_hash is not None and state_hash != data.state_hash:
+                self.on_desync(client_from, data.tick)
+        else:
+            super().on_data_received_private(client_from, data)
+
+    def on_client_disconnect_private(self, client: ConnectedClient):
+        with self.inputs_lock:
+            self.pending_inputs.append((client.client_id, LockstepMessages.PlayerLeft()))
+        super().on_client_disconnect_private(client)
+    # endregion
+
+    # region Automatically called functions to override
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.seed = int(self.start_time)
+        self.simulation = self.create_simulation(self.seed)
+        self.tick = 0
+        self.pending_inputs: list[tuple[int, any]] = []
+        self.inputs_lock = _thread.allocate_lock()
+        self.state_hashes: dict[int, int] = {}
+        """The server's state hash at each of the last CHECKSUM_HISTORY checksum ticks."""
+
+        # Sent before call_on_frame starts, so clients can create their simulations before the first Tick
+        self.send_data_to_all(LockstepMessages.Start(self.seed, self.CHECKSUM_INTERVAL))
+
+    @abstractmethod
+    def create_simulation(self, seed: int):
+        """Returns a new simulation. games.LockstepGame.create_simulation() must return the same one on clients."""
+        ...
+
+    def on_desync(self, client: ConnectedClient, tick: int):
+        console_log.error(f"{client.username}'s game state at tick {tick} doesn't match the server's")
+        self.send_data(client, LockstepMessages.Desync(tick))
     # endregion
 
-class SnakeServer(GameServer):
+class SnakeServer(LockstepGameServer):
     asset_class = shared_assets.SnakeAssets
+    FPS = 10
+    GAME_OVER_DELAY = 3
+    """Seconds the final state is shown for before the game ends."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.time_of_game_over: float | None = None
+
+    def create_simulation(self, seed: int):
+        return SnakeSimulation(self.settings.settings["board_width"],
+                               self.settings.settings["board_height"],
+                               [client.client_id for client in self.clients],
+                               seed)
+
+    def on_frame(self):
+        if self.time_of_game_over is None:
+            if self.simulation.is_over:
+                self.time_of_game_over = self.get_time()
+        elif self.get_time() - self.time_of_game_over >= self.GAME_OVER_DELAY:
+            self.end_game()
+
+    def get_spectator_state(self) -> dict[str, any]:
+        return {"tick": self.simulation.tick, "board": bytes(self.simulation.board)}
 
 class PongServer(GameServer):
     asset_class = shared_assets.PongAssets
 
+    def __init__(self, *args):
+        super().__init__(*args)
+        # The ball and paddles are moved by the players' games, so only what they send is kept, for spectators
+        self.paddle_ys: dict[int, float] = {}
+        """The y position each player last sent for their paddle, by client id."""
+        self.ball_hits = 0
+        self.last_ball_hit: tuple[int, shared_assets.PongAssets.Messages.BallHit, float] | None = None
+        """(client id of the player it was sent by or to, BallHit, time) of the latest BallHit."""
+
     def on_game_start(self):
         for i, client in enumerate(self.clients):
             horizontal_dir = i * 2 - 1
-            self.send_data(client, self.asset_class.Messages.BallHit(None, (horizontal_dir * 6, 6)))
+            ball_hit = self.asset_class.Messages.BallHit(None, (horizontal_dir * 6, 6))
+            self.send_data(client, ball_hit)
+            if i == 0:
+                self.on_ball_hit(client, ball_hit)
 
     def on_data_received(self, client_from: ConnectedClient, data):
-        if isinstance(data, self.asset_class.Messages.BallHit):
-            print("got data")
         if isinstance(data, (self.asset_class.Messages.BallHit, self.asset_class.Messages.PaddleMove)):
             for client in self.clients:
                 if client.client_id != client_from.client_id:
                     self.send_data(client, data)
+        if isinstance(data, self.asset_class.Messages.BallHit):
+            self.on_ball_hit(client_from, data)
+        elif isinstance(data, self.asset_class.Messages.PaddleMove):
+            self.paddle_ys[client_from.client_id] = data.paddle_y
+
+    def on_ball_hit(self, client: ConnectedClient, ball_hit: shared_assets.PongAssets.Messages.BallHit):
+        self.ball_hits += 1
+        self.last_ball_hit = (client.client_id, ball_hit, self.get_time())
+
+    def get_spectator_state(self) -> dict[str, any] | None:
+        if self.last_ball_hit is None:
+            return None
+        client_id, ball_hit, time_of_hit = self.last_ball_hit
+        # Positions are as seen by the player they came from. games.PongGame turns them around for the other player.
+        return {
+            "paddle_ys": tuple(self.paddle_ys.items()),
+            "ball_hits": self.ball_hits,
+            "ball_hit_by": client_id,
+            "ball_pos": ball_hit.ball_pos,
+            "ball_vel": ball_hit.ball_vel,
+            "ball_age": self.get_time() - time_of_hit
+        }
 
 
 game_servers: list[Type[GameServer]] = [GameServer, SnakeServer, PongServer]
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import console_log
 
 port = 5555
 
@@ -16,7 +17,9 @@ class Messages:
                      max_players: int | None = None,
                      private: int | None = None,
                      chat: list[str] | None = None,
-                     game_settings=None):
+                     game_settings=None,
+                     in_game: bool | None = None,
+                     spectators: list[tuple[str, int]] | None = None):
             self.lobby_id = lobby_id
             self.lobby_title = lobby_title
             self.host = host
@@ -26,21 +29,41 @@ class Messages:
             self.private = private
             self.chat = chat
             self.game_settings = game_settings
+            self.in_game = in_game
+            self.spectators = spectators
+            """(username, client id) of everyone watching the lobby's game. Spectators don't count towards max_players."""
     # endregion
 
     # region Base message type
     class Message:
         name = "default_message"
-        notify_to_console = True
+        log_level = console_log.INFO
+        """Level messages of this type are logged at when sent or received. Overridden by console_log.message_levels."""
+        droppable = False
+        """Whether newer messages of the same type supersede this one, so it may be sent unreliably."""
+
+        @property
+        def type_key(self) -> str:
+            """Messages with the same type_key are of the same type, for whether one supersedes another."""
+            return self.name
     # endregion
 
     # region General server related messages
     class ConnectedMessage(Message):
         name = "connected"
 
-        def __init__(self, address, client_id):
+        def __init__(self, address, client_id, udp_port: int | None = None, udp_token: bytes | None = None,
+                     compression: str | None = None):
             self.address = address
             self.client_id = client_id
+            self.udp_port = udp_port
+            """Port of the server's UDP channel for game data, or None if it doesn't have one (see datagram_channel)."""
+            self.udp_token = udp_token
+            self.compression = compression
+            """
+            Compression the server offers, or that the client accepts by sending it back. Once accepted, everything
+            after the handshake is sent in frame_compression frames.
+            """
 
     class DisconnectMessage(Message):
         name = "disconnect"
@@ -50,7 +73,7 @@ class Messages:
 
     class CheckConnectionMessage(Message):
         name = "check_connection"
-        notify_to_console = False
+        log_level = console_log.DEBUG
     # endregion
 
     # region Multiplayer menu related messages
@@ -59,6 +82,7 @@ class Messages:
 
     class LobbyListMessage(Message):
         name = "lobby_list_info"
+        droppable = True
 
         def __init__(self, lobbies: list[Messages.LobbyInfo]):
             self.lobbies = lobbies
@@ -75,9 +99,11 @@ class Messages:
     class JoinLobbyMessage(Message):
         name = "join_lobby"
 
-        def __init__(self, lobby_id, username):
+        def __init__(self, lobby_id, username, spectate: bool = False):
             self.lobby_id = lobby_id
             self.username = username
+            self.spectate = spectate
+            """Whether to watch the lobby's running game, rather than join the lobby as a player."""
 
     # endregion
 
@@ -133,10 +159,14 @@ class Messages:
     class GameStartedMessage(Message):
         name = "game_started_message"
 
-        def __init__(self, clients, host_client, game_id=None):
+        def __init__(self, clients, host_client, game_id=None, spectating: bool = False, settings=None):
             self.clients = clients
             self.host_client = host_client
             self.game_id = game_id
+            self.spectating = spectating
+            """Whether this is sent to a spectator joining a running game, rather than to the game's players."""
+            self.settings = settings
+            """The game's settings, for spectators, who weren't in the lobby to be sent them."""
 
     class GameInitializedMessage(Message):
         name = "game_initialized_message"
@@ -145,11 +175,20 @@ class Messages:
     # region Game related messages
     class GameDataMessage(Message):
         name = "game_data_message"
-        notify_to_console = False
+        log_level = console_log.DEBUG
 
         def __init__(self, data):
             self.data = data
 
+        @property
+        def droppable(self):
+            return getattr(self.data, "droppable", False)
+
+        @property
+        def type_key(self) -> str:
+            # Game data of different classes doesn't supersede each other
+            return f"{self.name}.{type(self.data).__qualname__}"
+
     class GameOverMessage(Message):
         name = "game_over_message"
     # endregion
@@ -157,7 +196,7 @@ class Messages:
     # region Other messages
     class ErrorMessage(Message):
         name = "error"
-        notify_to_console = False
+        log_level = console_log.DEBUG
 
         def __init__(self, error=None):
             self.error = error
@@ -177,6 +216,10 @@ class InputTypeIDs:
 
 class GameAssets:
     game_id = None
+    snapshot_quantization: dict[str, float] = {}
+    """Step to round each snapshot field to before sending, by field name (see SnapshotMessages)."""
+    allow_spectators = False
+    """Whether running games can be watched. Spectators are sent the server's get_spectator_state() as snapshots."""
 
     class Settings:
         # "setting_name": ("InputTypes.INPUT_TYPE", default_value)
@@ -194,8 +237,112 @@ class GameAssets:
         def set_setting(self, setting_name, new_value):
             self.settings[setting_name] = new_value
 
-class SnakeAssets:
+class LockstepMessages:
+    """
+    Game data sent between games.LockstepGame and server_assets.LockstepGameServer. Only players' inputs are sent; the
+    server and every client run the same deterministic simulation, stepping it once for every Tick the server sends.
+    \nA simulation must have apply_input(player_id, input), remove_player(player_id), step() and get_state_hash() -> int,
+    and must step through exactly the same states given the same seed and Ticks.
+    """
+
+    class Start:
+        def __init__(self, seed: int, checksum_interval: int):
+            self.seed = seed
+            self.checksum_interval = checksum_interval
+
+    class Input:
+        def __init__(self, input):
+            self.input = input
+
+    class PlayerLeft:
+        ...
+
+    class Tick:
+        def __init__(self, tick: int, inputs: list[tuple[int, any]]):
+            self.tick = tick
+            self.inputs = inputs
+            """(player id, input) of every input to apply before stepping, in order. An input may be a PlayerLeft."""
+
+        def apply_to(self, simulation):
+            """Applies this tick's inputs to the simulation, then steps it. Used by both the server and clients."""
+            for player_id, player_input in self.inputs:
+                if isinstance(player_input, LockstepMessages.PlayerLeft):
+                    simulation.remove_player(player_id)
+                else:
+                    simulation.apply_input(player_id, player_input)
+            simulation.step()
+
+    class Checksum:
+        def __init__(self, tick: int, state_hash: int):
+            self.tick = tick
+            self.state_hash = state_hash
+
+    class Desync:
+        def __init__(self, tick: int):
+            self.tick = tick
+
+class SnapshotMessages:
+    """
+    Game state sent by server_assets.GameServer.send_snapshot_to_all() and received by games.Game.on_snapshot(). A
+    snapshot is a dict of field name to value. Clients acknowledge every snapshot they receive, and are only sent the
+    fields that changed since the last one they acknowledged, or every field if the server no longer has it (e.g. after
+    loss, or on joining).
+    \nFields in the game's snapshot_quantization are sent as whole multiples of their step, and must be numbers or
+    sequences of numbers. Every other field is sent as is.
+    """
+    HISTORY = 32
+    """Amount of recent snapshots the server and clients keep to use as baselines."""
+
+    class Snapshot:
+        droppable = True
+
+        def __init__(self, snapshot_id: int, baseline_id: int | None, changed: dict[str, any], removed: tuple = ()):
+            self.snapshot_id = snapshot_id
+            self.baseline_id = baseline_id
+            """Id of the snapshot this one only has the changes from, or None if this is a full snapshot."""
+            self.changed = changed
+            self.removed = removed
+
+        def __reduce__(self):
+            # Pickled without attribute names, as snapshots are sent every tick
+            return SnapshotMessages.Snapshot, (self.snapshot_id, self.baseline_id, self.changed, self.removed)
+
+        def apply_to(self, baseline: dict[str, any] | None) -> dict[str, any]:
+            """Returns the (still quantized) state this snapshot describes, given the state of its baseline."""
+            if self.baseline_id is None:
+                return dict(self.changed)
+            state = {**baseline, **self.changed}
+            for field_name in self.removed:
+                del state[field_name]
+            return state
+
+    class Ack:
+        droppable = True
+
+        def __init__(self, snapshot_id: int):
+            self.snapshot_id = snapshot_id
+
+    @staticmethod
+    def quantize(state: dict[str, any], quantization: dict[str, float]) -> dict[str, any]:
+        quantized = dict(state)
+        for field_name, step in quantization.items():
+            if (value := state.get(field_name)) is not None:
+                quantized[field_name] = round(value / step) if isinstance(value, (int, float)) else \
+                    tuple(round(component / step) for component in value)
+        return quantized
+
+    @staticmethod
+    def dequantize(state: dict[str, any], quantization: dict[str, float]) -> dict[str, any]:
+        dequantized = dict(state)
+        for field_name, step in quantization.items():
+            if (value := state.get(field_name)) is not None:
+                dequantized[field_name] = value * step if isinstance(value, int) else \
+                    tuple(component * step for component in value)
+        return dequantized
+
+class SnakeAssets(GameAssets):
     game_id = "snake"
+    allow_spectators = True
 
     class Settings(GameAssets.Settings):
         setting_info_list = {
@@ -205,8 +352,9 @@ class SnakeAssets:
             "board_height": ("Height of Board:", InputTypeIDs.NUMBER_INPUT, 15, {"min_number": 5, "max_number": 30})
         }
 
-class PongAssets:
+class PongAssets(GameAssets):
     game_id = "pong"
+    allow_spectators = True
 
     class Settings(GameAssets.Settings):
         setting_info_list = {
@@ -221,6 +369,8 @@ class PongAssets:
                 self.ball_vel = ball_vel
 
         class PaddleMove:
+            droppable = True
+
             def __init__(self, paddle_y):
                 self.paddle_y = paddle_y
 
@@ -0,0 +1,215 @@
+from __future__ import annotations
+from array import array
+from typing import Sequence
+import zlib
+
+# region Cell values
+EMPTY = 0
+FOOD = 1
+FIRST_SNAKE = 2
+"""Cells taken by a snake store FIRST_SNAKE + the snake's index."""
+# endregion
+
+# region Directions
+UP = 0
+RIGHT = 1
+DOWN = 2
+LEFT = 3
+DIRECTION_OFFSETS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+"""(x, y) offset of each direction, indexed by direction."""
+# endregion
+
+class Snake:
+    def __init__(self, index: int, player_id: int, capacity: int):
+        """
+        A snake's body, stored as a ring buffer of cell indices so moving and growing never shift the whole body.
+
+        :param index: This snake's index in SnakeSimulation.snakes.
+        :param player_id: The client id of the player controlling this snake.
+        :param capacity: The most cells this snake can take up (the amount of cells on the board).
+        """
+        self.index = index
+        self.player_id = player_id
+        self.cell_value = FIRST_SNAKE + index
+        self.body = array("H", bytes(2 * capacity))
+        self.head = -1
+        """Position in body of the head's cell."""
+        self.length = 0
+        self.direction = RIGHT
+        self.next_direction = RIGHT
+        """The direction this snake will move in next tick."""
+        self.alive = True
+        self.score = 0
+
+    @property
+    def head_cell(self) -> int:
+        return self.body[self.head]
+
+    @property
+    def tail_cell(self) -> int:
+        return self.body[(self.head - self.length + 1) % len(self.body)]
+
+    @property
+    def cells(self) -> list[int]:
+        """The cells this snake takes up, from tail to head."""
+        capacity = len(self.body)
+        return [self.body[(self.head - i) % capacity] for i in range(self.length - 1, -1, -1)]
+
+    def push_head(self, cell: int):
+        self.head = (self.head + 1) % len(self.body)
+        self.body[self.head] = cell
+        self.length += 1
+
+    def pop_tail(self) -> int:
+        cell = self.tail_cell
+        self.length -= 1
+        return cell
+
+class SnakeSimulation:
+    START_LENGTH = 3
+
+    def __init__(self, width: int, height: int, player_ids: Sequence[int], seed: int, food_count: int = 1):
+        """
+        Deterministic simulation of a game of Snake. Given the same settings, seed and inputs in the same order, every
+        instance steps through exactly the same states, so the server and clients can all run it.
+        \nThe board is a flat bytearray of cell values (EMPTY, FOOD, or FIRST_SNAKE + a snake's index), indexed by
+        y * width + x. Moving, growing and collision checks are all constant time per snake per tick.
+
+        :param width: Width of the board, in cells. Must be at least 5.
+        :param height: Height of the board, in cells. Must be at least the amount of players + 1.
+        :param player_ids: The client ids of the players. Each gets a snake, ordered by id.
+        :param seed: Seed for food placement.
+        :param food_count: Amount of food on the board at once.
+        """
+        if width < 5 or height < len(player_ids) + 1:
+            raise ValueError(f"Board ({width}x{height}) is too small for {len(player_ids)} players")
+        self.width = width
+        self.height = height
+        self.board = bytearray(width * height)
+        self.tick = 0
+        self.rng_state = (seed * 2654435761 + 1) & 0xFFFFFFFF or 1
+
+        self.snakes = [Snake(i, player_id, width * height) for i, player_id in enumerate(sorted(player_ids))]
+        self.snakes_by_player_id = {snake.player_id: snake for snake in self.snakes}
+
+        # Snakes start on separate rows, alternating between starting on the left going right and the right going left
+        for snake in self.snakes:
+            y = (snake.index + 1) * height // (len(self.snakes) + 1)
+            going_right = snake.index % 2 == 0
+            snake.direction = snake.next_direction = RIGHT if going_right else LEFT
+            for i in range(self.START_LENGTH):
+                x = 1 + i if going_right else width - 2 - i
+                snake.push_head(y * width + x)
+                self.board[y * width + x] = snake.cell_value
+
+        for _ in range(food_count):
+            self.place_food()
+
+    @property
+    def alive_snakes(self) -> list[Snake]:
+        return [snake for snake in self.snakes if snake.alive]
+
+    @property
+    def is_over(self) -> bool:
+        """Whether at most one snake is left alive (or none, in a single player game)."""
+        return len(self.alive_snakes) <= (1 if len(self.snakes) > 1 else 0)
+
+    @property
+    def winner(self) -> Snake | None:
+        """The last snake alive once the game is over, or None if there isn't one."""
+        alive_snakes = self.alive_snakes
+        return alive_snakes[0] if self.is_over and alive_snakes else None
+
+    def next_random(self) -> int:
+        """Returns the next number from this simulation's xorshift generator, the same on every platform."""
+        x = self.rng_state
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self.rng_state = x
+        return x
+
+    def place_food(self):
+        """Puts food on a random empty cell. Does nothing if the board is full."""
+        cell_count = len(self.board)
+        start = self.next_random() % cell_count
+        empty_cell = self.board.find(EMPTY, start)
+        if empty_cell == -1:
+            empty_cell = self.board.find(EMPTY, 0, start)
+        if empty_cell != -1:
+            self.board[empty_cell] = FOOD
+
+    def set_direction(self, player_id: int, direction: int):
+        """Sets the direction a player's snake moves in next tick. Turning straight back into itself is ignored."""
+        snake = self.snakes_by_player_id.get(player_id)
+        if snake is not None and snake.alive and direction in (UP, RIGHT, DOWN, LEFT) and \
+                direction != (snake.direction + 2) % 4:
+            snake.next_direction = direction
+
+    def apply_input(self, player_id: int, direction: int):
+        """Lockstep input (see shared_assets.LockstepMessages): the direction a player changed to."""
+        self.set_direction(player_id, direction)
+
+    def remove_player(self, player_id: int):
+        """Removes a player's snake from the board, e.g. when they leave the game."""
+        snake = self.snakes_by_player_id.get(player_id)
+        if snake is not None and snake.alive:
+            self.remove_snake(snake)
+
+    def remove_snake(self, snake: Snake):
+        snake.alive = False
+        for cell in snake.cells:
+            self.board[cell] = EMPTY
+        snake.length = 0
+
+    def get_state_hash(self) -> int:
+        """Returns a checksum of everything that affects future ticks, to check two simulations are in the same state."""
+        state = array("I", (self.tick, self.rng_state))
+        for snake in self.snakes:
+            state.extend((snake.alive, snake.direction, snake.next_direction, snake.score, snake.length,
+                          snake.head_cell if snake.length else 0))
+        return zlib.crc32(state.tobytes(), zlib.crc32(self.board))
+
+    def step(self):
+        """
+        Advances the simulation by one tick. Every snake moves at the same time: tails move first, so a snake can move
+        into a cell a tail just left. A snake dies if it hits a wall or another snake, and snakes that move into the
+        same cell both die.
+        """
+        if self.is_over:
+            return
+        self.tick += 1
+        board, width, height = self.board, self.width, self.height
+
+        snakes = self.alive_snakes
+        new_heads: list[int] = []
+        eating: list[bool] = []
+        for snake in snakes:
+            snake.direction = snake.next_direction
+            head = snake.head_cell
+            offset_x, offset_y = DIRECTION_OFFSETS[snake.direction]
+            x, y = head % width + offset_x, head // width + offset_y
+            new_head = y * width + x if 0 <= x < width and 0 <= y < height else -1
+            new_heads.append(new_head)
+            eating.append(new_head != -1 and board[new_head] == FOOD)
+
+        for snake, snake_eating in zip(snakes, eating):
+            if not snake_eating:
+                board[snake.pop_tail()] = EMPTY
+
+        food_eaten = 0
+        dying = []
+        for i, (snake, new_head) in enumerate(zip(snakes, new_heads)):
+            if new_head == -1 or board[new_head] > FOOD or new_head in new_heads[:i] or new_head in new_heads[i + 1:]:
+                dying.append(snake)
+                continue
+            snake.push_head(new_head)
+            board[new_head] = snake.cell_value
+            if eating[i]:
+                snake.score += 1
+                food_eaten += 1
+
+        for snake in dying:
+            self.remove_snake(snake)
+        for _ in range(food_eaten):
+            self.place_food()
@@ -0,0 +1,170 @@
+from __future__ import annotations
+from typing import Hashable, Iterator
+import math
+
+class SpatialHash:
+    def __init__(self, cell_size: float):
+        """
+        Uniform grid broad phase for finding which axis aligned boxes are near each other, without checking every pair.
+        Boxes are stored by key (any hashable, e.g. an entity or its id), and are added to every cell they touch.
+        \nCollision results match utilities.Colliding: boxes only collide if they overlap, not if they just touch.
+        Usable on both the client (games.Game) and the server (server_assets.GameServer).
+
+        :param cell_size: Width and height of each cell. Works best at around the size of a typical box; much smaller
+         means boxes are in a lot of cells, and much bigger means a lot of boxes are in each cell.
+        """
+        if cell_size <= 0:
+            raise ValueError(f"Cell size ({cell_size}) must be positive")
+        self.cell_size = cell_size
+        self.cells: dict[tuple[int, int], set[Hashable]] = {}
+        self.boxes: dict[Hashable, tuple[float, float, float, float]] = {}
+        """The (x, y, width, height) of every box, by key."""
+        self._cell_ranges: dict[Hashable, tuple[int, int, int, int]] = {}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, key: Hashable):
+        return key in self.boxes
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.boxes)
+
+    def get_cell_range(self, x: float, y: float, w: float, h: float) -> tuple[int, int, int, int]:
+        """Returns the first and last x and y (inclusive) of the cells a box touches."""
+        cell_size = self.cell_size
+        return (math.floor(x / cell_size), math.floor(y / cell_size),
+                math.floor((x + w) / cell_size), math.floor((y + h) / cell_size))
+
+    def insert(self, key: Hashable, pos, size):
+        """
+        Adds a box. Raises KeyError if a box with the same key has already been added.
+
+        :param pos: The (x, y) of the top left of the box.
+        :param size: The (width, height) of the box.
+        """
+        if key in self.boxes:
+            raise KeyError(f"{key} is already in this SpatialHash")
+        box = self.boxes[key] = (pos[0], pos[1], size[0], size[1])
+        cell_range = self._cell_ranges[key] = self.get_cell_range(*box)
+        self._add_to_cells(key, cell_range)
+
+    def move(self, key: Hashable, pos, size=None):
+        """
+        Changes the position (and optionally the size) of a box. Cheap if the box stays within the same cells.
+
+        :param size: The new (width, height) of the box. Leave None to keep its current size.
+        """
+        x, y, w, h = self.boxes[key]
+        if size is not None:
+            w, h = size[0], size[1]
+        box = self.boxes[key] = (pos[0], pos[1], w, h)
+
+        cell_range = self.get_cell_range(*box)
+        if cell_range != self._cell_ranges[key]:
+            self._remove_from_cells(key, self._cell_ranges[key])
+            self._add_to_cells(key, cell_range)
+            self._cell_ranges[key] = cell_range
+
+    def remove(self, key: Hashable):
+        """Removes a box. Raises KeyError if there is no box with this key."""
+        del self.boxes[key]
+        self._remove_from_cells(key, self._cell_ranges.pop(key))
+
+    def clear(self):
+        self.cells.clear()
+        self.boxes.clear()
+        self._cell_ranges.clear()
+
+    # region Queries
+    def get_nearby(self, pos, size) -> set[Hashable]:
+        """Returns the keys of every box in the cells the given box touches. Broad phase only, so may include boxes that don't collide with it."""
+        min_x, min_y, max_x, max_y = self.get_cell_range(pos[0], pos[1], size[0], size[1])
+        nearby = set()
+        cells = self.cells
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                if (cell := cells.get((cell_x, cell_y))) is not None:
+                    nearby |= cell
+        return nearby
+
+    def query(self, pos, size) -> set[Hashable]:
+        """Returns the keys of every box that collides with the given box."""
+        x, y, w, h = pos[0], pos[1], size[0], size[1]
+        boxes = self.boxes
+        colliding = set()
+        for key in self.get_nearby(pos, size):
+            other_x, other_y, other_w, other_h = boxes[key]
+            if x + w > other_x > x - other_w and y + h > other_y > y - other_h:
+                colliding.add(key)
+        return colliding
+
+    def query_point(self, pos) -> set[Hashable]:
+        """Returns the keys of every box the point is inside of (or on the edge of)."""
+        x, y = pos[0], pos[1]
+        colliding = set()
+        cell = self.cells.get((math.floor(x / self.cell_size), math.floor(y / self.cell_size)), ())
+        for key in cell:
+            box_x, box_y, box_w, box_h = self.boxes[key]
+            if box_x <= x <= box_x + box_w and box_y <= y <= box_y + box_h:
+                colliding.add(key)
+        return colliding
+
+    def query_circle(self, pos, rad: float) -> set[Hashable]:
+        """Returns the keys of every box that collides with the circle."""
+        x, y = pos[0], pos[1]
+        colliding = set()
+        for key in self.get_nearby((x - rad, y - rad), (rad * 2, rad * 2)):
+            box_x, box_y, box_w, box_h = self.boxes[key]
+            dx = x - min(max(x, box_x), box_x + box_w)
+            dy = y - min(max(y, box_y), box_y + box_h)
+            if (dx * dx + dy * dy < rad * rad) if rad > 0 else (rad == 0 and dx == 0 and dy == 0):
+                colliding.add(key)
+        return colliding
+
+    def get_neighbors(self, key: Hashable) -> set[Hashable]:
+        """Returns the keys of every other box that collides with the box with this key."""
+        x, y, w, h = self.boxes[key]
+        neighbors = self.query((x, y), (w, h))
+        neighbors.discard(key)
+        return neighbors
+
+    def get_colliding_pairs(self) -> list[tuple[Hashable, Hashable]]:
+        """Returns every pair of boxes that collide with each other, each pair only once."""
+        boxes, cell_ranges = self.boxes, self._cell_ranges
+        pairs = []
+        for (cell_x, cell_y), cell in self.cells.items():
+            if len(cell) < 2:
+                continue
+            cell_keys = list(cell)
+            for i, key in enumerate(cell_keys):
+                x, y, w, h = boxes[key]
+                min_x, min_y = cell_ranges[key][:2]
+                for other_key in cell_keys[i + 1:]:
+                    other_x, other_y, other_w, other_h = boxes[other_key]
+                    if x + w > other_x > x - other_w and y + h > other_y > y - other_h:
+                        # Boxes that share more than one cell are only counted in the top left cell they share
+                        other_min_x, other_min_y = cell_ranges[other_key][:2]
+                        if max(min_x, other_min_x) == cell_x and max(min_y, other_min_y) == cell_y:
+                            pairs.append((key, other_key))
+        return pairs
+    # endregion
+
+    def _add_to_cells(self, key: Hashable, cell_range: tuple[int, int, int, int]):
+        min_x, min_y, max_x, max_y = cell_range
+        cells = self.cells
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                if (cell := cells.get((cell_x, cell_y))) is None:
+                    cell = cells[cell_x, cell_y] = set()
+                cell.add(key)
+
+    def _remove_from_cells(self, key: Hashable, cell_range: tuple[int, int, int, int]):
+        min_x, min_y, max_x, max_y = cell_range
+        cells = self.cells
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                cell = cells[cell_x, cell_y]
+                cell.discard(key)
+                if not cell:
+                    del cells[cell_x, cell_y]